@@ -27,42 +27,13 @@ Init script for module sat2rf1_tcpserver
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-import sys
-
-import yaml
-
-"""
-Config
-"""
-
-with open("config.yaml", 'r') as stream:
-    try:
-        config = yaml.safe_load(stream)
-    except yaml.YAMLError as exc:
-        logging.error('Error in configuration file: %s', exc)
 
 """
 Logging
-"""
-
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
-"""
-Log to file
+Modules log through this logger. Importing the package does not set up any
+handlers or read any configuration; the gateway does so on start, see
+logs.setup_logging() and config.load().
 """
 
-file_handler = logging.FileHandler(config['logging']['file_path'])
-file_formatter = logging.Formatter(config['logging']['file_format'])
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
-
-"""
-Log to console
-"""
-
-if config['logging']['log_to_console']:
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_formatter = logging.Formatter(config['logging']['console_format'])
-    stream_handler.setFormatter(stream_formatter)
-    logger.addHandler(stream_handler)
+logger = logging.getLogger()
@@ -23,11 +23,23 @@ Entry point for module sat2rf1_tcpserver
 #
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+
 from sat2rf1_tcpserver import logger
-from sat2rf1_tcpserver.core import main
 
 if __name__ == '__main__':
     try:
-        main()
+        if sys.argv[1:2] == ['bench']:
+            from sat2rf1_tcpserver.bench import main as bench
+
+            bench(sys.argv[2:])
+        elif sys.argv[1:2] == ['replay']:
+            from sat2rf1_tcpserver.replay import main as replay
+
+            replay(sys.argv[2:])
+        else:
+            from sat2rf1_tcpserver.core import main
+
+            main(sys.argv[1:])
     except KeyboardInterrupt:
         logger.info("Process terminated by user. Bye!")
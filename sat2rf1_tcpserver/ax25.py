@@ -0,0 +1,117 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+
+"""
+Length of an address in the address field: six callsign characters, each
+shifted left by one bit, and the SSID byte.
+"""
+ADDRESS_LENGTH = 7
+
+"""
+Most addresses in an address field: destination, source and eight digipeaters.
+"""
+MAX_ADDRESSES = 10
+
+"""
+Control field of a UI frame, without the poll/final bit, and the PID of
+frames without a layer 3 protocol.
+"""
+UI_CONTROL = 0x03
+NO_LAYER_3 = 0xF0
+
+"""
+Shifts every byte right by one bit, for decoding all callsigns of an
+address field in a single bytes.translate().
+"""
+_UNSHIFT = bytes(byte >> 1 for byte in range(256))
+
+"""
+The parts of an AX.25 header. Callsigns are str, SSIDs int. digipeaters is
+a tuple of (callsign, ssid). pid is None for frames without a PID field.
+info_offset is where the information field starts in the frame.
+"""
+Header = collections.namedtuple('Header', ['destination', 'destination_ssid', 'source', 'source_ssid',
+                                           'digipeaters', 'control', 'pid', 'info_offset'])
+
+
+def parse(frame):
+    """
+    Parses the address, control and PID fields of an AX.25 frame, as
+    delivered by a KISS TNC (no flags or FCS).
+
+    :param frame: Bytes-like frame.
+    :return: Header
+    """
+    # The last address has the extension bit set.
+    end = ADDRESS_LENGTH - 1
+    limit = min(len(frame), ADDRESS_LENGTH * MAX_ADDRESSES)
+    while end < limit and not frame[end] & 1:
+        end += ADDRESS_LENGTH
+    if end >= limit or end < 2 * ADDRESS_LENGTH - 1:
+        raise AX25Error('No valid address field in {} byte frame'.format(len(frame)))
+    end += 1
+    if end >= len(frame):
+        raise AX25Error('No control field in {} byte frame'.format(len(frame)))
+
+    text = bytes(frame[:end]).translate(_UNSHIFT)
+    addresses = [(text[i:i + 6].rstrip(b' ').decode('ascii', errors='replace'), (frame[i + 6] >> 1) & 0x0F)
+                 for i in range(0, end, ADDRESS_LENGTH)]
+
+    control = frame[end]
+    pid = None
+    info_offset = end + 1
+    # Information (I) and UI frames carry a PID.
+    if not control & 0x01 or control & 0xEF == UI_CONTROL:
+        if info_offset >= len(frame):
+            raise AX25Error('No PID field in {} byte frame'.format(len(frame)))
+        pid = frame[info_offset]
+        info_offset += 1
+    return Header(addresses[0][0], addresses[0][1], addresses[1][0], addresses[1][1], tuple(addresses[2:]),
+                  control, pid, info_offset)
+
+
+def format_address(callsign, ssid):
+    """
+    Returns callsign-ssid as usually written, or only callsign if ssid is 0.
+    """
+    return '{}-{}'.format(callsign, ssid) if ssid else callsign
+
+
+def format_header(header):
+    """
+    Returns the addresses of a header as text, e.g. LA1NGS-1>CQ,WIDE1-1.
+    """
+    path = [format_address(header.destination, header.destination_ssid)]
+    path += [format_address(callsign, ssid) for callsign, ssid in header.digipeaters]
+    return '{}>{}'.format(format_address(header.source, header.source_ssid), ','.join(path))
+
+
+class AX25Error(Exception):
+    """AX.25 Error."""
+    pass
@@ -0,0 +1,391 @@
+"""
+Benchmarks for the KISS codec, the frame decoder, the data socket and the
+whole gateway, run with: python -m sat2rf1_tcpserver bench
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tty
+
+from sat2rf1_tcpserver import logger
+from .connection import Connection
+from .framing import framer_factory
+from .kiss import Kiss, KissDecoder
+from .kiss_constants import FEND, FESC, DATA_FRAME
+from .simulator import RadioSimulator, DOWNLINK_HEADER
+from .utils import escape_special_codes, recover_special_codes
+
+"""
+Every benchmark returns a flat dict of numbers, so results from two commits
+can be compared key by key (see --compare). Rates are per second, times are
+in microseconds (us) or milliseconds (ms) as their keys say.
+"""
+
+
+def frame_mix(count, seed=0):
+    """
+    Returns count frame payloads resembling the radio's traffic: mostly
+    downlink data frames of 32 to 255 random bytes, where FEND and FESC turn
+    up as often as in any other binary data, and some short command responses.
+    """
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            frames.append(bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 4))))
+        else:
+            frames.append(bytes(rng.getrandbits(8) for _ in range(rng.randint(32, 255))))
+    return frames
+
+
+def worst_case_mix(count, length=255):
+    """
+    Returns count payloads made of nothing but bytes that need escaping.
+    """
+    return [(FEND + FESC) * (length // 2)] * count
+
+
+def kiss_stream(frames):
+    """
+    Returns frames as the radio would send them on the serial line.
+    """
+    return b''.join(FEND + DATA_FRAME + escape_special_codes(frame) + FEND for frame in frames)
+
+
+def percentiles(samples, scale=1e-6):
+    """
+    Returns p50, p99 and max of samples (nanoseconds) in milliseconds.
+    """
+    if not samples:
+        return {'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        'p50_ms': ordered[last * 50 // 100] * scale,
+        'p99_ms': ordered[last * 99 // 100] * scale,
+        'max_ms': ordered[last] * scale,
+    }
+
+
+def _best_of(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def bench_codec(frames=2000, repeat=5):
+    """
+    Times escape_special_codes() and recover_special_codes() over whole
+    frame mixes.
+    """
+    results = {}
+    for name, mix in (('mixed', frame_mix(frames)), ('worst_case', worst_case_mix(frames))):
+        escaped = [escape_special_codes(frame) for frame in mix]
+        nbytes = sum(len(frame) for frame in mix)
+
+        elapsed = _best_of(lambda: [escape_special_codes(frame) for frame in mix], repeat)
+        results['escape_{}_us_per_frame'.format(name)] = elapsed / frames * 1e6
+        results['escape_{}_mb_per_s'.format(name)] = nbytes / elapsed / 1e6
+
+        elapsed = _best_of(lambda: [recover_special_codes(frame) for frame in escaped], repeat)
+        results['recover_{}_us_per_frame'.format(name)] = elapsed / frames * 1e6
+        results['recover_{}_mb_per_s'.format(name)] = nbytes / elapsed / 1e6
+    return results
+
+
+def bench_decoder(frames=5000, repeat=5, chunk_sizes=(64, 4096)):
+    """
+    Feeds a KISS stream to KissDecoder in reads of different sizes, then
+    pushes the same stream through a pseudo-terminal into
+    Kiss.read_and_decode(), like the radio would.
+    """
+    stream = kiss_stream(frame_mix(frames))
+    results = {}
+    for chunk_size in chunk_sizes:
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+        def decode():
+            decoder = KissDecoder()
+            for chunk in chunks:
+                decoder.feed(chunk)
+
+        elapsed = _best_of(decode, repeat)
+        results['decoder_{}b_reads_frames_per_s'.format(chunk_size)] = frames / elapsed
+        results['decoder_{}b_reads_mb_per_s'.format(chunk_size)] = len(stream) / elapsed / 1e6
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    kiss = Kiss(port=os.ttyname(slave), baud=115200, timeout=1.0)
+    try:
+        writer = threading.Thread(target=_write_all, args=(master, stream), daemon=True)
+        start = time.perf_counter()
+        writer.start()
+        while len(kiss.decoded_frames) < frames:
+            before = len(kiss.decoded_frames)
+            kiss.read_and_decode()
+            if len(kiss.decoded_frames) == before and not writer.is_alive() and not kiss.interface.in_waiting:
+                break
+        elapsed = time.perf_counter() - start
+        writer.join()
+        results['read_and_decode_frames_per_s'] = len(kiss.decoded_frames) / elapsed
+        results['read_and_decode_mb_per_s'] = len(stream) / elapsed / 1e6
+        results['read_and_decode_lost_frames'] = frames - len(kiss.decoded_frames)
+    finally:
+        kiss.close()
+        os.close(master)
+        os.close(slave)
+    return results
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def bench_connection(frames=50000, size=64, batch=64, framing='length'):
+    """
+    Sends timestamped frames to one local client through Connection, as
+    fast as the client takes them, and measures delivered frames per second
+    and the time from queueing a frame to the client decoding it.
+    """
+    server = Connection('127.0.0.1', 0, framing=framer_factory(framing, size), max_queue=4 * batch)
+    address = server.lsock.getsockname()
+    latencies = []
+    done = threading.Event()
+
+    def client():
+        framer = framer_factory(framing, size)()
+        buffer = bytearray(65536)
+        with socket.create_connection(address) as sock:
+            sock.settimeout(10)
+            while len(latencies) < frames:
+                nbytes = sock.recv_into(buffer)
+                if not nbytes:
+                    break
+                now = time.monotonic_ns()
+                for message in framer.feed(memoryview(buffer)[:nbytes]):
+                    latencies.append(now - DOWNLINK_HEADER.unpack_from(message)[1])
+        done.set()
+
+    reader = threading.Thread(target=client, daemon=True)
+    reader.start()
+    while not server.clients():
+        server.server_cycle(timeout=1)
+
+    padding = bytes(size - DOWNLINK_HEADER.size)
+    start = time.perf_counter()
+    sequence = 0
+    while sequence < frames and server.clients():
+        if server.queue_room() >= batch:
+            count = min(batch, frames - sequence)
+            server.send_batch_to_all([DOWNLINK_HEADER.pack(sequence + i, time.monotonic_ns()) + padding
+                                      for i in range(count)])
+            sequence += count
+        server.server_cycle(timeout=0.01)
+    while server.clients() and server.clients()[0].outb and not done.is_set():
+        server.server_cycle(timeout=0.01)
+    done.wait(10)
+    elapsed = time.perf_counter() - start
+    reader.join(1)
+    for data in server.clients():
+        server._close(data)
+    server.lsock.close()
+    server.sel.close()
+
+    results = {'frames_per_s': len(latencies) / elapsed, 'lost_frames': frames - len(latencies)}
+    results.update(percentiles(latencies))
+    return results
+
+
+def bench_end_to_end(duration=5.0, rate=500.0, size=64, baud=921600, air_bitrate=10000000):
+    """
+    Runs the gateway against the simulated radio and measures the frames per
+    second reaching a data client, and the time from the simulator putting a
+    frame on the serial line to the client decoding it.
+    """
+    # Imported here, as only this benchmark needs the whole gateway.
+    from .core import Gateway
+    from .sat2rf1 import Sat2rf1
+
+    simulator = RadioSimulator(baud=baud, air_bitrate=air_bitrate, downlink_rate=rate, downlink_size=size)
+    simulator.start()
+    radio = Sat2rf1(simulator.port, baud=baud, air_bitrate=air_bitrate)
+    settings_socket = Connection('127.0.0.1', 0, True, framing=framer_factory('line'))
+    data_socket = Connection('127.0.0.1', 0, framing=framer_factory('length'), max_queue=1000)
+    gateway = Gateway(radio, settings_socket, data_socket)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(gateway.run())
+    server = threading.Thread(target=_run_until_cancelled, args=(loop, task), daemon=True)
+    server.start()
+
+    latencies = []
+    sequences = []
+    framer = framer_factory('length')()
+    buffer = bytearray(65536)
+    try:
+        with socket.create_connection(data_socket.lsock.getsockname()) as sock:
+            sock.settimeout(1)
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                try:
+                    nbytes = sock.recv_into(buffer)
+                except socket.timeout:
+                    continue
+                if not nbytes:
+                    break
+                now = time.monotonic_ns()
+                for message in framer.feed(memoryview(buffer)[:nbytes]):
+                    sequence, sent = DOWNLINK_HEADER.unpack_from(message)
+                    sequences.append(sequence)
+                    latencies.append(now - sent)
+            elapsed = time.perf_counter() - start
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        server.join(5)
+        loop.close()
+        radio.kiss.close()
+        simulator.stop()
+        for connection in (settings_socket, data_socket):
+            connection.lsock.close()
+            connection.sel.close()
+
+    expected = sequences[-1] - sequences[0] + 1 if sequences else 0
+    results = {
+        'offered_frames_per_s': rate,
+        'frames_per_s': len(sequences) / elapsed,
+        'lost_frames': expected - len(set(sequences)),
+    }
+    results.update(percentiles(latencies))
+    return results
+
+
+def _run_until_cancelled(loop, task):
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'decoder': bench_decoder,
+    'connection': bench_connection,
+    'end_to_end': bench_end_to_end,
+}
+
+"""
+Smaller workloads for a quick check, per benchmark.
+"""
+QUICK = {
+    'codec': {'frames': 500, 'repeat': 3},
+    'decoder': {'frames': 1000, 'repeat': 3},
+    'connection': {'frames': 5000},
+    'end_to_end': {'duration': 1.0},
+}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(names, quick=False):
+    """
+    Runs the named benchmarks and returns their results with enough
+    context to tell runs apart.
+    """
+    report = {
+        'revision': _git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': {},
+    }
+    for name in names:
+        logger.warning('Running benchmark {}...'.format(name))
+        report['results'][name] = BENCHMARKS[name](**(QUICK[name] if quick else {}))
+    return report
+
+
+def compare(old, new):
+    """
+    Returns lines comparing every result present in both reports.
+    """
+    lines = ['{:<52} {:>14} {:>14} {:>9}'.format('benchmark', old.get('revision'), new.get('revision'), 'change')]
+    for name, results in new['results'].items():
+        for key, value in results.items():
+            previous = old.get('results', {}).get(name, {}).get(key)
+            if value is None or previous is None:
+                continue
+            change = '{:+.1%}'.format((value - previous) / previous) if previous else ''
+            lines.append('{:<52} {:>14.4g} {:>14.4g} {:>9}'.format(name + '.' + key, previous, value, change))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sat2rf1_tcpserver bench',
+                                     description='Benchmarks for Sat2rf1-tcpserver.')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='benchmarks to run: {} (default: all)'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--quick', action='store_true', help='run smaller workloads')
+    parser.add_argument('-o', '--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', metavar='REPORT', help='compare the results with an earlier JSON report')
+    parser.add_argument('--log-level', default='ERROR', help='log level while benchmarking (default: ERROR)')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(name))
+
+    # Logging every frame would be measured along with everything else.
+    logger.setLevel(getattr(logging, args.log_level.upper()))
+
+    report = run(args.benchmarks or list(BENCHMARKS), quick=args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print('\n'.join(compare(old, report)), file=sys.stderr if not args.output else sys.stdout)
@@ -0,0 +1,118 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import struct
+import time
+from pathlib import Path
+
+from sat2rf1_tcpserver import logger
+
+"""
+A capture file starts with MAGIC, followed by records of a header (time in
+nanoseconds from time.monotonic_ns(), direction, kind and length, all
+big-endian) and the data.
+"""
+MAGIC = b'S2RFCAP1'
+_RECORD = struct.Struct('>QBBI')
+
+# Directions
+FROM_RADIO = 0
+TO_RADIO = 1
+
+# Kinds
+RAW = 0  # Bytes as read from or written to the serial port
+FRAME = 1  # A decoded KISS frame: command byte and unescaped payload
+
+Record = collections.namedtuple('Record', ['timestamp_ns', 'direction', 'kind', 'data'])
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file.
+
+    Records go through the file object's buffer, so a record costs a
+    struct.pack() and two buffered writes; call flush() to push them to the
+    file, e.g. at the end of a pass.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.records = 0
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        logger.info('Capturing radio traffic to %s', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, direction, kind, data, timestamp_ns=None):
+        """
+        Appends one record, stamped with the current time unless timestamp_ns is given.
+        """
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        self._file.write(_RECORD.pack(timestamp_ns, direction, kind, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path):
+    """
+    Yields every Record in a capture file, oldest first. A record cut short
+    at the end of the file, as left by a server that was killed, is skipped.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CaptureError('{} is not a capture file'.format(path))
+        while True:
+            header = f.read(_RECORD.size)
+            if not header:
+                return
+            if len(header) < _RECORD.size:
+                break
+            timestamp_ns, direction, kind, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield Record(timestamp_ns, direction, kind, data)
+    logger.warning('Capture file %s ends in a partial record', path)
+
+
+class CaptureError(Exception):
+    """Capture Error."""
+    pass
@@ -0,0 +1,93 @@
+"""
+KISS frame encoding and decoding
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from .kiss_constants import FEND, FESC, FESC_TFEND, FESC_TFESC
+
+
+def escape(data):
+    """
+    Escapes FEND and FESC in a frame payload, per KISS spec.
+
+    bytes.replace() returns the payload itself when there is nothing to
+    replace, so payloads without FEND or FESC are not copied at all.
+
+    :param data: Bytes-like payload.
+    :return: bytes
+    """
+    if type(data) is not bytes:
+        data = bytes(data)
+    # FESC first, so the FESCs added for FEND are not escaped again.
+    return data.replace(FESC, FESC_TFESC).replace(FEND, FESC_TFEND)
+
+
+def unescape(data):
+    """
+    Recovers FEND and FESC in an escaped frame payload.
+
+    Escaped FENDs have to be recovered first: every FESC in valid escaped
+    data starts an escape sequence, so FESC TFEND is always an escaped FEND,
+    while recovering escaped FESCs first would turn an escaped FESC followed
+    by a literal TFEND into FEND. An FESC followed by anything else is
+    invalid; it is kept as it is.
+
+    Payloads without FESC are returned as they are, without a copy.
+
+    :param data: Bytes-like escaped payload, without the delimiting FENDs.
+    :return: bytes
+    """
+    if type(data) is not bytes:
+        data = bytes(data)
+    return data.replace(FESC_TFEND, FEND).replace(FESC_TFESC, FESC)
+
+
+def encode_frame(command, data=b''):
+    """
+    Returns a complete KISS frame: FEND, command, escaped data, FEND.
+    """
+    return b''.join((FEND, command, escape(data), FEND))
+
+
+def encode_frames(frames):
+    """
+    Encodes a list of (command, data) pairs into one buffer, ready to be
+    sent to the radio in a single write.
+
+    :return: bytearray with the frames back to back
+    """
+    escaped = [(command, escape(data)) for command, data in frames]
+    out = bytearray(sum(len(command) + len(data) + 2 for command, data in escaped))
+    fend = FEND[0]
+    pos = 0
+    for command, data in escaped:
+        out[pos] = fend
+        pos += 1
+        out[pos:pos + len(command)] = command
+        pos += len(command)
+        out[pos:pos + len(data)] = data
+        pos += len(data)
+        out[pos] = fend
+        pos += 1
+    return out
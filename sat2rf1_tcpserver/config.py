@@ -0,0 +1,92 @@
+"""
+Loading of the configuration file
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+"""
+Configuration file used when none is given on the command line.
+"""
+DEFAULT_PATH = 'config.yaml'
+
+
+def load(path=DEFAULT_PATH):
+    """
+    Reads the YAML configuration file at path.
+
+    :return: The configuration as a dict of sections, see config.yaml.
+    """
+    # Imported here, so that importing the package does not pay for it.
+    import yaml
+
+    try:
+        with open(path, 'r') as stream:
+            config = yaml.safe_load(stream)
+    except OSError as e:
+        raise ConfigError('Could not read configuration file {}: {}'.format(path, e.strerror))
+    except yaml.YAMLError as e:
+        raise ConfigError('Error in configuration file {}: {}'.format(path, e))
+    if not isinstance(config, dict):
+        raise ConfigError('Configuration file {} is not a mapping of sections'.format(path))
+    return config
+
+
+"""
+Sections that an entry in the radios list can override.
+"""
+RADIO_SECTIONS = ('radio', 'socket', 'spool', 'simulator', 'doppler')
+
+
+def radio_configs(config):
+    """
+    Lists the radios to serve. Each entry in the radios section overrides
+    the keys it gives in the radio, socket, spool, simulator and doppler sections;
+    without a radios section the sections describe a single radio. With
+    several radios each spool is kept in a directory named after its radio,
+    unless the entry gives one.
+
+    :return: List of (name, config) for every radio, config having the same
+             sections as the configuration file.
+    """
+    entries = config.get('radios') or [{'name': config.get('radio', {}).get('name', 'sat2rf1')}]
+    radios = []
+    names = set()
+    for index, entry in enumerate(entries):
+        name = str(entry.get('name', 'radio{}'.format(index)))
+        if name in names:
+            raise ConfigError('Radio name {} is used more than once'.format(name))
+        names.add(name)
+        radio_config = dict(config)
+        for section in RADIO_SECTIONS:
+            radio_config[section] = dict(config.get(section) or {}, **(entry.get(section) or {}))
+        if len(entries) > 1 and 'directory' not in (entry.get('spool') or {}):
+            radio_config['spool']['directory'] = os.path.join(radio_config['spool'].get('directory', 'spool'), name)
+        radios.append((name, radio_config))
+    return radios
+
+
+class ConfigError(Exception):
+    """Configuration Error."""
+    pass
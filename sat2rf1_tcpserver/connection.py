@@ -25,12 +25,110 @@ provide socket functionality to a script or a program.
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
 
+import collections
+import itertools
+import os
 import selectors
 import socket
 import types
 
 # Defines logging format.
-from sat2rf1_tcpserver import logger, config
+from sat2rf1_tcpserver import logger
+from .framing import FramingError, RawFramer
+from .logs import PER_FRAME, Payload
+
+
+# What to do when a client's outbound queue is full.
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+
+
+class OutboundQueue:
+    """
+    Pending outbound data for one client.
+
+    Messages are kept as separate chunks instead of being concatenated, and
+    are handed to sendmsg() as one scatter-gather list. A partially sent chunk
+    is replaced by a memoryview of its remainder, so neither queueing nor
+    sending copies the backlog.
+
+    The queue holds at most max_messages chunks (unbounded if None). What
+    happens to a chunk appended to a full queue is decided by overflow.
+    """
+
+    def __init__(self, max_messages=None, overflow=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, DISCONNECT):
+            raise ValueError('Unknown overflow policy: {}'.format(overflow))
+        self.max_messages = max_messages
+        self.overflow = overflow
+        self.nbytes = 0
+        self.dropped = 0
+        self._chunks = collections.deque()
+        self._head_partial = False
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def append(self, chunk):
+        """
+        Queues chunk (any bytes-like object) behind the pending data.
+
+        :return: False if the queue is full and the overflow policy says the
+                 client should be disconnected, True otherwise.
+        """
+        if not chunk:
+            return True
+        chunks = self._chunks
+        if self.max_messages is not None and len(chunks) >= self.max_messages:
+            if self.overflow == DISCONNECT:
+                return False
+            self.dropped += 1
+            if self.overflow == DROP_NEWEST:
+                return True
+            # Never drop a chunk that is already partially on the wire, the
+            # client would get a torn message.
+            index = 1 if self._head_partial else 0
+            if index < len(chunks):
+                self.nbytes -= len(chunks[index])
+                del chunks[index]
+        chunks.append(memoryview(chunk))
+        self.nbytes += len(chunk)
+        return True
+
+    def send(self, sock):
+        """
+        Writes as much of the queue as sock accepts without blocking.
+
+        :return: Number of bytes sent.
+        """
+        try:
+            if hasattr(sock, 'sendmsg'):
+                sent = sock.sendmsg(list(itertools.islice(self._chunks, _IOV_MAX)))
+            else:
+                sent = sock.send(self._chunks[0])
+        except (BlockingIOError, InterruptedError):
+            return 0
+        self._consume(sent)
+        return sent
+
+    def _consume(self, sent):
+        self.nbytes -= sent
+        chunks = self._chunks
+        while sent:
+            chunk = chunks[0]
+            if len(chunk) > sent:
+                chunks[0] = chunk[sent:]
+                self._head_partial = True
+                break
+            sent -= len(chunk)
+            chunks.popleft()
+            self._head_partial = False
 
 
 class Connection:
@@ -39,12 +137,19 @@ class Connection:
     accept and serve an arbitrary amount of connection attempts.
     """
 
-    def __init__(self, host='localhost', port=65432, settings_con=False):
+    def __init__(self, host='localhost', port=65432, settings_con=False, framing=RawFramer,
+                 recv_buffer_size=65536, max_queue=None, overflow=DROP_OLDEST):
         # Defines variables.
         self._host = host
         self._port = port
         self._settings_con = settings_con
-        self._received = []
+        self._framing = framing  # Called once per client to create its framer.
+        self._max_queue = max_queue
+        self._overflow = overflow
+        self._received = collections.deque()
+        self._recv_buffer = memoryview(bytearray(recv_buffer_size))
+        self.counters = collections.Counter()  # connections, messages and bytes, for metrics
+        self.on_close = None  # Called with a client's data pointer when it is disconnected
         # Defines objects.
         self.lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sel = selectors.DefaultSelector()
@@ -67,10 +172,59 @@ class Connection:
         """
         conn, addr = self.lsock.accept()
         conn.setblocking(False)
-        self.sel.register(conn, selectors.EVENT_READ | selectors.EVENT_WRITE,
-                          data=types.SimpleNamespace(addr=addr, inb=b'', outb=b''))
+        # Write interest is only enabled while there is something to send,
+        # otherwise the selector reports the socket as ready on every cycle.
+        self.sel.register(conn, selectors.EVENT_READ,
+                          data=types.SimpleNamespace(addr=addr, sock=conn, framer=self._framing(),
+                                                     outb=OutboundQueue(self._max_queue, self._overflow)))
+        self.counters['accepted'] += 1
         logger.info('Accepted connection from %s:%s.', addr[0], addr[1])
 
+    def fileno(self):
+        """
+        Returns a file descriptor that becomes readable whenever the instance's
+        selector has events pending, so that an event loop can call
+        server_cycle() on readiness instead of polling it with a timeout.
+        """
+        return self.sel.fileno()
+
+    def clients(self):
+        """
+        Returns the data pointers of all connected clients.
+        """
+        return [key.data for key in self.sel.get_map().values() if key.data is not None]
+
+    def queue_room(self, data_pointer=None):
+        """
+        Returns how many more messages can be queued for the client of
+        data_pointer, or if not given for every client, without overflowing.
+        None if the queues are unbounded.
+        """
+        if self._max_queue is None:
+            return None
+        if data_pointer is not None:
+            return self._max_queue - len(data_pointer.outb)
+        return min((self._max_queue - len(data.outb) for data in self.clients()), default=self._max_queue)
+
+    def _close(self, data):
+        self.counters['closed'] += 1
+        self.sel.unregister(data.sock)
+        data.sock.close()
+        if self.on_close is not None:
+            self.on_close(data)
+
+    def _set_write_interest(self, data, enabled):
+        """
+        Toggles EVENT_WRITE for the socket associated with data.
+        """
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if enabled else selectors.EVENT_READ
+        try:
+            if self.sel.get_key(data.sock).events != events:
+                self.sel.modify(data.sock, events, data=data)
+        except (KeyError, ValueError):
+            # The socket has already been closed and unregistered.
+            pass
+
     def service_connection(self, key, mask):
         """
         Services established connections (sends/receives data).
@@ -80,38 +234,29 @@ class Connection:
         sock = key.fileobj
         data = key.data
         if mask & selectors.EVENT_READ:
-            recv_data = b''
-            if self._settings_con:
-                # TODO: Correct the settings size; 1 is a placeholder number.
-                temp_data = sock.recv(1)
-                if temp_data:
-                    recv_data += temp_data
-                else:
-                    logger.warning('Connection to %s:%s was closed from client side.',
-                                   data.addr[0], data.addr[1])
-                    self.sel.unregister(sock)
-                    sock.close()
+            # One read per event; the selector reports the socket again if
+            # more data is waiting, so a busy client can't starve the loop.
+            nbytes = sock.recv_into(self._recv_buffer)
+            if nbytes:
+                messages = data.framer.feed(self._recv_buffer[:nbytes])
+                for message in messages:
+                    self._received.append((message, data))
+                self.counters['received_bytes'] += nbytes
+                self.counters['received_messages'] += len(messages)
+                logger.debug('Received %d bytes (%d messages) from %s:%s',
+                             nbytes, len(messages), data.addr[0], data.addr[1], extra=PER_FRAME)
             else:
-                while len(recv_data) < config['socket']['data_packet_length']:
-                    temp_data = sock.recv(config['socket']['data_packet_length'])
-                    if temp_data:
-                        recv_data += temp_data
-                    else:
-                        logger.warning('Connection to %s:%s was closed from client side.',
-                                       data.addr[0], data.addr[1])
-                        self.sel.unregister(sock)
-                        sock.close()
-                        break
-            if recv_data:
-                logger.debug('Data received from %s:%s: %s',
-                             data.addr[0], data.addr[1], repr(recv_data))
-                self._received.append((recv_data, data))
-        if mask & selectors.EVENT_WRITE:
+                logger.warning('Connection to %s:%s was closed from client side.',
+                               data.addr[0], data.addr[1])
+                self._close(data)
+        if mask & selectors.EVENT_WRITE and sock.fileno() != -1:
             if data.outb:
-                logger.debug('Sending data to %s:%s: %s',
-                             data.addr[0], data.addr[1], repr(data.outb))
-                sent = sock.send(data.outb)
-                data.outb = data.outb[sent:]
+                sent = data.outb.send(sock)
+                self.counters['sent_bytes'] += sent
+                logger.debug('Sent %d bytes to %s:%s, %d bytes pending',
+                             sent, data.addr[0], data.addr[1], data.outb.nbytes, extra=PER_FRAME)
+            if not data.outb:
+                self._set_write_interest(data, False)
 
     def server_cycle(self, timeout=0):
         """
@@ -131,31 +276,74 @@ class Connection:
         except:
             logger.critical('An unexpected error occurred:\n', exc_info=True)
 
-    @staticmethod
-    def send(message, data_pointer):
+    def send(self, message, data_pointer):
         """
         Registers message for sending on the socket associated with data_pointer.
         """
-        logger.debug('Attempting to send {} to {}'.format(message, data_pointer))
-        data_pointer.outb += message
+        logger.debug('Attempting to send %s to %s:%s', Payload(message), data_pointer.addr[0], data_pointer.addr[1],
+                     extra=PER_FRAME)
+        self.send_batch([message], data_pointer)
+
+    def send_batch(self, messages, data_pointer):
+        """
+        Registers a list of messages for sending on the socket associated with
+        data_pointer. They are queued as separate messages, but go out in the
+        same sendmsg() call.
+        """
+        outb = data_pointer.outb
+        encode = data_pointer.framer.encode
+        dropped = outb.dropped
+        unframed = 0
+        for message in messages:
+            try:
+                chunk = encode(message)
+            except FramingError as e:
+                # Only this message is lost; the rest of the batch still goes out.
+                logger.warning('Dropping message for %s:%s: %s', data_pointer.addr[0], data_pointer.addr[1], e,
+                               extra=PER_FRAME)
+                unframed += 1
+                continue
+            if not outb.append(chunk):
+                logger.warning('Send queue for %s:%s is full, disconnecting slow client.',
+                               data_pointer.addr[0], data_pointer.addr[1], extra=PER_FRAME)
+                self._close(data_pointer)
+                return
+        self.counters['queued_messages'] += len(messages) - unframed
+        self.counters['dropped_messages'] += outb.dropped - dropped + unframed
+        self._set_write_interest(data_pointer, True)
+
+    def send_to_all(self, message):
+        """
+        Registers message for sending to every connected client.
 
-    def send_to_all(self):
-        self.sel.get_map()
+        :return: Number of clients the message was queued for.
+        """
+        return self.send_batch_to_all([message])
+
+    def send_batch_to_all(self, messages):
+        """
+        Registers a list of messages for sending to every connected client.
+
+        :return: Number of clients the messages were queued for.
+        """
+        clients = self.clients()
+        for data_pointer in clients:
+            self.send_batch(messages, data_pointer)
+        return len(clients)
 
     def receive(self):
         """
-        Pops one tuple (message, data_pointer) from the received list and returns it.
+        Pops the oldest tuple (message, data_pointer) from the received list and returns it.
         Returns None if the received list is empty.
         """
-        return self._received.pop() if self._received else None
+        return self._received.popleft() if self._received else None
 
     def receive_all(self):
         """
         Pops all tuples (message, data_pointer) from the
-        received list and returns a list of them.
+        received list and returns a list of them, oldest first.
         Returns None if the received list is empty.
         """
-        temp = []
-        while self._received:
-            temp.append(self._received.pop())
+        temp = list(self._received)
+        self._received.clear()
         return temp if temp else None
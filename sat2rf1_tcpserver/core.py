@@ -24,85 +24,492 @@ Main function for module sat2rf1_tcpserver
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+import asyncio
+import collections
+import os
 import sys
-from serial import SerialException
+import time
 
-from sat2rf1_tcpserver import connection, logger, config
+from sat2rf1_tcpserver import config as config_file
+from sat2rf1_tcpserver import connection, envelope, logger
+from sat2rf1_tcpserver.capture import CaptureWriter
+from sat2rf1_tcpserver.dedup import DedupCache
+from sat2rf1_tcpserver.doppler import DopplerScheduler, Station
+from sat2rf1_tcpserver.framing import framer_factory
+from sat2rf1_tcpserver.logs import PER_FRAME, Payload, setup_logging
+from sat2rf1_tcpserver.metrics import Registry, serve_http
 from sat2rf1_tcpserver.sat2rf1 import Sat2rf1
-from sat2rf1_tcpserver.utils import dump_packet
+from sat2rf1_tcpserver.settings import SettingsHandler
+from sat2rf1_tcpserver.simulator import RadioSimulator
+from sat2rf1_tcpserver.spool import Spool
+from sat2rf1_tcpserver.subscriptions import CONTROL_PREFIX, Subscriptions, SubscriptionError
 
 
-def main():
+class Gateway:
     """
-    Sets ut TCP connections for setting and getting radio configuration and tranceieving data.
+    Forwards traffic between a radio and its settings and data sockets.
 
-    In it's current state, only the data socket is functional, and only one client can be connected.
-    :return:
+    Every socket and the serial port are watched by the asyncio event loop, so
+    the gateway wakes up as soon as one of them is ready instead of polling
+    each of them with a select timeout.
+
+    Frames received while no data client is connected are kept in spool, if
+    given, and replayed to the first client(s) to connect.
+
+    With subscriptions set, data clients can ask for only some of the
+    frames, see subscriptions.Subscriptions. With envelope set, every frame
+    is sent with the header described in envelope.py in front of it.
+
+    With doppler, a DopplerScheduler for the radio, the settings port takes
+    the DOPPLER command to retune the radio along a satellite pass.
+
+    The gateway's counters and latency histograms are added to metrics, a
+    Registry shared by every gateway in the process, labelled with the
+    gateway's name. They are served on the settings port.
+    """
+
+    replay_batch = 256  # Frames replayed from the spool per socket event
+
+    def __init__(self, radio, settings_socket, data_socket, spool=None, state_max_age=10.0,
+                 name='sat2rf1', metrics=None, subscriptions=False, envelope=False, doppler=None):
+        self.radio = radio
+        self.settings_socket = settings_socket
+        self.data_socket = data_socket
+        self.spool = spool
+        self.state_max_age = state_max_age
+        self.name = name
+        self.envelope = envelope
+        self.doppler = doppler
+        self.subscriptions = None
+        if subscriptions:
+            self.subscriptions = Subscriptions()
+            # Clients are told apart by their socket, as data pointers are not hashable.
+            data_socket.on_close = lambda data_pointer: self.subscriptions.remove(data_pointer.sock)
+        self.metrics = Registry() if metrics is None else metrics
+        self.downlink_latency = self.metrics.histogram(
+            'sat2rf1_downlink_latency_seconds', 'Time from reading a frame off the serial port to queueing it '
+                                                'for the data clients.', {'radio': name})
+        self._register_metrics()
+        self.settings = SettingsHandler(radio, settings_socket, self.metrics, doppler)
+        self._transmit_timer = None  # Timer handle for sending on frames held back for the radio
+
+    def _register_metrics(self):
+        metrics = self.metrics
+        labels = {'radio': self.name}
+        for port, sock in (('settings', self.settings_socket), ('data', self.data_socket)):
+            port_labels = dict(labels, port=port)
+            counters = sock.counters
+            metrics.gauge('sat2rf1_clients', 'Connected clients.', port_labels,
+                          lambda sock=sock: len(sock.clients()))
+            for key, help_text in (('accepted', 'Client connections accepted.'),
+                                   ('closed', 'Client connections closed.'),
+                                   ('received_messages', 'Messages received from clients.'),
+                                   ('received_bytes', 'Bytes received from clients.'),
+                                   ('queued_messages', 'Messages queued for clients.'),
+                                   ('dropped_messages', 'Messages dropped as a client\'s queue was full.'),
+                                   ('sent_bytes', 'Bytes sent to clients.')):
+                metrics.counter('sat2rf1_client_' + key + '_total', help_text, port_labels,
+                                lambda counters=counters, key=key: counters[key])
+            metrics.gauge('sat2rf1_client_queue_max', 'Messages queued for the slowest client.', port_labels,
+                          lambda sock=sock: max((len(data.outb) for data in sock.clients()), default=0))
+        if self.spool is not None:
+            metrics.gauge('sat2rf1_spool_frames', 'Frames in the spool.', labels, lambda: len(self.spool))
+        if self.radio is None:
+            return
+        radio = self.radio
+        radio.kiss.write_latency = metrics.histogram(
+            'sat2rf1_uplink_latency_seconds', 'Time from reading a payload off the data port to writing it to '
+                                              'the serial port.', labels)
+        for key, help_text in (('frames_received', 'Data frames received from the radio.'),
+                               ('bytes_received', 'Payload bytes received from the radio.'),
+                               ('frames_sent', 'Data frames sent to the radio.'),
+                               ('bytes_sent', 'Payload bytes sent to the radio.'),
+                               ('duplicates', 'Data frames from the radio dropped as duplicates.')):
+            metrics.counter('sat2rf1_radio_' + key + '_total', help_text, labels,
+                            lambda key=key: radio.counters[key])
+        for key, help_text in (('flushes', 'Writes to the serial port.'),
+                               ('frames', 'Frames written to the serial port.'),
+                               ('bytes', 'Bytes written to the serial port.')):
+            metrics.counter('sat2rf1_serial_write_' + key + '_total', help_text, labels,
+                            lambda key=key: radio.kiss.write_counters[key])
+        metrics.counter('sat2rf1_serial_desyncs_total', 'Bytes discarded outside of a KISS frame, in runs.', labels,
+                        lambda: radio.kiss.desyncs)
+        scheduler = radio.scheduler
+        metrics.counter('sat2rf1_transmit_dropped_total', 'Payloads dropped as the transmit queue was full.', labels,
+                        lambda: scheduler.dropped)
+        metrics.gauge('sat2rf1_transmit_queue_frames', 'Payloads waiting for room in the radio\'s buffer.', labels,
+                      lambda: len(scheduler))
+        metrics.gauge('sat2rf1_transmit_queue_bytes', 'Bytes waiting for room in the radio\'s buffer.', labels,
+                      lambda: scheduler.queued_bytes)
+        metrics.gauge('sat2rf1_radio_buffered_bytes', 'Bytes estimated to be in the radio\'s buffer.', labels,
+                      scheduler.buffered)
+        doppler = self.doppler
+        if doppler is None:
+            return
+        doppler.lateness = metrics.histogram(
+            'sat2rf1_doppler_lateness_seconds', 'Time from when a Doppler correction was due to sending it.', labels)
+        for key, help_text in (('sent', 'Doppler corrections sent to the radio.'),
+                               ('skipped', 'Doppler corrections skipped as too small or overdue.'),
+                               ('failed', 'Doppler corrections the radio did not acknowledge.')):
+            metrics.counter('sat2rf1_doppler_' + key + '_total', help_text, labels,
+                            lambda key=key: doppler.counters[key])
+        metrics.gauge('sat2rf1_doppler_entries', 'Doppler corrections waiting to be sent.', labels,
+                      lambda: len(doppler))
+
+    async def run(self):
+        """
+        Serves both sockets and the radio until cancelled.
+        """
+        tasks = [self._serve_settings(), self._serve_data()]
+        if self.radio is not None:
+            tasks.append(self._serve_radio())
+            tasks.append(self._expire_commands())
+            tasks.append(self._refresh_state())
+        if self.spool is not None:
+            tasks.append(self._sync_spool())
+        await asyncio.gather(*tasks)
+
+    @staticmethod
+    async def _readable(fd):
+        """
+        Yields every time fd becomes readable.
+        """
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                yield
+        finally:
+            loop.remove_reader(fd)
+
+    async def _serve_settings(self):
+        async for _ in self._readable(self.settings_socket.fileno()):
+            self.settings_socket.server_cycle()
+            for line, data_pointer in self.settings_socket.receive_all() or []:
+                try:
+                    self.settings.handle(line, data_pointer)
+                except Exception as e:
+                    # A bad command must not take down the gateway, or the other radios served with it.
+                    logger.exception('Error handling settings command from %s:%s', data_pointer.addr[0],
+                                     data_pointer.addr[1])
+                    self.settings.reply_error(data_pointer, str(e) or type(e).__name__)
+
+    async def _serve_data(self):
+        async for _ in self._readable(self.data_socket.fileno()):
+            self.data_socket.server_cycle()
+            if self.spool and self.data_socket.clients():
+                self._replay_spool()
+            received_at = time.monotonic()
+            data_packets = []
+            for data_packet, data_pointer in self.data_socket.receive_all() or []:
+                if self.subscriptions is not None and data_packet[:1] == CONTROL_PREFIX:
+                    self._subscribe(data_packet, data_pointer)
+                    continue
+                logger.debug("Got a TCP packet of %d bytes: %s", len(data_packet), Payload(data_packet), extra=PER_FRAME)
+                data_packets.append(data_packet)
+            if data_packets and self.radio is not None:
+                self.radio.transmit_batch(data_packets, received_at)
+                self._schedule_transmit()
+
+    async def _serve_radio(self):
+        async for _ in self._readable(self.radio.fileno()):
+            if self.radio.cycle():
+                self._forward(self.radio.get_messages())
+
+    async def _sync_spool(self):
+        # Appends sync in batches; this makes sure the tail of a batch reaches
+        # the disk even if no more frames arrive.
+        while True:
+            await asyncio.sleep(self.spool.fsync_interval)
+            self.spool.sync()
+
+    async def _expire_commands(self):
+        # Sleeps until the oldest outstanding radio command times out, or
+        # until a new command is sent and the deadline may have moved.
+        engine = self.radio.commands
+        submitted = asyncio.Event()
+        engine.on_submit = submitted.set
+        try:
+            while True:
+                deadline = engine.next_deadline()
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    await asyncio.wait_for(submitted.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                submitted.clear()
+                engine.expire()
+        finally:
+            engine.on_submit = None
+
+    async def _refresh_state(self):
+        # Keeps the radio state cache served on the settings port fresh, so
+        # that clients never have to wait for the radio.
+        while True:
+            if self.radio.state.stale(self.state_max_age):
+                self.radio.refresh_status()
+            await asyncio.sleep(self.state_max_age / 2)
+
+    def _schedule_transmit(self):
+        """
+        Makes sure data frames held back for the radio are sent on as soon as
+        the radio has room for them and their write linger window has closed.
+        """
+        deadline = self.radio.transmit_deadline()
+        if deadline is None:
+            return
+        loop = asyncio.get_running_loop()
+        when = loop.time() + max(deadline - time.monotonic(), 0)
+        if self._transmit_timer is not None:
+            if self._transmit_timer.when() <= when:
+                return
+            self._transmit_timer.cancel()
+        self._transmit_timer = loop.call_at(when, self._service_transmit)
+
+    def _service_transmit(self):
+        self._transmit_timer = None
+        self.radio.service_transmit()
+        self._schedule_transmit()
+
+    def _subscribe(self, message, data_pointer):
+        try:
+            self.subscriptions.handle(message, data_pointer.sock)
+        except SubscriptionError as e:
+            logger.warning('Ignoring subscription command from %s:%s: %s', data_pointer.addr[0], data_pointer.addr[1], e)
+            return
+        logger.info('Subscription command from %s:%s: %s', data_pointer.addr[0], data_pointer.addr[1],
+                    bytes(message[len(CONTROL_PREFIX):]).decode('ascii', errors='replace'))
+
+    def _send_frames(self, frames, clients):
+        """
+        Sends a batch of frames to each of clients, or to a client that has
+        subscribed, only the frames it subscribed to.
+        """
+        subscriptions = self.subscriptions
+        if not subscriptions:
+            for data_pointer in clients:
+                self.data_socket.send_batch(frames, data_pointer)
+            return
+        header_size = envelope.HEADER.size if self.envelope else 0
+        batches = collections.defaultdict(list)
+        for frame in frames:
+            for sock in subscriptions.match(frame[header_size:]):
+                batches[sock].append(frame)
+        for data_pointer in clients:
+            if data_pointer.sock not in subscriptions:
+                self.data_socket.send_batch(frames, data_pointer)
+            elif data_pointer.sock in batches:
+                self.data_socket.send_batch(batches[data_pointer.sock], data_pointer)
+
+    def _replay_spool(self):
+        """
+        Sends the next batch of spooled frames to the data clients. Only as
+        many frames as the clients have room for are taken out of the spool,
+        the rest follow as the clients' queues drain.
+
+        A client whose queue is full is skipped, so that one stalled client
+        does not hold the spool back for the others. Its overflow policy would
+        have dropped the frames anyway.
+        """
+        clients = self.data_socket.clients()
+        rooms = [self.data_socket.queue_room(data_pointer) for data_pointer in clients]
+        ready = [data_pointer for data_pointer, room in zip(clients, rooms) if room is None or room > 0]
+        if not ready:
+            return
+        count = min([room for room in rooms if room] + [self.replay_batch])
+        frames = self.spool.read(count)
+        logger.info('Replaying %d spooled frame(s) to %d of %d client(s), %d left', len(frames), len(ready),
+                    len(clients), len(self.spool), extra=PER_FRAME)
+        self._send_frames(frames, ready)
+
+    def _forward(self, radio_messages):
+        """
+        Sends a batch of frames from the radio to every data client, or stores them until one connects.
+        """
+        logger.debug("Got %d frame(s) from radio", len(radio_messages), extra=PER_FRAME)
+        now = time.monotonic_ns()
+        for radio_message in radio_messages:
+            self.downlink_latency.record((now - radio_message.received_ns) / 1e9)
+        # Frames are spooled as they are sent, envelope included.
+        if self.envelope:
+            frames = [envelope.wrap(radio_message) for radio_message in radio_messages]
+        else:
+            frames = [radio_message.data for radio_message in radio_messages]
+        if self.data_socket.clients() and not self.spool:
+            # Every client has caught up with the spool, if any.
+            self._send_frames(frames, self.data_socket.clients())
+
+        elif self.spool is not None:
+            # Spooled frames have to go out first, so while the spool is being
+            # replayed new frames are queued behind them.
+            if not self.data_socket.clients():
+                logger.warning("Data received from radio but no client connected!", extra=PER_FRAME)
+            for frame in frames:
+                self.spool.append(frame)
+            if self.data_socket.clients():
+                self._replay_spool()
+
+        else:
+            logger.warning("Data received from radio but no client connected! Dropping %d frame(s).",
+                           len(radio_messages), extra=PER_FRAME)
+
+
+def _setup_radio(name, config, metrics, dedup=None, capture=None):
+    """
+    Sets up the sockets, spool and radio (or simulated radio) of one radio.
+    Data frames already seen by dedup, if given, are dropped, and the serial
+    traffic is recorded by capture, if given.
+
+    :return: tuple (gateway, spool, simulator), spool and simulator being None if not used.
     """
-    logger.info("Setting up sockets...")
+    # Imported here, so that only the gateway itself pays for pyserial.
+    from serial import SerialException
+
+    logger.info("Setting up sockets for %s...", name)
 
     hostname = config['socket']['hostname']
     settings_port = config['socket']['settings_port']
     data_port = config['socket']['data_port']
 
-    _client_data_buffer = []
-
-    settings_socket = connection.Connection(hostname, settings_port, True)
-    data_socket = connection.Connection(hostname, data_port)
+    settings_socket = connection.Connection(hostname, settings_port, True, framing=framer_factory('line'))
+    data_framing = framer_factory(config['socket'].get('data_framing', 'fixed'),
+                                  config['socket']['data_packet_length'])
+    data_socket = connection.Connection(hostname, data_port, framing=data_framing,
+                                        max_queue=config['socket'].get('client_queue_length', 1000),
+                                        overflow=config['socket'].get('client_overflow', connection.DROP_OLDEST))
 
-    data_pointer = None
-    radio_message = None
+    spool = None
+    if config['spool'].get('enabled', True):
+        spool_config = config['spool']
+        spool = Spool(spool_config.get('directory', 'spool'),
+                      segment_size=spool_config.get('segment_size', 4 * 1024 * 1024),
+                      max_size=spool_config.get('max_size', 256 * 1024 * 1024),
+                      fsync_interval=spool_config.get('fsync_interval', 1.0),
+                      fsync_frames=spool_config.get('fsync_frames', 256))
+        if spool:
+            logger.info('{} undelivered frame(s) in spool of {}'.format(len(spool), name))
 
-    logger.info("Setting up radio...")
+    logger.info("Setting up radio %s...", name)
+    radio = None
+    simulator = None
     try:
-        radio = Sat2rf1()
+        if config['debug'].get('simulate_radio', False):
+            simulator_config = config['simulator']
+            simulator = RadioSimulator(baud=config['radio']['baud'],
+                                       air_bitrate=simulator_config.get('air_bitrate', 9600),
+                                       downlink_rate=simulator_config.get('downlink_rate', 0.0),
+                                       downlink_size=simulator_config.get('downlink_size', 64),
+                                       buffer_size=simulator_config.get('buffer_size', 2048))
+            simulator.start()
+            radio = Sat2rf1.from_config(config['radio'], port=simulator.port, dedup=dedup, capture=capture)
+        else:
+            radio = Sat2rf1.from_config(config['radio'], dedup=dedup, capture=capture)
         logger.info('Testing radio...')
         # radio.test_radio()
     except SerialException as e:
-        logger.error('Failed to connect to radio:')
+        logger.error('Failed to connect to radio %s:', name)
         logger.error(e.strerror)
         if not config['debug']['fake_radio_connection']:
             sys.exit(1)
 
+    doppler = None
+    doppler_config = config.get('doppler') or {}
+    if radio is not None and doppler_config.get('enabled', True):
+        station = None
+        if doppler_config.get('latitude') is not None and doppler_config.get('longitude') is not None:
+            station = Station(doppler_config['latitude'], doppler_config['longitude'],
+                              doppler_config.get('altitude', 0.0))
+        doppler = DopplerScheduler(radio, step=doppler_config.get('step', 100), station=station,
+                                   interval=doppler_config.get('interval', 1.0),
+                                   min_elevation=doppler_config.get('min_elevation', 0.0),
+                                   search=doppler_config.get('search_hours', 24) * 3600)
+
+    gateway = Gateway(radio, settings_socket, data_socket, spool,
+                      state_max_age=config['radio'].get('state_max_age', 10.0), name=name, metrics=metrics,
+                      subscriptions=config['socket'].get('data_subscriptions', False),
+                      envelope=config['socket'].get('data_envelope', False), doppler=doppler)
+    return gateway, spool, simulator
+
+
+async def _serve(gateways, metrics, metrics_address=None):
+    """
+    Serves every gateway, and the metrics over HTTP if metrics_address is
+    given as (host, port), from one event loop until cancelled.
+    """
+    tasks = [gateway.run() for gateway in gateways]
+    if metrics_address is not None:
+        tasks.append(serve_http(metrics, *metrics_address))
+    await asyncio.gather(*tasks)
+
+
+def main(argv=None):
+    """
+    Sets ut TCP connections for setting and getting radio configuration and tranceieving data,
+    and serves them from an asyncio event loop until interrupted.
+
+    Frames from the radio are sent to every connected data client, and the settings socket
+    serves the radio's settings (see protocol.md). Every radio listed in the configuration
+    has its own sockets, and all of them are served from the same event loop.
+    :param argv: Command line arguments, sys.argv[1:] if None.
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog='python -m sat2rf1_tcpserver',
+                                     description='TCP server for the Sat2rf1 radio.',
+                                     epilog='Run "python -m sat2rf1_tcpserver bench --help" for the benchmarks.')
+    parser.add_argument('-c', '--config', default=config_file.DEFAULT_PATH,
+                        help='configuration file (default: {})'.format(config_file.DEFAULT_PATH))
+    args = parser.parse_args(argv)
     try:
-        while True:
-            # Update sockets, allows them to receive data.
-            # Setting a timeout so they won't block execution if no data is present.
-            settings_socket.server_cycle(0.5)
-            data_socket.server_cycle(0.5)
-
-            # Check for data/settings and do stuff
-            tcp_data = data_socket.receive()
-            if tcp_data is not None:
-                # logger.debug('tcp_data is not None')
-                data_packet = tcp_data[0]
-                data_pointer = tcp_data[1]
-                logger.info("Got a TCP packet. Message: {} ({} bytes)".format(data_packet, len(bytes(data_packet))))
-                if not config['debug']['fake_radio_connection']:
-                    radio.transmit_data(data_packet)
-
-            tcp_settings = settings_socket.receive()
-            if tcp_settings is not None:
-                pass
-                # TODO: Add pointer to stack, do stuff with command
-
-            if radio.cycle():
-                radio_message = radio.get_message()
-                logger.info("Got data from radio! Message: {}".format(radio_message[1]))
-                if data_pointer is not None:
-                    while len(_client_data_buffer) > 0:
-                        logger.info(
-                            'Radio messages in buffer: {}. Sending to client...'.format(len(_client_data_buffer)))
-                        data_socket.send(_client_data_buffer.pop(0), data_pointer)  # TODO: better logic
-                    # logger.info("Got data from radio, sending to client")
-                    logger.debug('Sending {} to {}'.format(radio_message[1], data_pointer))
-                    data_socket.send(radio_message[1], data_pointer)
-
-                else:
-                    logger.warning("Data received from radio but no client connected!")
-                    # logger.info("Dumping incoming data...")
-                    dump_packet(radio_message)
-                    _client_data_buffer.append(radio_message)
+        config = config_file.load(args.config)
+        radios = config_file.radio_configs(config)
+    except config_file.ConfigError as e:
+        parser.exit(1, '{}: {}\n'.format(parser.prog, e))
+    setup_logging(config['logging'])
+
+    metrics = Registry()
+    metrics_address = None
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled', False):
+        metrics_address = (metrics_config.get('host', '127.0.0.1'), metrics_config.get('port', 9105))
 
+    # One cache for all radios, so a frame heard by several of them is only forwarded once.
+    dedup = None
+    dedup_config = config.get('dedup', {})
+    if dedup_config.get('enabled', False):
+        dedup = DedupCache(window=dedup_config.get('window', 10.0),
+                           max_entries=dedup_config.get('max_entries', 4096))
+
+    capture_config = config.get('capture', {})
+    started = time.strftime('%Y%m%dT%H%M%S')
+
+    gateways = []
+    spools = []
+    simulators = []
+    captures = []
+    try:
+        for name, radio_config in radios:
+            capture = None
+            if capture_config.get('enabled', False):
+                capture = CaptureWriter(os.path.join(capture_config.get('directory', 'captures'),
+                                                     '{}-{}.cap'.format(name, started)))
+                captures.append(capture)
+            gateway, spool, simulator = _setup_radio(name, radio_config, metrics, dedup, capture)
+            gateways.append(gateway)
+            spools.append(spool)
+            simulators.append(simulator)
+        asyncio.run(_serve(gateways, metrics, metrics_address))
     except KeyboardInterrupt:
         logger.info('Terminated by user')
+    finally:
+        for capture in captures:
+            capture.close()
+        for spool in spools:
+            if spool is not None:
+                spool.close()
+        for simulator in simulators:
+            if simulator is not None:
+                simulator.stop()
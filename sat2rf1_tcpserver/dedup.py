@@ -0,0 +1,75 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+import time
+
+
+class DedupCache:
+    """
+    Remembers the frames received in the last window seconds, so that
+    copies of them can be dropped: beacons the satellite repeats, or the
+    same frame heard by several radios.
+
+    Frames are kept in order of arrival, keyed by their bytes, whose hash
+    Python computes once per frame. A copy is a duplicate if it arrives
+    within window seconds of the first copy; it does not extend the window,
+    so a frame repeated on purpose every window seconds still gets through.
+    At most max_entries frames are remembered; beyond that the oldest are
+    forgotten first, and a burst of new frames can only make the cache miss
+    a duplicate, never drop a new frame.
+    """
+
+    def __init__(self, window=10.0, max_entries=4096, clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self.duplicates = 0
+        self._seen = collections.OrderedDict()  # frame -> time of its first copy
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, frame, now=None):
+        """
+        Checks a frame against the ones received recently, and remembers it.
+
+        :return: True if frame is a duplicate and should be dropped.
+        """
+        now = self.clock() if now is None else now
+        seen = self._seen
+        expired = now - self.window
+        while seen and next(iter(seen.values())) <= expired:
+            seen.popitem(last=False)
+        frame = bytes(frame)
+        if frame in seen:
+            self.duplicates += 1
+            return True
+        if len(seen) >= self.max_entries:
+            seen.popitem(last=False)
+        seen[frame] = now
+        return False
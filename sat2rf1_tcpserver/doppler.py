@@ -0,0 +1,542 @@
+"""
+Doppler correction: predicts a satellite pass and retunes the radio on a timed schedule
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import calendar
+import collections
+import math
+import time
+
+from sat2rf1_tcpserver import logger
+from .logs import PER_FRAME
+from .sat2rf1_constants import LOWER_FREQUENCY_LIMIT, UPPER_FREQUENCY_LIMIT
+
+"""
+WGS 72 constants used by SGP4, which TLEs are fitted with.
+"""
+_MU = 398600.8  # km3 / s2
+_RADIUS = 6378.135  # km
+_XKE = 60.0 / math.sqrt(_RADIUS ** 3 / _MU)  # sqrt(mu) in Earth radii ** 1.5 per minute
+_J2 = 0.001082616
+_J3 = -0.00000253881
+_J4 = -0.00000165597
+_J3OJ2 = _J3 / _J2
+
+"""
+WGS 84 ellipsoid, for the station location.
+"""
+_WGS84_A = 6378.137  # km
+_WGS84_F = 1 / 298.257223563
+
+_EARTH_ROTATION = 7.292115e-5  # rad / s
+SPEED_OF_LIGHT = 299792.458  # km / s
+
+_TWO_PI = 2 * math.pi
+
+"""
+Seconds between the samples a pass is searched for with; shorter than any
+pass worth tracking.
+"""
+_SEARCH_STEP = 30.0
+
+"""
+Longest pass a low Earth orbit can make, in seconds.
+"""
+_MAX_PASS = 3600.0
+
+
+def _tle_checksum(line):
+    return sum(int(char) if char.isdigit() else char == '-' for char in line[:68]) % 10
+
+
+def _tle_float(field):
+    # Decimal point and exponent implied, as in ' 28098-4' for 0.28098e-4.
+    field = field.strip()
+    if not field:
+        return 0.0
+    sign = -1.0 if field[0] == '-' else 1.0
+    field = field.lstrip('+-')
+    mantissa, exponent = field[:-2], field[-2:]
+    return sign * float('0.' + mantissa.strip()) * 10 ** int(exponent)
+
+
+class Satellite:
+    """
+    Orbit of a satellite, propagated from its two-line element set with
+    SGP4.
+
+    Only the near-Earth part of SGP4 is implemented, which covers orbits of
+    less than 225 minutes: every low Earth orbit. Positions and velocities
+    are in km and km/s in the TEME frame.
+    """
+
+    def __init__(self, line1, line2):
+        line1 = line1.rstrip()
+        line2 = line2.rstrip()
+        for number, line in ((1, line1), (2, line2)):
+            if len(line) != 69 or line[:2] != '{} '.format(number):
+                raise DopplerError('TLE line {} is malformed'.format(number))
+            if not line[68].isdigit() or _tle_checksum(line) != int(line[68]):
+                raise DopplerError('TLE line {} has a bad checksum'.format(number))
+        if line1[2:7] != line2[2:7]:
+            raise DopplerError('TLE lines are for different satellites')
+        try:
+            self.number = line1[2:7].strip()
+            year = int(line1[18:20])
+            year += 2000 if year < 57 else 1900
+            self.epoch = calendar.timegm((year, 1, 1, 0, 0, 0)) + (float(line1[20:32]) - 1) * 86400
+            self.bstar = _tle_float(line1[53:61])
+            self.inclination = math.radians(float(line2[8:16]))
+            self.node = math.radians(float(line2[17:25]))
+            self.eccentricity = float('0.' + line2[26:33].strip())
+            self.perigee = math.radians(float(line2[34:42]))
+            self.mean_anomaly = math.radians(float(line2[43:51]))
+            mean_motion = float(line2[52:63]) * _TWO_PI / 1440  # rad / min
+        except ValueError as e:
+            raise DopplerError('TLE has an invalid field: {}'.format(e))
+        if _TWO_PI / mean_motion >= 225:
+            raise DopplerError('Deep space orbits are not supported')
+        self._init(mean_motion)
+
+    def _init(self, mean_motion):
+        # Initialisation of SGP4 as in Vallado et al., "Revisiting Spacetrack
+        # Report #3" (2006), near-Earth terms only.
+        ecco = self.eccentricity
+        inclo = self.inclination
+        bstar = self.bstar
+        eccsq = ecco * ecco
+        omeosq = 1 - eccsq
+        rteosq = math.sqrt(omeosq)
+        cosio = math.cos(inclo)
+        cosio2 = cosio * cosio
+
+        # Recover the original mean motion and semi-major axis from the elements.
+        ak = (_XKE / mean_motion) ** (2 / 3)
+        d1 = 0.75 * _J2 * (3 * cosio2 - 1) / (rteosq * omeosq)
+        delta = d1 / (ak * ak)
+        adel = ak * (1 - delta * delta - delta * (1 / 3 + 134 * delta * delta / 81))
+        delta = d1 / (adel * adel)
+        no = mean_motion / (1 + delta)
+        ao = (_XKE / no) ** (2 / 3)
+        sinio = math.sin(inclo)
+        po = ao * omeosq
+        con42 = 1 - 5 * cosio2
+        con41 = -con42 - cosio2 - cosio2
+        posq = po * po
+        rp = ao * (1 - ecco)
+
+        # Atmospheric drag terms, with the density reference lowered for low perigees.
+        ss = 78 / _RADIUS + 1
+        qzms2t = ((120 - 78) / _RADIUS) ** 4
+        self._simple = rp < 220 / _RADIUS + 1
+        sfour = ss
+        qzms24 = qzms2t
+        perige = (rp - 1) * _RADIUS
+        if perige < 156:
+            sfour = perige - 78
+            if perige < 98:
+                sfour = 20
+            qzms24 = ((120 - sfour) / _RADIUS) ** 4
+            sfour = sfour / _RADIUS + 1
+        pinvsq = 1 / posq
+        tsi = 1 / (ao - sfour)
+        eta = ao * ecco * tsi
+        etasq = eta * eta
+        eeta = ecco * eta
+        psisq = abs(1 - etasq)
+        coef = qzms24 * tsi ** 4
+        coef1 = coef / psisq ** 3.5
+        cc2 = coef1 * no * (ao * (1 + 1.5 * etasq + eeta * (4 + etasq)) +
+                            0.375 * _J2 * tsi / psisq * con41 * (8 + 3 * etasq * (8 + etasq)))
+        cc1 = bstar * cc2
+        cc3 = -2 * coef * tsi * _J3OJ2 * no * sinio / ecco if ecco > 1e-4 else 0.0
+        x1mth2 = 1 - cosio2
+        cc4 = 2 * no * coef1 * ao * omeosq * (
+            eta * (2 + 0.5 * etasq) + ecco * (0.5 + 2 * etasq) -
+            _J2 * tsi / (ao * psisq) * (-3 * con41 * (1 - 2 * eeta + etasq * (1.5 - 0.5 * eeta)) +
+                                        0.75 * x1mth2 * (2 * etasq - eeta * (1 + etasq)) * math.cos(2 * self.perigee)))
+        cc5 = 2 * coef1 * ao * omeosq * (1 + 2.75 * (etasq + eeta) + eeta * etasq)
+
+        # Secular rates of the mean anomaly, argument of perigee and node.
+        cosio4 = cosio2 * cosio2
+        temp1 = 1.5 * _J2 * pinvsq * no
+        temp2 = 0.5 * temp1 * _J2 * pinvsq
+        temp3 = -0.46875 * _J4 * pinvsq * pinvsq * no
+        self._mdot = no + 0.5 * temp1 * rteosq * con41 + 0.0625 * temp2 * rteosq * (13 - 78 * cosio2 + 137 * cosio4)
+        self._argpdot = (-0.5 * temp1 * con42 + 0.0625 * temp2 * (7 - 114 * cosio2 + 395 * cosio4) +
+                         temp3 * (3 - 36 * cosio2 + 49 * cosio4))
+        xhdot1 = -temp1 * cosio
+        self._nodedot = xhdot1 + (0.5 * temp2 * (4 - 19 * cosio2) + 2 * temp3 * (3 - 7 * cosio2)) * cosio
+        self._omgcof = bstar * cc3 * math.cos(self.perigee)
+        self._xmcof = -2 / 3 * coef * bstar / eeta if ecco > 1e-4 else 0.0
+        self._nodecf = 3.5 * omeosq * xhdot1 * cc1
+        self._t2cof = 1.5 * cc1
+        self._xlcof = -0.25 * _J3OJ2 * sinio * (3 + 5 * cosio) / max(1 + cosio, 1.5e-12)
+        self._aycof = -0.5 * _J3OJ2 * sinio
+        self._delmo = (1 + eta * math.cos(self.mean_anomaly)) ** 3
+        self._sinmao = math.sin(self.mean_anomaly)
+        self._x7thm1 = 7 * cosio2 - 1
+        if not self._simple:
+            cc1sq = cc1 * cc1
+            self._d2 = 4 * ao * tsi * cc1sq
+            temp = self._d2 * tsi * cc1 / 3
+            self._d3 = (17 * ao + sfour) * temp
+            self._d4 = 0.5 * temp * ao * tsi * (221 * ao + 31 * sfour) * cc1
+            self._t3cof = self._d2 + 2 * cc1sq
+            self._t4cof = 0.25 * (3 * self._d3 + cc1 * (12 * self._d2 + 10 * cc1sq))
+            self._t5cof = 0.2 * (3 * self._d4 + 12 * cc1 * self._d3 + 6 * self._d2 * self._d2 +
+                                 15 * cc1sq * (2 * self._d2 + cc1sq))
+        self._no = no
+        self._cc1 = cc1
+        self._cc4 = cc4
+        self._cc5 = cc5
+        self._eta = eta
+        self._con41 = con41
+        self._x1mth2 = x1mth2
+        self._cosio = cosio
+        self._sinio = sinio
+
+    def propagate(self, minutes):
+        """
+        Returns the position and velocity of the satellite the given number
+        of minutes after the epoch of the elements.
+
+        :return: tuple ((x, y, z), (vx, vy, vz)) in km and km/s, TEME frame
+        """
+        t = minutes
+        ecco = self.eccentricity
+        bstar = self.bstar
+        xmdf = self.mean_anomaly + self._mdot * t
+        argpdf = self.perigee + self._argpdot * t
+        nodedf = self.node + self._nodedot * t
+        argpm = argpdf
+        mm = xmdf
+        t2 = t * t
+        nodem = nodedf + self._nodecf * t2
+        tempa = 1 - self._cc1 * t
+        tempe = bstar * self._cc4 * t
+        templ = self._t2cof * t2
+        if not self._simple:
+            delomg = self._omgcof * t
+            delm = self._xmcof * ((1 + self._eta * math.cos(xmdf)) ** 3 - self._delmo)
+            temp = delomg + delm
+            mm = xmdf + temp
+            argpm = argpdf - temp
+            t3 = t2 * t
+            t4 = t3 * t
+            tempa = tempa - self._d2 * t2 - self._d3 * t3 - self._d4 * t4
+            tempe = tempe + bstar * self._cc5 * (math.sin(mm) - self._sinmao)
+            templ = templ + self._t3cof * t3 + t4 * (self._t4cof + t * self._t5cof)
+
+        am = (_XKE / self._no) ** (2 / 3) * tempa * tempa
+        nm = _XKE / am ** 1.5
+        em = ecco - tempe
+        if em >= 1 or em < -0.001:
+            raise DopplerError('Orbit of satellite {} has decayed'.format(self.number))
+        em = max(em, 1e-6)
+        mm = mm + self._no * templ
+        xlm = mm + argpm + nodem
+        nodem = nodem % _TWO_PI
+        argpm = argpm % _TWO_PI
+        xlm = xlm % _TWO_PI
+        mm = (xlm - argpm - nodem) % _TWO_PI
+
+        # Long period periodics
+        axnl = em * math.cos(argpm)
+        temp = 1 / (am * (1 - em * em))
+        aynl = em * math.sin(argpm) + temp * self._aycof
+        xl = mm + argpm + nodem + temp * self._xlcof * axnl
+
+        # Kepler's equation
+        u = (xl - nodem) % _TWO_PI
+        eo1 = u
+        sineo1 = coseo1 = 0.0
+        for _ in range(10):
+            sineo1 = math.sin(eo1)
+            coseo1 = math.cos(eo1)
+            delta = (u - aynl * coseo1 + axnl * sineo1 - eo1) / (1 - coseo1 * axnl - sineo1 * aynl)
+            delta = max(min(delta, 0.95), -0.95)
+            eo1 += delta
+            if abs(delta) < 1e-12:
+                break
+
+        # Short period periodics
+        ecose = axnl * coseo1 + aynl * sineo1
+        esine = axnl * sineo1 - aynl * coseo1
+        el2 = axnl * axnl + aynl * aynl
+        pl = am * (1 - el2)
+        if pl < 0:
+            raise DopplerError('Orbit of satellite {} has decayed'.format(self.number))
+        rl = am * (1 - ecose)
+        rdotl = math.sqrt(am) * esine / rl
+        rvdotl = math.sqrt(pl) / rl
+        betal = math.sqrt(1 - el2)
+        temp = esine / (1 + betal)
+        sinu = am / rl * (sineo1 - aynl - axnl * temp)
+        cosu = am / rl * (coseo1 - axnl + aynl * temp)
+        su = math.atan2(sinu, cosu)
+        sin2u = (cosu + cosu) * sinu
+        cos2u = 1 - 2 * sinu * sinu
+        temp = 1 / pl
+        temp1 = 0.5 * _J2 * temp
+        temp2 = temp1 * temp
+        mrt = rl * (1 - 1.5 * temp2 * betal * self._con41) + 0.5 * temp1 * self._x1mth2 * cos2u
+        if mrt < 1:
+            raise DopplerError('Orbit of satellite {} has decayed'.format(self.number))
+        su = su - 0.25 * temp2 * self._x7thm1 * sin2u
+        xnode = nodem + 1.5 * temp2 * self._cosio * sin2u
+        xinc = self.inclination + 1.5 * temp2 * self._cosio * self._sinio * cos2u
+        mvt = rdotl - nm * temp1 * self._x1mth2 * sin2u / _XKE
+        rvdot = rvdotl + nm * temp1 * (self._x1mth2 * cos2u + 1.5 * self._con41) / _XKE
+
+        # Orientation vectors
+        sinsu = math.sin(su)
+        cossu = math.cos(su)
+        snod = math.sin(xnode)
+        cnod = math.cos(xnode)
+        sini = math.sin(xinc)
+        cosi = math.cos(xinc)
+        xmx = -snod * cosi
+        xmy = cnod * cosi
+        ux = xmx * sinsu + cnod * cossu
+        uy = xmy * sinsu + snod * cossu
+        uz = sini * sinsu
+        vx = xmx * cossu - cnod * sinsu
+        vy = xmy * cossu - snod * sinsu
+        vz = sini * cossu
+        r = mrt * _RADIUS
+        v = _RADIUS * _XKE / 60
+        return ((r * ux, r * uy, r * uz),
+                ((mvt * ux + rvdot * vx) * v, (mvt * uy + rvdot * vy) * v, (mvt * uz + rvdot * vz) * v))
+
+    def at(self, unix_time):
+        """
+        Returns position and velocity, as propagate(), at a time.time() time.
+        """
+        return self.propagate((unix_time - self.epoch) / 60)
+
+
+def gmst(unix_time):
+    """
+    Returns the Greenwich mean sidereal time at a time.time() time, in radians.
+    """
+    centuries = (unix_time / 86400 + 2440587.5 - 2451545.0) / 36525
+    seconds = (-6.2e-6 * centuries ** 3 + 0.093104 * centuries ** 2 +
+               (876600 * 3600 + 8640184.812866) * centuries + 67310.54841)
+    return math.radians(seconds / 240) % _TWO_PI
+
+
+Station = collections.namedtuple('Station', ['latitude', 'longitude', 'altitude'])
+Station.__doc__ = 'Ground station location: latitude and longitude in degrees, altitude in metres.'
+
+
+def _station_vectors(station):
+    # Position in km in the Earth fixed frame, and the unit vector pointing up.
+    latitude = math.radians(station.latitude)
+    longitude = math.radians(station.longitude)
+    altitude = station.altitude / 1000
+    e2 = _WGS84_F * (2 - _WGS84_F)
+    sin_lat = math.sin(latitude)
+    n = _WGS84_A / math.sqrt(1 - e2 * sin_lat * sin_lat)
+    up = (math.cos(latitude) * math.cos(longitude), math.cos(latitude) * math.sin(longitude), sin_lat)
+    return ((n + altitude) * up[0], (n + altitude) * up[1], (n * (1 - e2) + altitude) * sin_lat), up
+
+
+def look(satellite, station, unix_time):
+    """
+    Returns where the satellite is seen from the station at a time.time() time.
+
+    :return: tuple (elevation in degrees, range rate in km/s, positive when receding)
+    """
+    (x, y, z), (vx, vy, vz) = satellite.at(unix_time)
+    # TEME to Earth fixed, ignoring polar motion.
+    theta = gmst(unix_time)
+    cos_t = math.cos(theta)
+    sin_t = math.sin(theta)
+    xe = cos_t * x + sin_t * y
+    ye = -sin_t * x + cos_t * y
+    vxe = cos_t * vx + sin_t * vy + _EARTH_ROTATION * ye
+    vye = -sin_t * vx + cos_t * vy - _EARTH_ROTATION * xe
+    position, up = _station_vectors(station)
+    rx, ry, rz = xe - position[0], ye - position[1], z - position[2]
+    distance = math.sqrt(rx * rx + ry * ry + rz * rz)
+    elevation = math.degrees(math.asin((rx * up[0] + ry * up[1] + rz * up[2]) / distance))
+    return elevation, (rx * vxe + ry * vye + rz * vz) / distance
+
+
+def pass_table(satellite, station, frequency, start, interval=1.0, search=86400.0, min_elevation=0.0):
+    """
+    Computes the Doppler corrected receive frequency every interval seconds
+    of the first pass over the station after start (or of the pass in
+    progress), while the satellite is at least min_elevation degrees up.
+
+    :param frequency: Frequency the satellite transmits on, in Hz.
+    :return: List of (time.time() time, frequency in Hz), in time order.
+    """
+    if not all(math.isfinite(value) for value in (frequency, start, interval, search)) or interval <= 0:
+        raise DopplerError('invalid pass parameters')
+    end = start + search
+    t = start
+    while look(satellite, station, t)[0] < min_elevation:
+        t += _SEARCH_STEP
+        if t > end:
+            raise DopplerError('No pass of satellite {} in the next {:.0f} hours'.format(satellite.number,
+                                                                                           search / 3600))
+    t = max(t - _SEARCH_STEP, start)
+    table = []
+    # A pass ends within the search window, or the elements are not a sensible orbit.
+    while t <= end + _MAX_PASS:
+        elevation, range_rate = look(satellite, station, t)
+        if elevation >= min_elevation:
+            table.append((t, int(round(frequency * (1 - range_rate / SPEED_OF_LIGHT)))))
+        elif table:
+            return table
+        t += interval
+    raise DopplerError('Pass of satellite {} does not end'.format(satellite.number))
+
+
+class DopplerScheduler:
+    """
+    Retunes the radio along a table of (time.time() time, frequency) entries,
+    such as pass_table() computes.
+
+    Each SET_FREQUENCY is sent from an event loop timer armed for the time of
+    its entry, so the radio follows the table with the timing of the loop
+    rather than that of a client on the settings port. An entry within step
+    Hz of the frequency last set is skipped, and no timer is armed for it.
+    Entries that are already due when the table is loaded are skipped, except
+    the latest, which is sent at once.
+    """
+
+    def __init__(self, radio, step=100, station=None, interval=1.0, min_elevation=0.0, search=86400.0,
+                 clock=time.time):
+        self.radio = radio
+        self.step = step
+        self.station = station  # Station to compute passes for, if known
+        self.interval = interval
+        self.min_elevation = min_elevation
+        self.search = search
+        self.clock = clock
+        self.lateness = None  # Histogram of how late entries were sent, if set
+        self.counters = collections.Counter()  # entries sent, skipped and failed
+        self.last_frequency = None
+        self._table = collections.deque()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._table)
+
+    def plan_pass(self, frequency, line1, line2, start=None):
+        """
+        Computes the table for the next pass of the satellite described by a
+        TLE. Takes a while; run it outside the event loop.
+        """
+        if self.station is None:
+            raise DopplerError('station location not configured')
+        start = self.clock() if start is None else start
+        return pass_table(Satellite(line1, line2), self.station, frequency, start, self.interval, self.search,
+                          self.min_elevation)
+
+    def load(self, table, replace=True):
+        """
+        Follows table from now on, instead of the current table or, with
+        replace False, merged into it.
+        """
+        for when, frequency in table:
+            # NaN would break the ordering of the event loop's timers, and inf never fires.
+            if not math.isfinite(when):
+                raise DopplerError('invalid time {}'.format(when))
+            if not math.isfinite(frequency) or not LOWER_FREQUENCY_LIMIT <= frequency <= UPPER_FREQUENCY_LIMIT:
+                raise DopplerError('frequency {} out of range'.format(frequency))
+        if not replace:
+            table = list(self._table) + list(table)
+        self._table = collections.deque(sorted(table))
+        self._arm()
+
+    def stop(self):
+        """
+        Drops the table, leaving the radio on the frequency it is on.
+        """
+        self._table.clear()
+        self._arm()
+
+    def next_entry(self):
+        """
+        Returns the next (time.time() time, frequency) that will be sent, or None.
+        """
+        return self._table[0] if self._table else None
+
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        table = self._table
+        now = self.clock()
+        due = None
+        while table and table[0][0] <= now:
+            if due is not None:
+                self.counters['skipped'] += 1
+            due = table.popleft()
+        if due is not None:
+            self._send(due[1])
+        while table and self.last_frequency is not None and abs(table[0][1] - self.last_frequency) < self.step:
+            table.popleft()
+            self.counters['skipped'] += 1
+        if not table:
+            return
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_at(loop.time() + table[0][0] - now, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        when, frequency = self._table.popleft()
+        if self.lateness is not None:
+            self.lateness.record(self.clock() - when)
+        self._send(frequency)
+        if not self._table:
+            logger.info('Doppler schedule finished at %d Hz', frequency)
+        self._arm()
+
+    def _send(self, frequency):
+        if self.last_frequency is not None and abs(frequency - self.last_frequency) < self.step:
+            self.counters['skipped'] += 1
+            return
+        self.last_frequency = frequency
+        self.counters['sent'] += 1
+        self.radio.set_frequency(frequency, wait=False).add_done_callback(self._done)
+
+    def _done(self, future):
+        error = future.exception()
+        if error is not None:
+            self.counters['failed'] += 1
+            # The next entry is sent even if the radio did not take this one.
+            self.last_frequency = None
+            logger.warning('Doppler correction failed: %s', error, extra=PER_FRAME)
+
+
+class DopplerError(Exception):
+    """Doppler Error."""
+    pass
@@ -0,0 +1,68 @@
+"""
+Header carrying receive time, sequence number and length in front of frames sent to data clients
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import struct
+
+"""
+With socket.data_envelope set, every frame sent to a data client is
+preceded by this header: the time.monotonic_ns() time the frame was read
+from the serial port, its sequence number (modulo 2 ** 32) and the length
+of the payload that follows, all big-endian.
+"""
+HEADER = struct.Struct('>QIH')
+
+Envelope = collections.namedtuple('Envelope', ['received_ns', 'sequence', 'length'])
+
+
+def wrap(radio_frame):
+    """
+    Puts the envelope header in front of the payload of a RadioFrame.
+
+    :return: bytes, header and payload
+    """
+    data = radio_frame.data
+    return HEADER.pack(radio_frame.received_ns, radio_frame.sequence & 0xFFFFFFFF, len(data)) + data
+
+
+def unwrap(message):
+    """
+    Splits a message from the data port into its envelope and payload.
+
+    :return: tuple (Envelope, payload)
+    """
+    if len(message) < HEADER.size:
+        raise EnvelopeError('message of {} bytes is shorter than the header'.format(len(message)))
+    envelope = Envelope(*HEADER.unpack_from(message))
+    payload = bytes(message[HEADER.size:HEADER.size + envelope.length])
+    if len(payload) != envelope.length:
+        raise EnvelopeError('payload of {} bytes, header says {}'.format(len(payload), envelope.length))
+    return envelope, payload
+
+
+class EnvelopeError(Exception):
+    """Envelope Error."""
+    pass
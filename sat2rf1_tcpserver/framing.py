@@ -0,0 +1,187 @@
+"""
+Message framing for the TCP sockets
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+
+from sat2rf1_tcpserver import logger
+from .codec import encode_frame
+from .kiss import KissDecoder
+from .kiss_constants import DATA_FRAME
+from .logs import PER_FRAME
+
+"""
+Every client gets its own framer instance. feed() takes whatever a single
+recv_into() returned, keeps incomplete messages buffered and returns the
+list of whole messages it completed; encode() frames a message for sending.
+"""
+
+_LENGTH = struct.Struct('>H')
+
+
+class RawFramer:
+    """
+    No framing: every read is passed on as one message.
+    """
+
+    def feed(self, data):
+        return [bytes(data)] if data else []
+
+    @staticmethod
+    def encode(message):
+        return message
+
+
+class FixedLengthFramer:
+    """
+    Splits the stream into messages of exactly packet_length bytes.
+    """
+
+    def __init__(self, packet_length):
+        self.packet_length = packet_length
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        length = self.packet_length
+        end = len(buffer) - len(buffer) % length
+        messages = [bytes(buffer[i:i + length]) for i in range(0, end, length)]
+        del buffer[:end]
+        return messages
+
+    @staticmethod
+    def encode(message):
+        return message
+
+
+class LengthPrefixFramer:
+    """
+    Messages preceded by their length as a 2 byte big-endian integer.
+    """
+
+    max_length = 0xFFFF
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        size = len(buffer)
+        messages = []
+        pos = 0
+        while size - pos >= 2:
+            (length,) = _LENGTH.unpack_from(buffer, pos)
+            end = pos + 2 + length
+            if end > size:
+                break
+            if length:  # Zero length messages are keepalives.
+                messages.append(bytes(buffer[pos + 2:end]))
+            pos = end
+        del buffer[:pos]
+        return messages
+
+    def encode(self, message):
+        if len(message) > self.max_length:
+            raise FramingError('Message of {} bytes is too long to frame'.format(len(message)))
+        return _LENGTH.pack(len(message)) + message
+
+
+class LineFramer:
+    """
+    Newline terminated text lines, as used on the settings port. Lines are
+    returned without the line ending; overlong lines are discarded.
+    """
+
+    max_length = 4096
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        end = buffer.rfind(b'\n')
+        if end < 0:
+            if len(buffer) > self.max_length:
+                logger.warning('Discarding line of more than %d bytes from client', self.max_length, extra=PER_FRAME)
+                buffer.clear()
+            return []
+        lines = [line.rstrip(b'\r') for line in bytes(buffer[:end]).split(b'\n')]
+        del buffer[:end + 1]
+        return [line for line in lines if line]
+
+    @staticmethod
+    def encode(message):
+        return message + b'\n'
+
+
+class KissFramer:
+    """
+    KISS frames as sent to and from a TNC: FEND, command byte, escaped
+    payload, FEND. Only data frames (command 0x00 on any port) are passed on.
+    """
+
+    def __init__(self):
+        self._decoder = KissDecoder(max_frame_length=2 * 0xFFFF)
+
+    def feed(self, data):
+        messages = []
+        for frame in self._decoder.feed(data):
+            if frame[0] & 0x0F == DATA_FRAME[0]:
+                messages.append(frame[1:])
+            else:
+                logger.warning('Ignoring KISS frame with command byte 0x%02x from client', frame[0], extra=PER_FRAME)
+        return messages
+
+    @staticmethod
+    def encode(message):
+        return encode_frame(DATA_FRAME, message)
+
+
+def framer_factory(framing, packet_length=None):
+    """
+    Returns a callable that creates a new framer of the given type.
+
+    :param framing: One of 'raw', 'fixed', 'length', 'kiss' or 'line'.
+    :param packet_length: Message length for 'fixed' framing.
+    """
+    if framing == 'raw':
+        return RawFramer
+    if framing == 'fixed':
+        return lambda: FixedLengthFramer(packet_length)
+    if framing == 'length':
+        return LengthPrefixFramer
+    if framing == 'kiss':
+        return KissFramer
+    if framing == 'line':
+        return LineFramer
+    raise FramingError('Unknown framing mode: {}'.format(framing))
+
+
+class FramingError(Exception):
+    """Framing Error."""
+    pass
@@ -25,13 +25,16 @@ Kiss interface script for the Sat2RF1 radio module
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
 
+import collections
 import logging
-
-import serial
+import time
 
 from sat2rf1_tcpserver import logger
+from sat2rf1_tcpserver.capture import FRAME, FROM_RADIO, RAW, TO_RADIO
+from sat2rf1_tcpserver.codec import encode_frame, encode_frames, unescape
 from sat2rf1_tcpserver.kiss_constants import *
-from sat2rf1_tcpserver.utils import escape_special_codes, recover_special_codes
+from sat2rf1_tcpserver.logs import PER_FRAME, Payload
+from sat2rf1_tcpserver.serial_io import SerialProcess, SerialThread
 
 
 class Kiss:
@@ -39,13 +42,100 @@ class Kiss:
     Defines new KISS interface.
     """
 
-    def __init__(self, port, baud, timeout):
-        self.interface = serial.Serial(port=port, baudrate=baud, timeout=timeout)
-        logging.info('Opened serial port {}'.format(self.interface.name))
-
-        # TODO: Add some kind of queue for read and write here
+    def __init__(self, port, baud, timeout, io_thread=False, linger=0.0, max_write_bytes=4096, io_process=False):
+        # With io_process set, a separate process owns the serial port and
+        # every read and write below goes through it; there is no interface.
+        self.interface = None
+        self.io_process = None
+        if io_process:
+            self.io_process = SerialProcess(port, baud, timeout)
+            self.io_process.start()
+            logging.info('Opened serial port {} in process {}'.format(port, self.io_process.pid))
+        else:
+            # Imported here, so that importing the package does not pay for pyserial.
+            import serial
+
+            self.interface = serial.Serial(port=port, baudrate=baud, timeout=timeout)
+            logging.info('Opened serial port {}'.format(self.interface.name))
+
+        # Frames queued for the radio are held back for up to linger seconds,
+        # or until max_write_bytes are waiting, and then go out in one write.
         self.write_queue = []
+        self.linger = linger
+        self.max_write_bytes = max_write_bytes
+        self.write_counters = collections.Counter()  # flushes, frames and bytes written
+        self.frames_per_flush = collections.Counter()  # frames in one write -> number of such writes
+        self.write_latency = None  # Histogram of the time from receiving a frame to writing it, if set
+        self._write_queue_bytes = 0
+        self._write_queue_frames = 0
+        self._write_queue_received = []
+        self._write_deadline = None
         self.decoded_frames = []
+        self.decoder = KissDecoder()
+        self.capture = None  # CaptureWriter recording the traffic, if set
+
+        # With io_thread set, a dedicated thread owns the serial port and
+        # every read and write below goes through it.
+        self.io_thread = None
+        if io_thread and self.io_process is None:
+            self.io_thread = SerialThread(self.interface, self.decoder)
+            self.io_thread.start()
+
+    @property
+    def desyncs(self):
+        """
+        Frame desyncs counted by the decoder, wherever it runs.
+        """
+        if self.io_process is not None:
+            return self.io_process.desyncs
+        return self.decoder.desyncs
+
+    def fileno(self):
+        """
+        Returns a file descriptor that becomes readable when read_frames() has something to return.
+        """
+        if self.io_process is not None:
+            return self.io_process.fileno()
+        if self.io_thread is not None:
+            return self.io_thread.fileno()
+        return self.interface.fileno()
+
+    def in_waiting(self):
+        """
+        Returns the number of bytes waiting to be read: on the serial port, or
+        handed over by the I/O thread or process and not yet read.
+        """
+        if self.io_process is not None:
+            return self.io_process.in_waiting()
+        if self.io_thread is not None:
+            return self.io_thread.in_waiting()
+        return self.interface.in_waiting
+
+    def write(self, data):
+        """
+        Writes raw bytes to the radio.
+        """
+        if self.capture is not None:
+            self.capture.write(TO_RADIO, RAW, data)
+        if self.io_process is not None:
+            self.io_process.write(data)
+        elif self.io_thread is not None:
+            self.io_thread.write(data)
+        else:
+            self.interface.write(data)
+
+    def close(self):
+        """
+        Stops the I/O thread or process, if any, and closes the serial port.
+        """
+        if self.io_process is not None:
+            self.io_process.stop()
+            self.io_process = None
+            return
+        if self.io_thread is not None:
+            self.io_thread.stop()
+            self.io_thread = None
+        self.interface.close()
 
     # TODO: Rename this to create_frame() or something.
     def create_frame(self, setting, value):  # Renamed from write_setting(...) to create_frame(...)
@@ -54,22 +144,13 @@ class Kiss:
 
         ???This is also used to transmit data by using the DATA setting???.
         """
-        logger.debug('Constructing a frame with header [{}] and value [{}]...'.format(setting, value))
-
-        frame = b''.join([
-            FEND,  # First header
-            setting,  # What setting should be sent to the radio
-            escape_special_codes(value),
-            # Used to change data that looks like FEND's to something else to ensure the frame isn't cut to early
-            FEND  # Last header
-        ])
+        logger.debug('Constructing a frame with header [%s] and value [%s]...', setting, Payload(value), extra=PER_FRAME)
 
-        logger.debug('Frame: [{}]\nTest: [{}]'.format(frame, FEND + setting + escape_special_codes(value) + FEND))
+        # FEND, the setting to send to the radio, the escaped value and FEND.
+        frame = encode_frame(setting, value)
 
-        # TODO: Remove this interface and write to queue instead
-        # self.interface.write(frame)
-        logger.debug('Adding frame to queue: {}'.format(frame))
-        self.write_queue.append(frame)
+        logger.debug('Adding frame to queue: %s', Payload(frame), extra=PER_FRAME)
+        self.queue_write(frame)
         return frame
 
         # TODO: Don't read from radio here. This only expects one frame.
@@ -77,70 +158,118 @@ class Kiss:
         # Removes setting and returnes only error code
         # return self.readline().replace(setting, b'')
 
-    # TODO: Renamed this. Has to handle reading multiple frames.
-    def read_and_decode(self):
-        """
-        Returns single line response. Temporary?
+    def read_frames(self, block=False):
         """
-        frames = []
-        read_buffer = bytes()
+        Reads everything waiting on the serial interface in one go and feeds it
+        to the decoder.
 
-        try:
-            response = self.interface.readline()  # returns a byte string
-
-            if len(response) < 1:
-                # logger.debug('No data found on interface')
-                return
-
-            logger.debug('Raw response: [{}]'.format(response))
+        :param block: Wait up to the serial timeout for data if none is waiting.
+        :return: List of complete, unescaped frames (command byte included).
+        """
+        return [frame for _, frame in self.read_timed_frames(block)]
 
-            # Test redundancy
+    def read_timed_frames(self, block=False):
+        """
+        Like read_frames(), but also returns when each frame was read off the
+        serial port, which may be well before it is returned here when a
+        thread or process serves the port.
 
-            if type(response) != type(bytes()):
-                raise KissError("Respons != bytes(), will terminate.")
+        :return: List of (time.monotonic_ns() time read, frame), oldest first.
+        """
+        if self.io_process is not None:
+            frames = self.io_process.read_frames()
+        elif self.io_thread is not None:
+            frames = self.io_thread.read_frames()
+        else:
+            waiting = self.interface.in_waiting
+            if not waiting and not block:
+                return []
+            data = self.interface.read(waiting or 1)
+            if not data:
+                return []
+            read_ns = time.monotonic_ns()
+            if self.capture is not None:
+                self.capture.write(FROM_RADIO, RAW, data, read_ns)
+            frames = [(read_ns, frame) for frame in self.decoder.feed(data)]
+        if self.capture is not None:
+            for read_ns, frame in frames:
+                self.capture.write(FROM_RADIO, FRAME, frame, read_ns)
+        return frames
 
-            split_data = response.split(FEND)  # Assumes that 'response' is a byte string
-            fends = len(split_data)
+    def read_and_decode(self):
+        """
+        Reads available data from the radio and appends every complete frame
+        to decoded_frames. Partial frames are kept by the decoder until the
+        rest of them arrives.
+        """
+        frames = self.read_frames(block=True)
+        if frames:
+            logger.debug('Decoded %d frame(s)', len(frames), extra=PER_FRAME)
+            self.decoded_frames.extend(frames)
 
-            logger.debug('len(split_data) = {}'.format(len(split_data)))
+    def queue_write(self, data, frames=1, urgent=False, received_at=()):
+        """
+        Queues encoded frames for the radio. They are written at once if
+        linger is 0 or max_write_bytes are queued, otherwise by
+        write_frames_to_radio() once flush_deadline() has passed.
+
+        :param data: One or more complete frames, back to back.
+        :param frames: Number of frames in data, for the counters.
+        :param urgent: Put data ahead of everything already queued.
+        :param received_at: time.monotonic() times the frames were received,
+                            for write_latency.
+        """
+        self._write_queue_received.extend(received_at)
+        if self._write_deadline is None:
+            self._write_deadline = time.monotonic() + self.linger
+        if urgent:
+            self.write_queue.insert(0, data)
+        else:
+            self.write_queue.append(data)
+        self._write_queue_bytes += len(data)
+        self._write_queue_frames += frames
+        if self.linger <= 0 or self._write_queue_bytes >= self.max_write_bytes:
+            self.write_frames_to_radio()
+
+    def write_data_frames(self, payloads, received_at=()):
+        """
+        Encodes a list of payloads as data frames and queues them for the radio.
+        """
+        if payloads:
+            self.queue_write(encode_frames([(DATA_FRAME, payload) for payload in payloads]), len(payloads),
+                             received_at=received_at)
 
-            if fends == 1:
-                logging.info("No FEND found, assuming the entire response is a partial frame")
-                read_buffer += split_data[0]
+    def flush_deadline(self):
+        """
+        Returns the time.monotonic() time by which the queued frames should be
+        written, or None if the queue is empty.
+        """
+        return self._write_deadline
 
-            else:
-                if split_data[0]:  # Response starts with an incomplete frame; concatenate and add frame
-                    logging.info("End of frame found, joining this with incomplete frame in buffer")
-                    frames.append(b''.join([read_buffer, split_data[0]]))
-                    read_buffer = bytes()
-
-                if fends >= 3:  # Handles one or more complete frames
-                    logging.info("Two or more FENDs found, expecting at least one complete frame")
-                    for i in range(1, fends - fends % 3):
-                        if split_data[i]:
-                            logging.info("Found a complete frame")
-                            frames.append(split_data[i])
-
-                if split_data[fends - 1]:  # Ends wih a partial frame; add to buffer
-                    logging.info("Found an incomplete frame at end of response, adding this to buffer")
-                    read_buffer += split_data[fends - 1]
-
-            for ii in range(len(
-                    frames)):  # Iterates trough the data in frames, recovers the special codes and appends the data to the decoded_frame list
-                logging.info("Decoding and assembling frames")
-                self.decoded_frames.append(recover_special_codes(frames[ii]))
-                logger.debug('Added frame {}'.format(recover_special_codes(frames[ii])))
-
-        except KissError as e:
-            print(e)
-
-    # TODO: Check this. not tested
     def write_frames_to_radio(self):
-        logger.debug('{} frames in queue, writing to radio...'.format(len(self.write_queue)))
-        for frame in self.write_queue:
-            logger.debug('Writing frame [{}]'.format(repr(frame)))
-            self.interface.write(frame)
+        """
+        Writes every queued frame to the radio in a single write.
+        """
+        if not self.write_queue:
+            return
+        data = self.write_queue[0] if len(self.write_queue) == 1 else b''.join(self.write_queue)
+        frames = self._write_queue_frames
+        logger.debug('Writing %d frame(s), %d bytes to radio', frames, len(data), extra=PER_FRAME)
+        self.write(data)
+        self.write_counters['flushes'] += 1
+        self.write_counters['frames'] += frames
+        self.write_counters['bytes'] += len(data)
+        self.frames_per_flush[frames] += 1
+        if self._write_queue_received:
+            if self.write_latency is not None:
+                now = time.monotonic()
+                for received_at in self._write_queue_received:
+                    self.write_latency.record(now - received_at)
+            self._write_queue_received.clear()
         self.write_queue.clear()
+        self._write_queue_bytes = 0
+        self._write_queue_frames = 0
+        self._write_deadline = None
 
     def write_and_return_response(self, frame):
         self.interface.write(frame)
@@ -156,6 +285,73 @@ class Kiss:
                 self.write_frames_to_radio()
 
 
+class KissDecoder:
+    """
+    Incremental KISS decoder.
+
+    Bytes are fed in whatever chunks the serial port returns them, and every
+    frame completed by a chunk is returned unescaped. A frame split across
+    two reads is kept in the internal buffer until its closing FEND arrives.
+    """
+
+    def __init__(self, max_frame_length=4096):
+        self.max_frame_length = max_frame_length
+        self.desyncs = 0
+        self._buffer = bytearray()
+        self._in_frame = False
+
+    def feed(self, data):
+        """
+        Decodes data and returns a list of the frames it completed.
+
+        :param data: Bytes read from the serial interface.
+        :return: List of unescaped frames, in order of arrival.
+        """
+        buffer = self._buffer
+        buffer += data
+        if not buffer:
+            return []
+        start = 0
+
+        if not self._in_frame:
+            start = buffer.find(FEND)
+            if start < 0:
+                # Garbage between frames, nothing to resynchronise on yet.
+                self.desyncs += 1
+                logger.error('Frame desync! Discarding %d bytes outside of a frame.', len(buffer))
+                buffer.clear()
+                return []
+            if start > 0:
+                self.desyncs += 1
+                logger.error('Frame desync! Discarding %d bytes outside of a frame.', start)
+            start += 1
+            self._in_frame = True
+
+        frames = []
+        end = buffer.find(FEND, start)
+        while end >= 0:
+            if end > start:  # Back-to-back FENDs delimit empty frames; skip those.
+                frames.append(unescape(buffer[start:end]))
+            start = end + 1
+            end = buffer.find(FEND, start)
+        del buffer[:start]
+
+        if len(buffer) > self.max_frame_length:
+            self.desyncs += 1
+            logger.error('Frame desync! No FEND in %d bytes, dropping partial frame.', len(buffer))
+            buffer.clear()
+            self._in_frame = False
+
+        return frames
+
+    def reset(self):
+        """
+        Drops any partial frame.
+        """
+        self._buffer.clear()
+        self._in_frame = False
+
+
 class KissError(Exception):
     """Kiss Error."""
     # TODO: Logging (and error handling)
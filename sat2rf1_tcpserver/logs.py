@@ -0,0 +1,130 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+"""
+Pass as extra= to a log call that may be made for every frame, so that
+RateLimitFilter keeps it from flooding the log.
+"""
+PER_FRAME = {'per_frame': True}
+
+
+class Payload:
+    """
+    Wraps a payload passed as a log message argument. It is only turned
+    into text, and only its first limit bytes, if the message is emitted.
+    """
+
+    __slots__ = ('data', 'limit')
+
+    def __init__(self, data, limit=32):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        head = bytes(self.data[:self.limit]).hex()
+        if len(self.data) > self.limit:
+            return '{}... ({} bytes)'.format(head, len(self.data))
+        return head
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most burst PER_FRAME messages from each line of code through
+    every interval seconds and drops the rest. The next message let
+    through from that line says how many were dropped.
+
+    Other messages are not affected.
+    """
+
+    def __init__(self, burst=10, interval=1.0, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self._sites = {}  # (pathname, lineno) -> [window start, messages let through, messages dropped]
+
+    def filter(self, record):
+        if not getattr(record, 'per_frame', False):
+            return True
+        now = self.clock()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None or now - site[0] >= self.interval:
+            dropped = site[2] if site is not None else 0
+            site = self._sites[(record.pathname, record.lineno)] = [now, 0, 0]
+        else:
+            dropped = 0
+        if site[1] >= self.burst:
+            site[2] += 1
+            return False
+        site[1] += 1
+        if dropped:
+            record.msg = '{} ({} similar message(s) suppressed)'.format(record.getMessage(), dropped)
+            record.args = None
+        return True
+
+
+def setup_logging(logging_config):
+    """
+    Sets up the log file, console output and per frame rate limit described
+    by the logging section of the configuration file.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(logging_config.get('level', 'DEBUG').upper())
+    handlers = []
+
+    # Log to file
+    file_handler = logging.FileHandler(logging_config['file_path'])
+    file_handler.setFormatter(logging.Formatter(logging_config['file_format']))
+    handlers.append(file_handler)
+
+    # Log to console
+    if logging_config['log_to_console']:
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(logging_config['console_format']))
+        handlers.append(stream_handler)
+
+    # Write the log from a background thread, so that file and console I/O
+    # never holds up the caller
+    if logging_config.get('async', True):
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    # Limit messages logged for every frame
+    logger.addFilter(RateLimitFilter(burst=logging_config.get('per_frame_burst', 10),
+                                     interval=logging_config.get('per_frame_interval', 1.0)))
@@ -0,0 +1,241 @@
+"""
+Counters, gauges and latency histograms, exported in Prometheus text format
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from sat2rf1_tcpserver import logger
+
+"""
+Most metrics read a value the code keeps anyway (a counter attribute, the
+length of a queue) through a function that only runs when the metrics are
+exported, so nothing is added to the paths frames take. Histograms are the
+exception: recording a value is a few integer operations.
+"""
+
+"""
+Histogram resolution: every power of two is split in 2 ** (_SUB_BITS - 1)
+linear sub-buckets, so a recorded value is off by at most 1 / 16 (~6 %).
+"""
+_SUB_BITS = 5
+_SUB_HALF = 1 << (_SUB_BITS - 1)
+
+"""
+Bucket bounds, in seconds, in the exported histograms.
+"""
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in items) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A value that only goes up. Either inc() it, or give a function that
+    returns the current count.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=None, function=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.function = function
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        yield self.name, {}, self.get()
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, such as a queue depth. Either set() it,
+    or give a function that returns the current value.
+    """
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """
+    Latency histogram in the style of HdrHistogram: values are counted in
+    buckets that are linear within each power of two, which keeps the
+    relative error bounded from microseconds to minutes at a fixed cost per
+    recorded value.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=None, unit=1e-9):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.unit = unit  # Smallest value told apart, in seconds
+        self.count = 0
+        self.sum = 0.0
+        self._counts = []
+
+    @staticmethod
+    def _index(value):
+        if value < 2 * _SUB_HALF:
+            return value
+        shift = value.bit_length() - _SUB_BITS
+        return (shift << (_SUB_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def _upper_bound(index):
+        # Smallest value that no longer falls in bucket index.
+        if index < 2 * _SUB_HALF:
+            return index + 1
+        shift = (index >> (_SUB_BITS - 1)) - 1
+        return (index - (shift << (_SUB_BITS - 1)) + 1) << shift
+
+    def record(self, seconds):
+        """
+        Counts one value, in seconds.
+        """
+        value = int(seconds / self.unit) if seconds > 0 else 0
+        index = self._index(value)
+        counts = self._counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, percent):
+        """
+        Returns the value, in seconds, that percent of the recorded values
+        do not exceed (to the histogram's resolution), or None if empty.
+        """
+        if not self.count:
+            return None
+        rank = max(self.count * percent / 100, 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return self._upper_bound(index) * self.unit
+        return None
+
+    def samples(self):
+        cumulative = 0
+        index = 0
+        counts = self._counts
+        for bound in EXPORT_BOUNDS:
+            limit = bound / self.unit
+            while index < len(counts) and self._upper_bound(index) <= limit:
+                cumulative += counts[index]
+                index += 1
+            yield self.name + '_bucket', {'le': repr(bound)}, cumulative
+        yield self.name + '_bucket', {'le': '+Inf'}, self.count
+        yield self.name + '_sum', {}, self.sum
+        yield self.name + '_count', {}, self.count
+
+
+class Registry:
+    """
+    Collects metrics and renders them in the Prometheus text format.
+    Metrics with the same name and different labels are exported together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=None, function=None):
+        return self.register(Counter(name, help_text, labels, function))
+
+    def gauge(self, name, help_text, labels=None, function=None):
+        return self.register(Gauge(name, help_text, labels, function))
+
+    def histogram(self, name, help_text, labels=None):
+        return self.register(Histogram(name, help_text, labels))
+
+    def render(self):
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        families = {}
+        for metric in self._metrics:
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, metrics in families.items():
+            lines.append('# HELP {} {}'.format(name, metrics[0].help))
+            lines.append('# TYPE {} {}'.format(name, metrics[0].kind))
+            for metric in metrics:
+                for sample_name, extra, value in metric.samples():
+                    lines.append('{}{} {}'.format(sample_name, _format_labels(metric.labels, extra),
+                                                  _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_http(registry, host, port):
+    """
+    Serves registry.render() to every HTTP request on host:port, such as a
+    Prometheus scrape of /metrics, until cancelled.
+    """
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = registry.render().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                         b'Connection: close\r\n\r\n' + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+    async with server:
+        await server.serve_forever()
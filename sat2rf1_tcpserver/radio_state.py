@@ -0,0 +1,106 @@
+"""
+Cache of the last known radio settings
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+
+from .sat2rf1_constants import *
+
+"""
+Cached fields, by the command that reads them and the command that changes them.
+"""
+GET_FIELDS = {
+    GET_FREQUENCY: 'frequency',
+    GET_POWER: 'power',
+    GET_MODE: 'mode',
+    GET_CORR_COEF: 'corr_coef',
+    GET_RSSI: 'rssi',
+}
+SET_FIELDS = {
+    SET_FREQUENCY: 'frequency',
+    SET_POWER: 'power',
+    SET_MODE: 'mode',
+    SET_CORR_COEF: 'corr_coef',
+}
+FIELD_GETTERS = {name: command for command, name in GET_FIELDS.items()}
+
+
+class RadioState:
+    """
+    Last known value of every radio setting, with the time it was read.
+
+    Values are filled in from the radio's responses to GET_* commands, and
+    invalidated when the radio acknowledges a SET_* command for the same
+    setting, until it has been read again. Reading the cache never touches
+    the serial port.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._values = {}  # name -> (value, time read)
+
+    def update(self, name, value):
+        self._values[name] = value, self._clock()
+
+    def invalidate(self, name):
+        self._values.pop(name, None)
+
+    def get(self, name):
+        """
+        Returns (value, age in seconds), or None if the value is not known.
+        """
+        entry = self._values.get(name)
+        if entry is None:
+            return None
+        return entry[0], self._clock() - entry[1]
+
+    def snapshot(self):
+        """
+        Returns a dict of every known setting -> (value, age in seconds).
+        """
+        now = self._clock()
+        return {name: (value, now - read) for name, (value, read) in self._values.items()}
+
+    def stale(self, max_age, names=('frequency', 'power', 'mode', 'corr_coef')):
+        """
+        Returns the names that are unknown or older than max_age seconds.
+        """
+        now = self._clock()
+        return [name for name in names if name not in self._values or now - self._values[name][1] > max_age]
+
+    def handle_response(self, command, value):
+        """
+        Updates the cache from a decoded response to command.
+
+        :return: Name of the setting invalidated by a SET_* acknowledgement, or None.
+        """
+        if command in GET_FIELDS:
+            if command == GET_MODE:
+                value = value[0] if value else None
+            self.update(GET_FIELDS[command], value)
+        elif command in SET_FIELDS and value == 0:
+            self.invalidate(SET_FIELDS[command])
+            return SET_FIELDS[command]
+        return None
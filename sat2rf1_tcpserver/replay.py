@@ -0,0 +1,228 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import os
+import socket
+import sys
+import time
+import tty
+
+from .capture import FRAME, FROM_RADIO, RAW, TO_RADIO, CaptureError, read_capture
+from .codec import encode_frame
+from .framing import FramingError, framer_factory
+from .kiss import KissDecoder
+from .kiss_constants import DATA_FRAME
+
+"""
+Bytes joined into one write when replaying at maximum speed.
+"""
+BATCH_BYTES = 65536
+
+
+def serial_chunks(records, direction=FROM_RADIO):
+    """
+    Returns (timestamp_ns, bytes) to write to a serial port: the raw bytes
+    captured in direction, or its frames encoded again if the capture has
+    no raw bytes for it (as when the serial port was served by a thread or
+    process).
+    """
+    raw = [(record.timestamp_ns, record.data) for record in records
+           if record.direction == direction and record.kind == RAW]
+    if raw:
+        return raw
+    return [(record.timestamp_ns, encode_frame(record.data[:1], record.data[1:])) for record in records
+            if record.direction == direction and record.kind == FRAME]
+
+
+def data_payloads(records, direction=TO_RADIO):
+    """
+    Returns (timestamp_ns, payload) of every data frame captured in
+    direction, decoding the raw bytes if the capture has no frames for it.
+    """
+    frames = [(record.timestamp_ns, record.data) for record in records
+              if record.direction == direction and record.kind == FRAME]
+    if not frames:
+        decoder = KissDecoder()
+        for record in records:
+            if record.direction == direction and record.kind == RAW:
+                frames += [(record.timestamp_ns, frame) for frame in decoder.feed(record.data)]
+    return [(timestamp_ns, frame[1:]) for timestamp_ns, frame in frames if frame[:1] == DATA_FRAME]
+
+
+def replay(items, send, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+    """
+    Sends the data of (timestamp_ns, data) items with send(). With speed set,
+    items are sent as far apart as they were captured, divided by speed;
+    with speed 0 or None they are sent as fast as send() takes them, joined
+    in writes of up to BATCH_BYTES.
+
+    :return: Number of bytes sent.
+    """
+    sent = 0
+    if not speed:
+        batch = []
+        size = 0
+        for _, data in items:
+            batch.append(data)
+            size += len(data)
+            if size >= BATCH_BYTES:
+                send(b''.join(batch))
+                sent += size
+                batch = []
+                size = 0
+        if batch:
+            send(b''.join(batch))
+            sent += size
+        return sent
+
+    start = clock()
+    first = items[0][0] if items else 0
+    for timestamp_ns, data in items:
+        delay = start + (timestamp_ns - first) / 1e9 / speed - clock()
+        if delay > 0:
+            sleep(delay)
+        send(data)
+        sent += len(data)
+    return sent
+
+
+def _speed(value):
+    if value == 'max':
+        return 0.0
+    try:
+        speed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('speed must be a number or max')
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('speed must be positive')
+    return speed
+
+
+def _address(value):
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError('expected HOST:PORT')
+    return host, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sat2rf1_tcpserver replay',
+                                     description='Replays a capture file, as recorded with capture.enabled, '
+                                                 'into a serial port or the data port.')
+    parser.add_argument('capture', help='capture file')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--serial', metavar='PORT', help='write what the radio sent to this serial port')
+    target.add_argument('--pty', action='store_true',
+                        help='write what the radio sent to a new pseudo-terminal; point radio.port at the path '
+                             'printed')
+    target.add_argument('--tcp', metavar='HOST:PORT', type=_address,
+                        help='send the payloads sent to the radio to this data port')
+    parser.add_argument('--direction', choices=('from-radio', 'to-radio'),
+                        help='traffic to replay (default: from-radio to a serial port, to-radio to the data port)')
+    parser.add_argument('--speed', type=_speed, default=1.0,
+                        help='replay this many times faster than captured, or max (default: 1)')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the capture this many times (default: 1)')
+    parser.add_argument('--baud', type=int, default=115200, help='serial port baud rate (default: 115200)')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before replaying (default: 0, '
+                                                                 '5 with --pty)')
+    parser.add_argument('--framing', default='length', help='data port framing (default: length)')
+    parser.add_argument('--packet-length', type=int, help='message length for fixed framing')
+    args = parser.parse_args(argv)
+
+    try:
+        records = list(read_capture(args.capture))
+    except (OSError, CaptureError) as e:
+        parser.exit(1, '{}: {}\n'.format(parser.prog, e))
+    direction = args.direction or ('to-radio' if args.tcp else 'from-radio')
+    direction = TO_RADIO if direction == 'to-radio' else FROM_RADIO
+    delay = args.delay or (5.0 if args.pty else 0.0)
+
+    if args.tcp:
+        try:
+            framer = framer_factory(args.framing, args.packet_length)()
+            items = [(timestamp_ns, framer.encode(payload))
+                     for timestamp_ns, payload in data_payloads(records, direction)]
+        except FramingError as e:
+            parser.exit(1, '{}: {}\n'.format(parser.prog, e))
+        sock = socket.create_connection(args.tcp)
+        send = sock.sendall
+        close = sock.close
+    elif args.pty:
+        items = serial_chunks(records, direction)
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        print('Replaying on {}'.format(os.ttyname(slave)), file=sys.stderr)
+        os.set_blocking(master, False)
+
+        def drain():
+            # Throw away what the server writes to the radio, so it is never blocked.
+            try:
+                while os.read(master, 4096):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+
+        def send(data):
+            view = memoryview(data)
+            while view:
+                drain()
+                try:
+                    view = view[os.write(master, view):]
+                except BlockingIOError:
+                    time.sleep(0.001)
+
+        def close():
+            os.close(master)
+            os.close(slave)
+    else:
+        import serial
+
+        items = serial_chunks(records, direction)
+        interface = serial.Serial(port=args.serial, baudrate=args.baud)
+        send = interface.write
+        close = interface.close
+
+    time.sleep(delay)
+    start = time.monotonic()
+    sent = 0
+    try:
+        for _ in range(args.repeat):
+            sent += replay(items, send, args.speed)
+        elapsed = time.monotonic() - start
+        print('Replayed {} records, {} bytes in {:.3f} s'.format(len(items) * args.repeat, sent, elapsed),
+              file=sys.stderr)
+        if args.pty:
+            # Closing the pseudo-terminal would be an I/O error for the server reading it.
+            print('Keeping {} open until interrupted'.format(os.ttyname(slave)), file=sys.stderr)
+            while True:
+                drain()
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
@@ -25,47 +25,138 @@ Class providing higher level to the Sat2RF1 radio module
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
 
-from sat2rf1_tcpserver import logger, config
+import collections
+import select
+import time
 
-from .kiss import Kiss, FEND
+from sat2rf1_tcpserver import logger
+
+from .codec import encode_frame
+from .kiss import Kiss
+from .logs import PER_FRAME, Payload
+from .radio_state import FIELD_GETTERS, RadioState
+from .sat2rf1_commands import CommandEngine, CommandFailed, CommandTimeout, decode_response
 from .sat2rf1_constants import *
+from .scheduler import TransmitScheduler
+
+from .utils import radio_error_code_handler
+
+"""
+Keys in the radio section of the configuration file, and the Sat2rf1
+arguments they set.
+"""
+CONFIG_KEYS = {
+    'port': 'port',
+    'baud': 'baud',
+    'serial_timeout': 'timeout',
+    'io_thread': 'io_thread',
+    'io_process': 'io_process',
+    'write_linger': 'linger',
+    'write_max_bytes': 'max_write_bytes',
+    'command_timeout': 'command_timeout',
+    'command_retries': 'command_retries',
+    'air_bitrate': 'air_bitrate',
+    'radio_buffer': 'radio_buffer',
+    'transmit_queue_bytes': 'transmit_queue_bytes',
+}
 
-from .utils import recover_special_codes, escape_special_codes, radio_error_code_handler
+"""
+A frame from the radio: command byte, payload, the time.monotonic_ns() time
+it was read from the serial port and its sequence number. Data frames are
+numbered in the order they are handed on, from 0.
+"""
+RadioFrame = collections.namedtuple('RadioFrame', ['command', 'data', 'received_ns', 'sequence'])
 
-# Define parameters for serial communication
-baud = config['radio']['baud']
-port = config['radio']['port']
-serial_timeout = config['radio']['serial_timeout']
 
 class Sat2rf1:
     """
     Class for interfacing with the Sat2rf1 radio.
     """
 
-    def __init__(self):
+    max_reads_per_cycle = 64
+
+    def __init__(self, port, baud=115200, timeout=0.1, io_thread=False, linger=0.002, max_write_bytes=4096,
+                 command_timeout=0.5, command_retries=2, air_bitrate=9600, radio_buffer=2048,
+                 transmit_queue_bytes=1024 * 1024, io_process=False, dedup=None, capture=None):
         try:
-            self.kiss = Kiss(port=port, baud=baud, timeout=serial_timeout)
+            self.kiss = Kiss(port=port, baud=baud, timeout=timeout, io_thread=io_thread,
+                             linger=linger, max_write_bytes=max_write_bytes, io_process=io_process)
         except FileNotFoundError as e:
             logger.error('Could not find radio! Make sure it is connected.')
-            raise RadioError('Radio might not be connected: ' + e)
+            raise RadioError('Radio might not be connected: ' + str(e))
+        self.kiss.capture = capture  # CaptureWriter recording the serial traffic, if given
 
-        self._packets_waiting = []
-        self._response_waiting = []
+        self._packets_waiting = collections.deque()
+        self.counters = collections.Counter()  # data frames and bytes received and sent
+        self._sequence = 0  # Sequence number of the next data frame handed on
+        self.commands = CommandEngine(self.__write_frames, timeout=command_timeout, retries=command_retries)
+        self.state = RadioState()
+        self.scheduler = TransmitScheduler(air_bitrate, radio_buffer, transmit_queue_bytes, baud=baud)
+        self.dedup = dedup  # DedupCache dropping repeated data frames, may be shared by several radios
 
         # Get some information about the radio...
-        frames = []
-        frames.append(self.__build_frame(command=GET_FREQUENCY))
-        frames.append(self.__build_frame(command=GET_POWER))
-        frames.append(self.__build_frame(command=GET_MODE))
-        frames.append(self.__build_frame(command=GET_CORR_COEF))
-
-        for frame in frames:
-            self.__write_frame(frame)
+        self.refresh_status()
+
+    @classmethod
+    def from_config(cls, radio_config, **kwargs):
+        """
+        Connects to the radio described by the radio section of the
+        configuration file. Keyword arguments override the configuration.
+        """
+        arguments = {argument: radio_config[key] for key, argument in CONFIG_KEYS.items() if key in radio_config}
+        arguments.update(kwargs)
+        return cls(**arguments)
+
+    def request(self, command, data=b''):
+        """
+        Sends a command to the radio without waiting for the response.
+
+        :return: concurrent.futures.Future for the decoded response. Use
+                 wait() to block on it, or asyncio.wrap_future() to await it.
+        """
+        return self.commands.submit(command, self.__build_frame(command, data))
+
+    def refresh_status(self):
+        """
+        Asks the radio for frequency, power, mode and correlation coefficient
+        in a single write.
+
+        :return: dict of command byte -> future
+        """
+        commands = (GET_FREQUENCY, GET_POWER, GET_MODE, GET_CORR_COEF)
+        futures = self.commands.submit_many([(command, self.__build_frame(command)) for command in commands])
+        return dict(zip(commands, futures))
+
+    def wait(self, future, timeout=None):
+        """
+        Services the serial port until future is resolved, and returns its result.
+        Only for use outside the event loop, which services the port itself.
+
+        :raises RadioError: If the radio did not answer or reported an error.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not future.done():
             self.cycle()
+            self.commands.expire()
+            if future.done():
+                break
+            wake = self.commands.next_deadline()
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    raise RadioError('Timed out waiting for the radio')
+                wake = deadline if wake is None else min(wake, deadline)
+            select.select([self.fileno()], [], [], None if wake is None else max(wake - time.monotonic(), 0))
+        try:
+            return future.result()
+        except (CommandTimeout, CommandFailed) as e:
+            raise RadioError(str(e)) from e
 
-    def set_frequency(self, freq):
+    def set_frequency(self, freq, wait=True):
         """
         Sets frequency of the radio in Hertz.
+
+        :param wait: Block until the radio has acknowledged the new frequency.
+                     If False, a future for the acknowledgement is returned.
         """
         if freq < LOWER_FREQUENCY_LIMIT:
             raise RadioError("Frequency too low. Must be higher than " + str(int(LOWER_FREQUENCY_LIMIT / 1e6)) + " MHz")
@@ -74,31 +165,24 @@ class Sat2rf1:
                 "Frequency too high. Must be lower than " + str(int(UPPER_FREQUENCY_LIMIT / 1e6)) + " MHz")
 
         freq_in_bytes = int(freq).to_bytes(length=4, byteorder='big')  # freq must be int
+        future = self.request(SET_FREQUENCY, freq_in_bytes)
+        if not wait:
+            return future
         try:
-            # response = self.kiss.write_setting(setting=SET_FREQUENCY, value=freq_in_bytes)
-            response = self.kiss.create_frame(setting=SET_FREQUENCY, value=freq_in_bytes)
-            response = int.from_bytes(response, 'big')
-
-            if response != 0:
-                raise RadioError("Could not set frequency! Error code " + str(response))
-
-            else:
-                logger.info('Set frequency to ' + str(int(freq / 1e6)) + ' MHz.')
-
+            self.wait(future)
+            logger.info('Set frequency to ' + str(int(freq / 1e6)) + ' MHz.')
         except RadioError as e:
-            logger.error(e)
+            logger.error("Could not set frequency! " + str(e))
 
     def get_frequency(self):
         """
         Returns current carrier frequency.
         """
         try:
-            # response = self.kiss.write_setting(setting=GET_FREQUENCY, value=b'00000000')
-            response = self.kiss.create_frame(setting=GET_FREQUENCY, value=b'00000000')
-            freq = int.from_bytes(response, 'big')
+            freq = self.wait(self.request(GET_FREQUENCY))
             logger.info("Frequency is " + str(int(freq / 1e6)) + " MHz")
             return freq
-        except Exception as e:
+        except RadioError as e:
             logger.error("Could not get frequency from radio. " + str(e))
 
     def send_string(self, data):
@@ -108,7 +192,7 @@ class Sat2rf1:
         """
         Sets a transmitter mode
         """
-        self.__write_frame(self.__build_frame(SET_MODE, mode))
+        return self.request(SET_MODE, mode)
 
     def set_packet_receive_mode(self):
         """
@@ -140,8 +224,7 @@ class Sat2rf1:
         Returns current radio mode.
         """
         try:
-            # response = self.kiss.write_setting(setting=GET_MODE, value=b'00000000')
-            response = self.kiss.create_frame(setting=GET_MODE, value=b'00000000')
+            response = self.wait(self.request(GET_MODE))
 
             if response == PACKET_RECEIVE_MODE:
                 logger.info("Radio is in packet receive mode.")
@@ -153,17 +236,16 @@ class Sat2rf1:
                 logger.info("Radio is in transmit in progress mode.")
 
             return response
-        except Exception as e:
+        except RadioError as e:
             logger.error("Could not get radio mode. " + str(e))
 
     # TODO: Rough scetch. Test this. Data transmission uses DATA setting from KISS.
     def transmit_data(self, data):
         """
-        Pass data to the radio for transmission
+        Pass data to the radio for transmission. See transmit_batch().
         """
-        logger.debug("Creating a frame with a payload of {} bytes".format(len(data)))
-        self.kiss.create_frame(setting=DATA_FRAME, value=data)
-        self.kiss.write_frames_to_radio()
+        logger.debug("Creating a frame with a payload of %d bytes", len(data), extra=PER_FRAME)
+        self.transmit_batch([data])
 
         # try:
         # response = self.kiss.write_setting(setting=DATA, value=data)
@@ -177,6 +259,56 @@ class Sat2rf1:
         # except RadioError as e:
         #    logger.error(e)
 
+    def transmit_batch(self, payloads, received_at=None):
+        """
+        Pass a list of payloads to the radio for transmission. They are
+        handed to the radio as fast as it can send them on air (see
+        TransmitScheduler), and written together with anything else queued
+        within the write linger window. Call service_transmit() once
+        transmit_deadline() has passed.
+
+        :param received_at: time.monotonic() time the payloads were received, for latency measurements.
+        :return: Number of payloads queued; the rest were dropped as the queue is full.
+        """
+        accepted = self.scheduler.submit(payloads, received_at)
+        if accepted < len(payloads):
+            logger.warning('Transmit queue is full, dropping %d data frame(s)', len(payloads) - accepted,
+                           extra=PER_FRAME)
+        logger.debug("Queued %d data frame(s) for the radio, %d waiting", accepted, len(self.scheduler), extra=PER_FRAME)
+        self.service_transmit()
+        return accepted
+
+    def transmit_deadline(self):
+        """
+        Returns the time.monotonic() time by which service_transmit() should
+        be called, or None if nothing is waiting to be sent.
+        """
+        deadlines = [deadline for deadline in (self.kiss.flush_deadline(), self.scheduler.next_release())
+                     if deadline is not None]
+        return min(deadlines, default=None)
+
+    def service_transmit(self):
+        """
+        Passes the data frames the radio has room for on to the serial port,
+        and writes them out once the write linger window has closed.
+        """
+        released = self.scheduler.release()
+        if released:
+            payloads = [payload for payload, _ in released]
+            self.counters['frames_sent'] += len(payloads)
+            self.counters['bytes_sent'] += sum(len(payload) for payload in payloads)
+            self.kiss.write_data_frames(payloads, [received_at for _, received_at in released
+                                                   if received_at is not None])
+        deadline = self.kiss.flush_deadline()
+        if deadline is not None and deadline <= time.monotonic():
+            self.kiss.write_frames_to_radio()
+
+    def flush_transmit(self):
+        """
+        Writes every frame released for the radio in one write.
+        """
+        self.kiss.write_frames_to_radio()
+
     # TODO: Get data from KISS interface. Then send data to socket or validate command.
     def read_data_from_interface(self):
         """
@@ -221,33 +353,52 @@ class Sat2rf1:
         """
         Get the oldest message from the queue
 
-        :return: tuple (command, message)
+        :return: RadioFrame (command, message, received_ns, sequence)
         """
-        return self._packets_waiting.pop(0)
-
-    def __get_frame(self):
-        first_byte = self.kiss.interface.read(1)
-
-        if not first_byte == FEND:
-            logger.error('Frame desync! Returned frame might be incomplete')
-
-        payload = self.kiss.interface.read_until(FEND)
-
-        if payload[:1] == FEND:
-            logger.error('Frame desync! Lost at least one frame from radio.')
-            payload = self.kiss.interface.read_until(FEND)
+        return self._packets_waiting.popleft()
 
-        self.__unpack_and_stash_frame(payload)
+    def get_messages(self):
+        """
+        Get every message in the queue at once
 
-    def __unpack_and_stash_frame(self, payload):
-        payload = payload.replace(FEND, b'')
-        payload = recover_special_codes(payload)
+        :return: list of RadioFrame (command, message, received_ns, sequence), oldest first
+        """
+        packets = list(self._packets_waiting)
+        self._packets_waiting.clear()
+        return packets
+
+    def __get_frames(self):
+        # Keep reading until the port is drained, frames may still be arriving
+        # while the previous read is decoded. The bound keeps a radio that never
+        # goes quiet from starving the rest of the event loop.
+        for _ in range(self.max_reads_per_cycle):
+            frames = self.kiss.read_timed_frames()
+            if not frames:
+                break
+            for received_ns, payload in frames:
+                self.__unpack_and_stash_frame(payload, received_ns)
+
+    def __unpack_and_stash_frame(self, payload, received_ns):
+        # The decoder has already stripped FENDs and recovered special codes.
         package = payload[:1], payload[1:]
         if package[0] != b'\x00':
             self.__handle_response(package)
-            self._response_waiting.append(package)
+            invalidated = self.state.handle_response(package[0], decode_response(package[0], package[1]))
+            if not self.commands.handle_response(package[0], package[1]):
+                logger.warning('Response to command %s was not requested', package[0], extra=PER_FRAME)
+            if invalidated is not None:
+                # Read the new value back so the cache is filled in again.
+                self.request(FIELD_GETTERS[invalidated])
         else:
-            self._packets_waiting.append(package)
+            self.scheduler.received(len(package[1]))
+            self.counters['frames_received'] += 1
+            self.counters['bytes_received'] += len(package[1])
+            if self.dedup is not None and self.dedup.seen(package[1]):
+                self.counters['duplicates'] += 1
+                logger.debug('Dropping duplicate frame: %s', Payload(package[1]), extra=PER_FRAME)
+                return
+            self._packets_waiting.append(RadioFrame(package[0], package[1], received_ns, self._sequence))
+            self._sequence += 1
 
     def __handle_response(self, package):
         command = package[0]
@@ -270,7 +421,7 @@ class Sat2rf1:
         elif command == GET_RSSI:
             logger.info('RSSI level of last transmission: {}dBm'.format(arg_int))
 
-        elif command == SET_MODE or SET_POWER or SET_CORR_COEF or SET_FREQUENCY:
+        elif command in (SET_MODE, SET_POWER, SET_CORR_COEF, SET_FREQUENCY):
             radio_error_code_handler(command, argument)
 
         else:
@@ -307,29 +458,41 @@ class Sat2rf1:
         logger.info('Radio mode: {}'.format(mode))
 
     def __build_frame(self, command=b'\x00', data=b''):
-        escape_special_codes(data)
-        return FEND + command + data + FEND
+        return encode_frame(command, data)
 
-    def __write_frame(self, frame):
-        return self.kiss.interface.write(frame)
+    def __write_frames(self, frames):
+        # Commands are not held back, they go out ahead of any data frames
+        # waiting in the linger window, in the same write.
+        self.kiss.queue_write(b''.join(frames), len(frames), urgent=True)
+        self.kiss.write_frames_to_radio()
+
+    def fileno(self):
+        """
+        Returns a file descriptor that becomes readable when cycle() has frames to read.
+        """
+        return self.kiss.fileno()
 
     def has_data(self):
         """
-        Returns the number of bytes waiting on the serial port.
+        Returns the number of bytes waiting to be read from the radio, see Kiss.in_waiting().
         One frame is at least three bytes.
 
         :return: Number of bytes
         """
-        return self.kiss.interface.in_waiting
+        return self.kiss.in_waiting()
 
     def cycle(self):
         """
-        Check the serial interface for frames, add incoming frames to queue
+        Check the serial interface for frames and add every complete frame
+        already buffered to the queue
 
-        :return: Number of frames in queue
+        :return: Messages in queue, i.e. the batch get_messages() will return
         """
-        if self.has_data() >= 3:  # Minimum length of a complete frame
-            self.__get_frame()  # Reads one frame from the radio and adds it to the queue
+        self.__get_frames()  # Reads every frame waiting on the radio and adds them to the queue
+
+        deadline = self.transmit_deadline()
+        if deadline is not None and deadline <= time.monotonic():
+            self.service_transmit()
 
         return self._packets_waiting
 
@@ -1,5 +1,5 @@
 """
-Enum for radio settings. To be implemented.
+Enum for radio settings, and the engine matching radio responses to the commands that caused them.
 """
 
 #  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
@@ -23,6 +23,12 @@ Enum for radio settings. To be implemented.
 #
 #  You should have received a copy of the GNU General Public License
 #  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import collections
+import concurrent.futures
+import time
+
+from sat2rf1_tcpserver import logger
+from sat2rf1_tcpserver.logs import PER_FRAME
 from sat2rf1_tcpserver.sat2rf1_constants import *
 
 DIR_TO_RADIO = 0
@@ -43,3 +49,183 @@ class Sat2rf1Command:
     @staticmethod
     def decode_uint8(value):
         int.from_bytes(value, False)
+
+
+SET_COMMANDS = (SET_FREQUENCY, SET_POWER, SET_CORR_COEF, SET_MODE)
+
+
+def decode_response(command, argument):
+    """
+    Decodes the argument of a response from the radio.
+
+    :return: Frequency in Hz, power or RSSI in dBm, correlation coefficient
+             as an int, mode as the raw mode byte, or the status byte (as an
+             int, 0 meaning OK) for SET_* commands.
+    """
+    if command in (GET_POWER, GET_RSSI):
+        return int.from_bytes(argument, byteorder='big', signed=True)
+    if command == GET_MODE:
+        return bytes(argument)
+    return int.from_bytes(argument, byteorder='big', signed=False)
+
+
+class _PendingCommand:
+    __slots__ = ('command', 'frame', 'future', 'deadline', 'retries', 'attempts')
+
+    def __init__(self, command, frame, future, deadline, retries):
+        self.command = command
+        self.frame = frame
+        self.future = future
+        self.deadline = deadline
+        self.retries = retries
+        self.attempts = 1
+
+
+class CommandEngine:
+    """
+    Pipelines commands to the radio and matches each response to its request.
+
+    Commands are written back-to-back without waiting for earlier responses.
+    The radio answers with the command byte of the request, so a response is
+    matched to the oldest outstanding request with the same command byte.
+    Every request gets a concurrent.futures.Future that resolves to the
+    decoded response (see decode_response()). A request that is not answered
+    within timeout seconds is written again, up to retries times, before its
+    future fails with CommandTimeout. SET_* requests fail with CommandFailed
+    if the radio reports an error.
+
+    A retried request keeps its place in line, so a late answer to its first
+    attempt still resolves it. Once a retried request is resolved or has
+    failed, the radio may still answer its other attempts; for one timeout
+    after its last attempt, that many answers to the same command are
+    dropped as stale instead of resolving the requests queued behind it.
+
+    write is called with a list of complete frames to send to the radio.
+    expire() has to be called after next_deadline() for timeouts to fire.
+    """
+
+    def __init__(self, write, timeout=0.5, retries=2, clock=time.monotonic):
+        self.timeout = timeout
+        self.retries = retries
+        self.on_submit = None  # Called after every submit, e.g. to reschedule expire()
+        self._write = write
+        self._clock = clock
+        self._pending = collections.defaultdict(collections.deque)
+        self._stale = {}  # command -> [answers still expected for resolved requests, until when]
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._pending.values())
+
+    def submit(self, command, frame):
+        """
+        Sends a command frame to the radio.
+
+        :return: Future for the decoded response.
+        """
+        return self.submit_many([(command, frame)])[0]
+
+    def submit_many(self, commands):
+        """
+        Sends several command frames to the radio in one write.
+
+        :param commands: List of (command byte, frame) tuples.
+        :return: List of futures, one per command.
+        """
+        deadline = self._clock() + self.timeout
+        futures = []
+        for command, frame in commands:
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            self._pending[command].append(_PendingCommand(command, frame, future, deadline, self.retries))
+            futures.append(future)
+        self._write([frame for _, frame in commands])
+        if self.on_submit is not None:
+            self.on_submit()
+        return futures
+
+    def handle_response(self, command, argument):
+        """
+        Resolves the oldest outstanding request for command.
+
+        :return: True if the response matched a request.
+        """
+        stale = self._stale.get(command)
+        if stale is not None:
+            if stale[1] > self._clock():
+                stale[0] -= 1
+                if not stale[0]:
+                    del self._stale[command]
+                logger.debug('Dropping stale response to retried command 0x%02x', command[0], extra=PER_FRAME)
+                return True
+            del self._stale[command]
+        queue = self._pending.get(command)
+        if not queue:
+            return False
+        pending = queue.popleft()
+        if pending.attempts > 1:
+            self._expect_stale(command, pending.attempts - 1, pending.deadline)
+        value = decode_response(command, argument)
+        if command in SET_COMMANDS and value != 0:
+            pending.future.set_exception(CommandFailed(command, value))
+        else:
+            pending.future.set_result(value)
+        return True
+
+    def _expect_stale(self, command, count, until):
+        stale = self._stale.setdefault(command, [0, until])
+        stale[0] += count
+        stale[1] = max(stale[1], until)
+
+    def next_deadline(self):
+        """
+        Returns when the next request times out, or None if nothing is outstanding.
+        """
+        deadlines = [pending.deadline for queue in self._pending.values() for pending in queue]
+        return min(deadlines) if deadlines else None
+
+    def expire(self, now=None):
+        """
+        Retries or fails every request whose deadline has passed.
+        """
+        now = self._clock() if now is None else now
+        resend = []
+        for command, queue in self._pending.items():
+            if not any(pending.deadline <= now for pending in queue):
+                continue
+            waiting = collections.deque()
+            for pending in queue:
+                if pending.deadline > now:
+                    waiting.append(pending)
+                elif pending.retries > 0:
+                    # Retried in place, ahead of requests made after it.
+                    pending.retries -= 1
+                    pending.attempts += 1
+                    pending.deadline = now + self.timeout
+                    waiting.append(pending)
+                    resend.append(pending)
+                else:
+                    logger.error('No response from radio to command 0x%02x', pending.command[0], extra=PER_FRAME)
+                    pending.future.set_exception(CommandTimeout(pending.command))
+                    self._expect_stale(command, pending.attempts, now + self.timeout)
+            self._pending[command] = waiting
+        for pending in resend:
+            logger.warning('Retrying command 0x%02x', pending.command[0], extra=PER_FRAME)
+        if resend:
+            self._write([pending.frame for pending in resend])
+
+
+class CommandTimeout(Exception):
+    """The radio did not answer a command."""
+
+    def __init__(self, command):
+        super().__init__('No response to command 0x{:02x}'.format(command[0]))
+        self.command = command
+
+
+class CommandFailed(Exception):
+    """The radio answered a SET_* command with an error code."""
+
+    def __init__(self, command, status):
+        super().__init__('Command 0x{:02x} failed with error code {}'.format(command[0], status))
+        self.command = command
+        self.status = status
@@ -51,6 +51,12 @@ Carrier frequency limits
 LOWER_FREQUENCY_LIMIT = 430e6  # Hertz
 UPPER_FREQUENCY_LIMIT = 440e6  # Hertz
 
+"""
+Over-the-air framing overhead added to every frame, in bytes (preamble,
+sync word, AX.25 flags and CRC).
+"""
+AIR_OVERHEAD = 16
+
 """
 Transmitter operational modes
 """
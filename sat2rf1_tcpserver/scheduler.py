@@ -0,0 +1,144 @@
+"""
+Paces data frames to the radio at the rate it can send them on air
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import time
+
+from .sat2rf1_constants import AIR_OVERHEAD
+
+
+class TransmitScheduler:
+    """
+    Holds data frames back until the radio has room for them.
+
+    The radio sends frames at air_bitrate, much slower than they arrive over
+    the serial port, and only buffers radio_buffer bytes. The scheduler keeps
+    track of when the radio will be done with every frame it was given, and
+    only releases a frame once the radio's buffer can take it. With baud
+    set, a frame is not expected to go on air before it has crossed the
+    serial port at that rate. Frames are
+    released in order; up to max_queue_bytes of them wait here, and newer
+    frames are refused while the queue is full.
+
+    Command frames do not pass through the scheduler, they are written to
+    the radio at once and so never queue behind data.
+    """
+
+    def __init__(self, air_bitrate=9600, radio_buffer=2048, max_queue_bytes=1024 * 1024,
+                 frame_overhead=AIR_OVERHEAD, baud=None, clock=time.monotonic):
+        self.air_bitrate = air_bitrate
+        self.baud = baud
+        self.radio_buffer = radio_buffer
+        self.max_queue_bytes = max_queue_bytes
+        self.frame_overhead = frame_overhead
+        self.clock = clock
+        self.queued_bytes = 0
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._air_free_at = 0.0  # When the radio will have sent everything released so far
+        self._serial_free_at = 0.0  # When everything released so far has reached the radio
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _air_bytes(self, payload_length):
+        return payload_length + self.frame_overhead
+
+    def buffered(self, now=None):
+        """
+        Returns how many bytes the radio is estimated to hold, not yet sent.
+        """
+        now = self.clock() if now is None else now
+        return max(self._air_free_at - now, 0) * self.air_bitrate / 8
+
+    def submit(self, payloads, received_at=None):
+        """
+        Queues data frame payloads for the radio.
+
+        :param received_at: time.monotonic() time the payloads were received,
+                            handed back by release() for latency measurements.
+        :return: Number of payloads queued; the rest did not fit and were dropped.
+        """
+        accepted = 0
+        for payload in payloads:
+            if self.queued_bytes + len(payload) > self.max_queue_bytes:
+                self.dropped += len(payloads) - accepted
+                break
+            self._queue.append((payload, received_at))
+            self.queued_bytes += len(payload)
+            accepted += 1
+        return accepted
+
+    def release(self, now=None):
+        """
+        Takes as many payloads off the queue as the radio has room for.
+
+        :return: List of (payload, received_at) to write to the radio now, oldest first.
+        """
+        now = self.clock() if now is None else now
+        queue = self._queue
+        released = []
+        air_free_at = max(self._air_free_at, now)
+        serial_free_at = max(self._serial_free_at, now)
+        buffered = (air_free_at - now) * self.air_bitrate / 8
+        while queue:
+            size = self._air_bytes(len(queue[0][0]))
+            # A frame larger than the whole buffer still goes out once the radio is idle.
+            if buffered + size > self.radio_buffer and buffered > 0:
+                break
+            entry = queue.popleft()
+            payload = entry[0]
+            self.queued_bytes -= len(payload)
+            released.append(entry)
+            if self.baud:
+                # FENDs and command byte; 8N1 puts ten bits on the wire per byte.
+                serial_free_at += (len(payload) + 3) * 10 / self.baud
+                air_free_at = max(air_free_at, serial_free_at)
+            air_free_at += size * 8 / self.air_bitrate
+            buffered = (air_free_at - now) * self.air_bitrate / 8
+        self._air_free_at = air_free_at
+        self._serial_free_at = serial_free_at
+        return released
+
+    def received(self, payload_length, now=None):
+        """
+        Accounts for a frame the radio just received. The radio is half
+        duplex, so frames waiting to be sent were held up while it listened.
+        """
+        now = self.clock() if now is None else now
+        airtime = self._air_bytes(payload_length) * 8 / self.air_bitrate
+        if self._air_free_at > now - airtime:
+            self._air_free_at += airtime
+
+    def next_release(self):
+        """
+        Returns the clock() time at which the next queued payload will fit in
+        the radio's buffer, or None if the queue is empty.
+        """
+        if not self._queue:
+            return None
+        room_needed = self.radio_buffer - self._air_bytes(len(self._queue[0][0]))
+        return self._air_free_at - max(room_needed, 0) * 8 / self.air_bitrate
@@ -0,0 +1,328 @@
+"""
+Dedicated thread or process owning the serial port of a Kiss interface
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import multiprocessing
+import os
+import select
+import struct
+import threading
+import time
+
+from sat2rf1_tcpserver import logger
+from .shm_ring import ShmRing
+
+"""
+The serial process puts the time.monotonic_ns() time each frame was read in
+front of it in the receive ring, in this format.
+"""
+_STAMP = struct.Struct('>Q')
+
+
+def _wakeup_pipe():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    return read_fd, write_fd
+
+
+def _notify(fd):
+    try:
+        os.write(fd, b'\x00')
+    except BlockingIOError:
+        pass  # The pipe is full, so the other side is already awake.
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+class SerialThread(threading.Thread):
+    """
+    Owns a serial port so that UART reads and writes never block the network loop.
+
+    The thread waits on the port and reads whatever is waiting in one block,
+    runs it through the KISS decoder and appends the frames, with the time
+    they were read, to a receive deque. Data to write is appended to a transmit deque. Each deque has a
+    single producer and a single consumer, and append()/popleft() are atomic,
+    so the two sides never take a lock. A pipe wakes the network loop when
+    frames arrive (see fileno()), and another pipe wakes this thread when
+    there is data to write.
+    """
+
+    def __init__(self, interface, decoder, read_size=4096):
+        super().__init__(name='serial-io', daemon=True)
+        self.interface = interface
+        self.decoder = decoder
+        self.read_size = read_size
+
+        self._rx = collections.deque()
+        self._tx = collections.deque()
+        self._rx_wake_r, self._rx_wake_w = _wakeup_pipe()
+        self._tx_wake_r, self._tx_wake_w = _wakeup_pipe()
+        self._running = False
+
+    def fileno(self):
+        """
+        Returns a file descriptor that becomes readable when frames are waiting.
+        """
+        return self._rx_wake_r
+
+    def read_frames(self):
+        """
+        Takes every decoded frame handed over by the thread so far.
+
+        :return: List of (time.monotonic_ns() time read, frame), oldest first.
+        """
+        _drain(self._rx_wake_r)
+        rx = self._rx
+        return [rx.popleft() for _ in range(len(rx))]
+
+    def in_waiting(self):
+        """
+        Returns the number of bytes of decoded frames waiting to be read.
+        """
+        # list() copies the deque in one step, while the thread may append to it.
+        return sum(len(frame) for _, frame in list(self._rx))
+
+    def write(self, data):
+        """
+        Queues data to be written to the serial port by the thread.
+        """
+        self._tx.append(data)
+        _notify(self._tx_wake_w)
+
+    def start(self):
+        self._running = True
+        super().start()
+
+    def stop(self):
+        """
+        Stops the thread and waits for it to finish writing.
+        """
+        self._running = False
+        _notify(self._tx_wake_w)
+        self.join()
+        for fd in (self._rx_wake_r, self._rx_wake_w, self._tx_wake_r, self._tx_wake_w):
+            os.close(fd)
+
+    def run(self):
+        serial_fd = self.interface.fileno()
+        try:
+            while self._running:
+                readable, _, _ = select.select([serial_fd, self._tx_wake_r], [], [])
+                if self._tx_wake_r in readable:
+                    _drain(self._tx_wake_r)
+                    self._write_pending()
+                if serial_fd in readable:
+                    self._read_available()
+            self._write_pending()
+        except Exception:
+            logger.critical('Serial thread stopped by an unexpected error:\n', exc_info=True)
+
+    def _write_pending(self):
+        tx = self._tx
+        if tx:
+            self.interface.write(b''.join([tx.popleft() for _ in range(len(tx))]))
+
+    def _read_available(self):
+        data = self.interface.read(min(max(self.interface.in_waiting, 1), self.read_size))
+        if not data:
+            return
+        read_ns = time.monotonic_ns()
+        frames = self.decoder.feed(data)
+        if frames:
+            self._rx.extend([(read_ns, frame) for frame in frames])
+            _notify(self._rx_wake_w)
+
+
+class SerialProcess:
+    """
+    Owns a serial port from a separate process, so that UART servicing and
+    KISS decoding never wait for the network loop, and the other way around.
+
+    Works like SerialThread, but frames cross between the processes through
+    two ShmRings in shared memory instead of deques, so they are never
+    pickled. A pipe next to each ring wakes its consumer. Closing the pipe
+    that wakes the serial process tells it to stop.
+    """
+
+    def __init__(self, port, baud, timeout, ring_size=1024 * 1024, read_size=4096):
+        self.port = port
+        context = multiprocessing.get_context('spawn')
+        self._rx = ShmRing(size=ring_size)
+        self._tx = ShmRing(size=ring_size)
+        self._rx_wake_r, self._rx_wake_w = context.Pipe(duplex=False)
+        self._tx_wake_r, self._tx_wake_w = context.Pipe(duplex=False)
+        for pipe in (self._rx_wake_r, self._rx_wake_w, self._tx_wake_r, self._tx_wake_w):
+            os.set_blocking(pipe.fileno(), False)
+        self._ready_r, ready_w = context.Pipe(duplex=False)
+        self._desyncs = context.Value('Q', 0, lock=False)
+        self._process = context.Process(target=_serve_serial, name='serial-io', daemon=True,
+                                        args=(port, baud, timeout, self._rx.name, self._tx.name, self._rx_wake_w,
+                                              self._tx_wake_r, ready_w, self._desyncs, read_size))
+        self._ready_w = ready_w
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    @property
+    def desyncs(self):
+        """
+        Frame desyncs counted by the decoder in the serial process.
+        """
+        return self._desyncs.value
+
+    def start(self, timeout=10.0):
+        """
+        Starts the process and waits for it to open the serial port.
+        Raises whatever opening the port raised in the process.
+        """
+        self._process.start()
+        # The process has its own copies of these now.
+        for pipe in (self._rx_wake_w, self._tx_wake_r, self._ready_w):
+            pipe.close()
+        if not self._ready_r.poll(timeout):
+            self.stop()
+            raise TimeoutError('Serial process did not open {}'.format(self.port))
+        try:
+            error = self._ready_r.recv()
+        except EOFError:
+            error = OSError('Serial process exited while opening {}'.format(self.port))
+        self._ready_r.close()
+        if error is not None:
+            self.stop()
+            raise error
+
+    def stop(self):
+        """
+        Stops the process and waits for it to finish writing.
+        """
+        if not self._tx_wake_w.closed:
+            self._tx_wake_w.close()
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._rx_wake_r.close()
+        self._rx.close()
+        self._tx.close()
+
+    def fileno(self):
+        """
+        Returns a file descriptor that becomes readable when frames are waiting.
+        """
+        return self._rx_wake_r.fileno()
+
+    def read_frames(self):
+        """
+        Takes every decoded frame handed over by the process so far.
+
+        :return: List of (time.monotonic_ns() time read, frame), oldest first.
+        """
+        _drain(self._rx_wake_r.fileno())
+        unpack = _STAMP.unpack_from
+        stamp_size = _STAMP.size
+        return [(unpack(item)[0], item[stamp_size:]) for item in self._rx.get_all()]
+
+    def in_waiting(self):
+        """
+        Returns the number of bytes waiting in the receive ring, time stamps and record lengths included.
+        """
+        return len(self._rx)
+
+    def write(self, data):
+        """
+        Queues data to be written to the serial port by the process.
+        """
+        if not self._tx.put(data):
+            # Data frames are paced to the radio, so this only happens if
+            # the process has stopped writing.
+            logger.error('Serial process is not keeping up, dropping %d bytes.', len(data))
+            return
+        _notify(self._tx_wake_w.fileno())
+
+
+def _serve_serial(port, baud, timeout, rx_name, tx_name, rx_wake, tx_wake, ready, desyncs, read_size):
+    """
+    Body of the process started by SerialProcess.
+    """
+    import serial
+    from .kiss import KissDecoder
+
+    try:
+        interface = serial.Serial(port=port, baudrate=baud, timeout=timeout)
+    except Exception as e:
+        ready.send(e)
+        return
+    rx = ShmRing(rx_name)
+    tx = ShmRing(tx_name)
+    ready.send(None)
+    ready.close()
+
+    decoder = KissDecoder()
+    serial_fd = interface.fileno()
+    tx_fd = tx_wake.fileno()
+    pending = collections.deque()  # Frames waiting for room in the receive ring
+    try:
+        while True:
+            # Retry frames that did not fit while the other side catches up.
+            readable, _, _ = select.select([serial_fd, tx_fd], [], [], 0.01 if pending else None)
+            if tx_fd in readable:
+                try:
+                    if not os.read(tx_fd, 4096):
+                        break  # SerialProcess.stop() closed the pipe
+                except BlockingIOError:
+                    pass
+                data = tx.get_all()
+                if data:
+                    interface.write(b''.join(data))
+            if serial_fd in readable:
+                data = interface.read(min(max(interface.in_waiting, 1), read_size))
+                if data:
+                    stamp = _STAMP.pack(time.monotonic_ns())
+                    pending.extend([stamp + frame for frame in decoder.feed(data)])
+                    desyncs.value = decoder.desyncs
+            if pending:
+                count = rx.put_many(pending)
+                if count:
+                    for _ in range(count):
+                        pending.popleft()
+                    _notify(rx_wake.fileno())
+        data = tx.get_all()
+        if data:
+            interface.write(b''.join(data))
+    except Exception:
+        logger.critical('Serial process stopped by an unexpected error:\n', exc_info=True)
+    finally:
+        interface.close()
+        rx.close()
+        tx.close()
@@ -0,0 +1,199 @@
+"""
+Command handler for the settings port
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from sat2rf1_tcpserver import logger
+from .doppler import DopplerError
+from .radio_state import FIELD_GETTERS
+from .sat2rf1 import RadioError
+from .sat2rf1_constants import *
+
+"""
+Settings that can be changed from the settings port, with the command that
+changes them and the encoding of the value.
+"""
+SETTERS = {
+    'frequency': (SET_FREQUENCY, lambda value: int(value).to_bytes(4, 'big')),
+    'power': (SET_POWER, lambda value: int(value).to_bytes(1, 'big', signed=True)),
+    'mode': (SET_MODE, lambda value: int(value).to_bytes(1, 'big')),
+    'corr_coef': (SET_CORR_COEF, lambda value: int(value).to_bytes(1, 'big')),
+}
+
+
+class SettingsHandler:
+    """
+    Serves the line based settings protocol described in protocol.md.
+
+    Queries are answered from the radio's state cache, so any number of
+    clients can poll the settings without adding traffic on the serial port.
+    """
+
+    def __init__(self, radio, connection, metrics=None, doppler=None):
+        self.radio = radio
+        self.connection = connection
+        self.metrics = metrics  # Registry served by the METRICS command, if any
+        self.doppler = doppler  # DopplerScheduler driven by the DOPPLER command, if any
+
+    def handle(self, line, data_pointer):
+        """
+        Handles one line received from a settings client.
+        """
+        words = line.decode('ascii', errors='replace').split()
+        try:
+            if not words:
+                raise SettingsError('empty command')
+            command = words[0].upper()
+            if command == 'METRICS' and len(words) == 1:
+                if self.metrics is None:
+                    raise SettingsError('metrics disabled')
+                self._reply(data_pointer, self.metrics.render().splitlines())
+                return
+            if self.radio is None:
+                raise SettingsError('no radio')
+            if command == 'STATUS' and len(words) == 1:
+                self._reply(data_pointer, self._status(FIELD_GETTERS))
+            elif command == 'GET' and len(words) == 2:
+                self._reply(data_pointer, self._status([self._field(words[1])]))
+            elif command == 'SET' and len(words) == 3:
+                self._set(self._field(words[1], SETTERS), words[2], data_pointer)
+            elif command == 'DOPPLER':
+                self._doppler(words, line, data_pointer)
+            else:
+                raise SettingsError('unknown command')
+        except SettingsError as e:
+            self._reply(data_pointer, [], error=str(e))
+
+    @staticmethod
+    def _field(name, fields=FIELD_GETTERS):
+        name = name.lower()
+        if name not in fields:
+            raise SettingsError('unknown setting {}'.format(name))
+        return name
+
+    def _status(self, names):
+        lines = []
+        for name in names:
+            entry = self.radio.state.get(name)
+            if entry is None:
+                lines.append('{} unknown'.format(name))
+            else:
+                lines.append('{} {} {:.3f}'.format(name, entry[0], entry[1]))
+        return lines
+
+    def _set(self, name, value, data_pointer):
+        command, encode = SETTERS[name]
+        try:
+            if name == 'frequency':
+                future = self.radio.set_frequency(int(value), wait=False)
+            else:
+                future = self.radio.request(command, encode(value))
+        except (ValueError, OverflowError):
+            raise SettingsError('invalid value {}'.format(value))
+        except RadioError as e:
+            raise SettingsError(str(e))
+
+        def done(future):
+            error = future.exception()
+            self._reply(data_pointer, [], error=None if error is None else str(error))
+
+        future.add_done_callback(done)
+
+    def _doppler(self, words, line, data_pointer):
+        if self.doppler is None:
+            raise SettingsError('doppler disabled')
+        doppler = self.doppler
+        action = words[1].upper() if len(words) > 1 else 'STATUS'
+        if action == 'STATUS' and len(words) <= 2:
+            entry = doppler.next_entry()
+            self._reply(data_pointer, [
+                'entries {}'.format(len(doppler)),
+                'next {:.3f} {}'.format(*entry) if entry is not None else 'next none',
+                'frequency {}'.format(doppler.last_frequency if doppler.last_frequency is not None else 'unknown'),
+                'sent {}'.format(doppler.counters['sent']),
+                'skipped {}'.format(doppler.counters['skipped']),
+                'failed {}'.format(doppler.counters['failed'])])
+        elif action == 'STOP' and len(words) == 2:
+            doppler.stop()
+            self._reply(data_pointer, [])
+        elif action == 'TABLE' and len(words) > 2:
+            try:
+                table = [(float(when), int(frequency))
+                         for when, _, frequency in (word.partition(':') for word in words[2:])]
+                doppler.load(table, replace=False)
+            except ValueError:
+                raise SettingsError('invalid table')
+            except DopplerError as e:
+                raise SettingsError(str(e))
+            self._reply(data_pointer, [])
+        elif action == 'TLE' and len(words) > 3:
+            # The TLE lines have fixed columns, so they are taken from the
+            # line as it is rather than from its words.
+            try:
+                frequency = int(words[2])
+            except ValueError:
+                raise SettingsError('invalid value {}'.format(words[2]))
+            elements = line.decode('ascii', errors='replace').split(None, 3)[3]
+            line1, line2 = elements[:69], elements[69:].strip()
+            # Computing a pass takes tens of milliseconds, too long to hold up the event loop.
+            future = asyncio.get_running_loop().run_in_executor(None, doppler.plan_pass, frequency, line1, line2)
+
+            def done(future):
+                try:
+                    table = future.result()
+                    doppler.load(table)
+                except DopplerError as e:
+                    self._reply(data_pointer, [], error=str(e))
+                    return
+                except Exception as e:
+                    # Elements that parse but describe no sensible orbit may fail anywhere in SGP4.
+                    logger.exception('Could not compute Doppler correction')
+                    self.reply_error(data_pointer, str(e) or 'invalid elements')
+                    return
+                logger.info('Doppler correction from %d to %d Hz between %s and %s', table[0][1], table[-1][1],
+                            time.strftime('%H:%M:%S', time.gmtime(table[0][0])),
+                            time.strftime('%H:%M:%S', time.gmtime(table[-1][0])))
+                self._reply(data_pointer, ['pass {:.3f} {:.3f}'.format(table[0][0], table[-1][0])])
+
+            future.add_done_callback(done)
+        else:
+            raise SettingsError('unknown command')
+
+    def reply_error(self, data_pointer, reason):
+        """
+        Answers a command with ERROR, e.g. one that failed unexpectedly.
+        """
+        self._reply(data_pointer, [], error=' '.join(reason.split()))
+
+    def _reply(self, data_pointer, lines, error=None):
+        lines.append('OK' if error is None else 'ERROR ' + error)
+        self.connection.send_batch([line.encode('ascii', errors='replace') for line in lines], data_pointer)
+
+
+class SettingsError(Exception):
+    """Settings Error."""
+    pass
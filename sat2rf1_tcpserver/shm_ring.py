@@ -0,0 +1,148 @@
+"""
+Shared memory ring buffer for the serial I/O process
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+from multiprocessing import shared_memory
+
+"""
+Layout of the shared memory: the write position, the capacity, and on its
+own cache line the read position, followed by the records. Positions count
+bytes since the ring was created and never wrap; the offset of a position
+in the ring is position % capacity.
+"""
+_HEAD = 0
+_CAPACITY = 8
+_TAIL = 64
+_DATA = 128
+
+_POSITION = struct.Struct('<Q')
+_LENGTH = struct.Struct('<I')
+
+
+class ShmRing:
+    """
+    Single producer, single consumer ring of byte records in shared memory.
+
+    One process creates the ring and hands name to the other, which attaches
+    to it with ShmRing(name). Each record is stored as its length and its
+    bytes, so nothing is pickled on the way. The producer only ever writes
+    the write position and the consumer the read position, and each does so
+    after the records are in place, so neither side takes a lock. Neither
+    side blocks either: put() refuses records that do not fit, and the
+    caller decides what to do with them.
+
+    Pair the ring with a pipe to wake the consumer, see serial_io.SerialProcess.
+    """
+
+    def __init__(self, name=None, size=1024 * 1024):
+        self.owner = name is None
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=_DATA + size)
+            _POSITION.pack_into(self._shm.buf, _CAPACITY, size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        self.capacity = _POSITION.unpack_from(self._buf, _CAPACITY)[0]
+        self._data = self._buf[_DATA:_DATA + self.capacity]
+
+    def __len__(self):
+        """
+        Returns the number of bytes in use, record lengths included.
+        """
+        return _POSITION.unpack_from(self._buf, _HEAD)[0] - _POSITION.unpack_from(self._buf, _TAIL)[0]
+
+    def _write(self, position, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self._data[offset:offset + first] = data[:first]
+        if first < len(data):
+            self._data[:len(data) - first] = data[first:]
+
+    def _read(self, position, length):
+        offset = position % self.capacity
+        if offset + length <= self.capacity:
+            return bytes(self._data[offset:offset + length])
+        first = self.capacity - offset
+        return bytes(self._data[offset:]) + bytes(self._data[:length - first])
+
+    def put(self, record):
+        """
+        Appends one record.
+
+        :return: False if it does not fit, True otherwise.
+        """
+        return self.put_many([record]) == 1
+
+    def put_many(self, records):
+        """
+        Appends records, oldest first, until one does not fit. The write
+        position is published once for all of them.
+
+        :return: Number of records appended.
+        """
+        head = _POSITION.unpack_from(self._buf, _HEAD)[0]
+        free = self.capacity - (head - _POSITION.unpack_from(self._buf, _TAIL)[0])
+        count = 0
+        for record in records:
+            size = _LENGTH.size + len(record)
+            if size > free:
+                break
+            self._write(head, _LENGTH.pack(len(record)))
+            self._write(head + _LENGTH.size, memoryview(record))
+            head += size
+            free -= size
+            count += 1
+        if count:
+            _POSITION.pack_into(self._buf, _HEAD, head)
+        return count
+
+    def get_all(self):
+        """
+        Takes every record appended so far.
+
+        :return: List of bytes, oldest first.
+        """
+        tail = _POSITION.unpack_from(self._buf, _TAIL)[0]
+        head = _POSITION.unpack_from(self._buf, _HEAD)[0]
+        records = []
+        while tail < head:
+            length = _LENGTH.unpack(self._read(tail, _LENGTH.size))[0]
+            records.append(self._read(tail + _LENGTH.size, length))
+            tail += _LENGTH.size + length
+        if records:
+            _POSITION.pack_into(self._buf, _TAIL, tail)
+        return records
+
+    def close(self):
+        """
+        Detaches from the ring, and frees it if this side created it.
+        """
+        self._data.release()
+        self._buf = self._data = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
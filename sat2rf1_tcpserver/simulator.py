@@ -0,0 +1,261 @@
+"""
+Sat2rf1 radio simulator on a pseudo-terminal, for testing without hardware
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import collections
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from sat2rf1_tcpserver import logger
+from .codec import encode_frame
+from .kiss import KissDecoder
+from .sat2rf1_constants import *
+
+"""
+Downlink payloads start with this header: sequence number and the
+simulator's time.monotonic_ns() when the frame left the radio.
+"""
+DOWNLINK_HEADER = struct.Struct('>IQ')
+
+
+class RadioSimulator:
+    """
+    Emulates a Sat2rf1 radio on a pseudo-terminal.
+
+    Sat2rf1 and Kiss can be pointed at port like at the real radio. The
+    simulator answers the GET_* and SET_* commands from sat2rf1_constants,
+    sends data frames "over the air" and generates downlink traffic at
+    downlink_rate frames per second. Bytes cross the emulated UART no faster
+    than baud allows, and every frame on air takes its airtime at
+    air_bitrate; the radio is half duplex, so transmitting blocks reception.
+
+    Data frames wait in a buffer of buffer_size bytes until the radio
+    gets to send them; frames that do not fit are dropped and counted in
+    counters['uplink_overflows'].
+
+    Downlink payloads are downlink_size bytes and start with
+    DOWNLINK_HEADER, so the receiving end can measure latency.
+    Transmitted data frames are passed to on_uplink(payload,
+    time.monotonic_ns()), if set.
+    """
+
+    uart_chunk = 64  # Bytes moved across the emulated UART at a time
+
+    def __init__(self, baud=115200, air_bitrate=9600, downlink_rate=0.0, downlink_size=64,
+                 frequency=435000000, power=20, mode=PACKET_RECEIVE_MODE, corr_coef=12, buffer_size=2048):
+        self.baud = baud
+        self.air_bitrate = air_bitrate
+        self.buffer_size = buffer_size
+        self.downlink_rate = downlink_rate
+        self.downlink_size = max(downlink_size, DOWNLINK_HEADER.size)
+        self.on_uplink = None
+
+        self.settings = {
+            'frequency': int(frequency),
+            'power': power,
+            'mode': mode,
+            'corr_coef': corr_coef,
+            'rssi': -110,
+        }
+        self.counters = collections.Counter()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        self._decoder = KissDecoder()
+        self._to_host = bytearray()
+        self._uart_out_free_at = 0.0  # When the UART can take the next byte towards the host
+        self._uart_in_free_at = 0.0  # Same for bytes from the host
+        self._air_free_at = 0.0  # When the radio is done transmitting or receiving
+        self._next_downlink = None
+        self._sequence = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._next_downlink = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='radio-simulator', daemon=True)
+        self._thread.start()
+        logger.info('Simulated radio listening on {}'.format(self.port))
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self):
+        master = self._master
+        while self._running:
+            now = time.monotonic()
+            self._generate_downlink(now)
+
+            # Only wait for the pty when the emulated UART could move a byte.
+            reading = self._uart_in_free_at <= now
+            writing = bool(self._to_host) and self._uart_out_free_at <= now
+            wake = [now + 0.1]
+            if not reading:
+                wake.append(self._uart_in_free_at)
+            if self._to_host and not writing:
+                wake.append(self._uart_out_free_at)
+            if self.downlink_rate > 0:
+                wake.append(self._downlink_due())
+
+            readable, writable, _ = select.select([master] if reading else [], [master] if writing else [], [],
+                                                  max(min(wake) - now, 0))
+            now = time.monotonic()
+            if readable:
+                self._read_from_host(now)
+            if writable:
+                self._write_to_host(now)
+
+    def _uart_time(self, nbytes):
+        return nbytes * 10 / self.baud  # 8N1: ten bits on the wire per byte
+
+    def _airtime(self, nbytes):
+        return (nbytes + AIR_OVERHEAD) * 8 / self.air_bitrate
+
+    def _read_from_host(self, now):
+        try:
+            data = os.read(self._master, self.uart_chunk)
+        except (BlockingIOError, OSError):
+            return
+        self._uart_in_free_at = max(self._uart_in_free_at, now) + self._uart_time(len(data))
+        for frame in self._decoder.feed(data):
+            self._handle_frame(frame, now)
+
+    def _write_to_host(self, now):
+        try:
+            written = os.write(self._master, self._to_host[:self.uart_chunk])
+        except (BlockingIOError, OSError):
+            return
+        del self._to_host[:written]
+        self._uart_out_free_at = max(self._uart_out_free_at, now) + self._uart_time(written)
+
+    def _send(self, command, payload=b''):
+        self._to_host += encode_frame(command, payload)
+
+    def _downlink_due(self):
+        """
+        Returns when the next downlink frame has been received in full.
+        """
+        return max(self._next_downlink, self._air_free_at) + self._airtime(self.downlink_size)
+
+    def _generate_downlink(self, now):
+        if self.downlink_rate <= 0:
+            return
+        while self._downlink_due() <= now:
+            self._air_free_at = self._downlink_due()
+            payload = DOWNLINK_HEADER.pack(self._sequence & 0xFFFFFFFF, time.monotonic_ns())
+            payload += bytes(self.downlink_size - len(payload))
+            self._send(DATA_FRAME, payload)
+            self._sequence += 1
+            self.counters['downlink_frames'] += 1
+            self._next_downlink += 1 / self.downlink_rate
+
+    def _handle_frame(self, frame, now):
+        command, argument = frame[:1], frame[1:]
+        self.counters['frames_from_host'] += 1
+        settings = self.settings
+
+        if command == DATA_FRAME:
+            # Half duplex: the frame goes on air once the radio is free, and
+            # waits in a buffer of buffer_size bytes until then.
+            waiting = max(self._air_free_at - now, 0) * self.air_bitrate / 8
+            if waiting and waiting + len(argument) + AIR_OVERHEAD > self.buffer_size:
+                self.counters['uplink_overflows'] += 1
+                logger.warning('Simulated radio buffer full, dropping a {} byte frame'.format(len(argument)))
+                return
+            self._air_free_at = max(self._air_free_at, now) + self._airtime(len(argument))
+            self.counters['uplink_frames'] += 1
+            self.counters['uplink_bytes'] += len(argument)
+            if self.on_uplink is not None:
+                self.on_uplink(argument, time.monotonic_ns())
+        elif command == GET_FREQUENCY:
+            self._send(command, settings['frequency'].to_bytes(4, 'big'))
+        elif command == GET_POWER:
+            self._send(command, settings['power'].to_bytes(1, 'big', signed=True))
+        elif command == GET_MODE:
+            self._send(command, settings['mode'])
+        elif command == GET_CORR_COEF:
+            self._send(command, settings['corr_coef'].to_bytes(1, 'big'))
+        elif command == GET_RSSI:
+            self._send(command, settings['rssi'].to_bytes(1, 'big', signed=True))
+        elif command == SET_FREQUENCY:
+            frequency = int.from_bytes(argument, 'big')
+            ok = LOWER_FREQUENCY_LIMIT <= frequency <= UPPER_FREQUENCY_LIMIT
+            if ok:
+                settings['frequency'] = frequency
+            self._send(command, b'\x00' if ok else b'\x01')
+        elif command == SET_POWER:
+            settings['power'] = int.from_bytes(argument, 'big', signed=True)
+            self._send(command, b'\x00')
+        elif command == SET_MODE:
+            settings['mode'] = argument[:1]
+            self._send(command, b'\x00')
+        elif command == SET_CORR_COEF:
+            settings['corr_coef'] = int.from_bytes(argument, 'big')
+            self._send(command, b'\x00')
+        elif command == PING:
+            self._send(command, b'\x00')
+        else:
+            self.counters['unknown_commands'] += 1
+            logger.warning('Simulated radio got unknown command {}'.format(command))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated Sat2rf1 radio on a pseudo-terminal.')
+    parser.add_argument('--baud', type=int, default=115200, help='emulated UART bitrate')
+    parser.add_argument('--air-bitrate', type=int, default=9600, help='emulated RF bitrate')
+    parser.add_argument('--downlink-rate', type=float, default=0.0, help='downlink frames per second')
+    parser.add_argument('--downlink-size', type=int, default=64, help='downlink payload bytes')
+    args = parser.parse_args()
+
+    simulator = RadioSimulator(baud=args.baud, air_bitrate=args.air_bitrate,
+                               downlink_rate=args.downlink_rate, downlink_size=args.downlink_size)
+    simulator.start()
+    print(simulator.port, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        logger.info('Simulated radio stopped: {}'.format(dict(simulator.counters)))
+
+
+if __name__ == '__main__':
+    main()
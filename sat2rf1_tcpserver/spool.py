@@ -0,0 +1,266 @@
+"""
+Append-only spool for downlink frames that could not be delivered
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+from sat2rf1_tcpserver import logger
+
+_RECORD = struct.Struct('>I')  # Payload length, followed by the payload
+_INDEX = struct.Struct('>QQ')  # First undelivered segment, offset into it
+_SUFFIX = '.seg'
+
+
+class Spool:
+    """
+    Stores frames on disk until a client is connected to receive them.
+
+    Frames are appended to segment files of at most segment_size bytes, each
+    record being a 4 byte big-endian length followed by the frame. Writes
+    are synced in batches, every fsync_frames frames or fsync_interval
+    seconds, whichever comes first. A small index file records how far the
+    spool has been delivered, so nothing is replayed twice after a restart.
+
+    read() maps the oldest segment and returns memoryviews into the mapping,
+    so replaying the spool does not copy the frames. Fully delivered
+    segments are deleted, and the oldest ones are dropped if the spool grows
+    beyond max_size bytes.
+    """
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, max_size=256 * 1024 * 1024,
+                 fsync_interval=1.0, fsync_frames=256):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.fsync_interval = fsync_interval
+        self.fsync_frames = fsync_frames
+        self.pending = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.directory / 'index'
+        self._sealed = []  # Sealed segment numbers, oldest first
+        self._sizes = {}  # Segment number -> bytes
+        self._file = None
+        self._active = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._reader = None  # (segment, mmap) currently being read
+        self._read_segment, self._read_offset = self._load_index()
+        self._recover()
+
+    def __len__(self):
+        return self.pending
+
+    def append(self, frame):
+        """
+        Appends a frame to the active segment.
+        """
+        size = _RECORD.size + len(frame)
+        if self._file is None or self._sizes[self._active] + size > self.segment_size:
+            self._rotate()
+        self._file.write(_RECORD.pack(len(frame)))
+        self._file.write(frame)
+        self._sizes[self._active] += size
+        self.pending += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_frames or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Flushes and fsyncs the active segment if anything was appended since the last sync.
+        """
+        if self._unsynced and self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def read(self, max_frames):
+        """
+        Takes up to max_frames of the oldest frames out of the spool.
+
+        :return: List of memoryviews, oldest first. Empty when the spool is empty.
+        """
+        frames = []
+        while len(frames) < max_frames:
+            if self._reader is None and not self._open_reader():
+                break
+            segment, view = self._reader
+            end = len(view)
+            offset = self._read_offset
+            while len(frames) < max_frames and offset + _RECORD.size <= end:
+                (length,) = _RECORD.unpack_from(view, offset)
+                if offset + _RECORD.size + length > end:
+                    logger.warning('Spool segment %s ends with a truncated frame, skipping it.', segment)
+                    offset = end
+                    break
+                offset += _RECORD.size
+                frames.append(view[offset:offset + length])
+                offset += length
+            self._read_offset = offset
+            if offset + _RECORD.size > end:
+                self._finish_segment(segment)
+        if frames:
+            self.pending = max(self.pending - len(frames), 0)
+            self._write_index()
+        return frames
+
+    def close(self):
+        """
+        Syncs and closes the active segment.
+        """
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._write_index()
+
+    def _segment_path(self, segment):
+        return self.directory / '{:016d}{}'.format(segment, _SUFFIX)
+
+    def _load_index(self):
+        try:
+            return _INDEX.unpack(self._index_path.read_bytes())
+        except (FileNotFoundError, struct.error):
+            return 0, 0
+
+    def _write_index(self):
+        tmp = self._index_path.with_suffix('.tmp')
+        tmp.write_bytes(_INDEX.pack(self._read_segment, self._read_offset))
+        os.replace(tmp, self._index_path)
+
+    def _recover(self):
+        """
+        Picks up segments left by a previous run and counts their undelivered frames.
+        """
+        segments = sorted(int(path.stem) for path in self.directory.glob('*' + _SUFFIX))
+        for segment in segments:
+            if segment < self._read_segment:
+                self._segment_path(segment).unlink()
+                continue
+            path = self._segment_path(segment)
+            size = path.stat().st_size
+            offset = self._read_offset if segment == self._read_segment else 0
+            count, end = self._count(path, offset)
+            if end < size:
+                logger.warning('Spool segment %s ends with a truncated frame, dropping %d byte(s).',
+                               segment, size - end)
+                os.truncate(path, end)
+                size = end
+            self._sizes[segment] = size
+            self._sealed.append(segment)
+            self.pending += count
+        if self._sealed and self._sealed[0] != self._read_segment:
+            self._read_segment, self._read_offset = self._sealed[0], 0
+        self._next_segment = max(segments, default=self._read_segment) + 1
+
+    @staticmethod
+    def _count(path, offset):
+        """
+        Counts the complete frames in a segment from offset on. A record that
+        runs past the end of the file, left by a crash in the middle of an
+        append, ends the count.
+
+        :return: tuple (count, end), end being the offset just past the last complete frame.
+        """
+        size = os.path.getsize(path)
+        count = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                (length,) = _RECORD.unpack(header)
+                if offset + _RECORD.size + length > size:
+                    break
+                offset += _RECORD.size + length
+                f.seek(offset)
+                count += 1
+        return count, offset
+
+    def _rotate(self):
+        """
+        Seals the active segment and starts a new one.
+        """
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._sealed.append(self._active)
+        self._active = self._next_segment
+        self._next_segment += 1
+        self._file = open(self._segment_path(self._active), 'ab')
+        self._sizes[self._active] = 0
+        self._enforce_max_size()
+
+    def _enforce_max_size(self):
+        while self._sealed and sum(self._sizes.values()) > self.max_size:
+            segment = self._sealed[0]
+            logger.warning('Spool is larger than %d bytes, dropping segment %s.', self.max_size, segment)
+            if self._reader is not None and self._reader[0] == segment:
+                self._reader = None
+            self.pending -= self._count(self._segment_path(segment),
+                                        self._read_offset if segment == self._read_segment else 0)[0]
+            self._finish_segment(segment)
+
+    def _open_reader(self):
+        if not self._sealed:
+            # Everything left is in the active segment; seal it so that new
+            # frames go to a fresh segment while this one is read.
+            if self._file is None or not self._sizes[self._active]:
+                return False
+            self._rotate()
+        segment = self._sealed[0]
+        if segment != self._read_segment:
+            self._read_segment, self._read_offset = segment, 0
+        if not self._sizes[segment]:
+            self._finish_segment(segment)
+            return bool(self._sealed) and self._open_reader()
+        with open(self._segment_path(segment), 'rb') as f:
+            # The mapping stays valid after the file is closed (and deleted),
+            # and is released once the last memoryview into it is gone.
+            self._reader = segment, memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return True
+
+    def _finish_segment(self, segment):
+        """
+        Deletes a segment that has been delivered in full.
+        """
+        self._reader = None
+        self._sealed.remove(segment)
+        del self._sizes[segment]
+        self._segment_path(segment).unlink()
+        if self._sealed:
+            self._read_segment = self._sealed[0]
+        elif self._file is not None:
+            self._read_segment = self._active
+        else:
+            self._read_segment = self._next_segment
+        self._read_offset = 0
@@ -0,0 +1,165 @@
+"""
+Logging setup, and helpers that keep logging cheap on the paths every frame takes
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import collections
+
+from . import ax25
+
+"""
+Data port messages starting with this byte are subscription commands, not
+payloads for the radio. No AX.25 frame starts with it, as callsign
+characters are shifted left by one bit.
+"""
+CONTROL_PREFIX = b'\xff'
+
+"""
+Header fields a client can subscribe to.
+"""
+FIELDS = ('src', 'dst', 'pid')
+
+
+def parse_key(field, value):
+    """
+    Turns a field and value from a subscription command into an index key.
+    A callsign without SSID matches every SSID.
+
+    :return: tuple (field, callsign, ssid or None) or (field, pid)
+    """
+    field = field.lower()
+    if field == 'pid':
+        try:
+            pid = int(value, 0)
+        except ValueError:
+            raise SubscriptionError('invalid PID {}'.format(value))
+        if not 0 <= pid <= 0xFF:
+            raise SubscriptionError('invalid PID {}'.format(value))
+        return field, pid
+    if field not in FIELDS:
+        raise SubscriptionError('unknown field {}'.format(field))
+    callsign, _, ssid = value.upper().partition('-')
+    if not callsign or len(callsign) > 6:
+        raise SubscriptionError('invalid callsign {}'.format(value))
+    if not ssid:
+        return field, callsign, None
+    if not ssid.isdigit() or int(ssid) > 15:
+        raise SubscriptionError('invalid SSID {}'.format(value))
+    return field, callsign, int(ssid)
+
+
+def header_keys(header):
+    """
+    Returns every index key a frame with this header matches.
+    """
+    return (('src', header.source, None), ('src', header.source, header.source_ssid),
+            ('dst', header.destination, None), ('dst', header.destination, header.destination_ssid),
+            ('pid', header.pid))
+
+
+class Subscriptions:
+    """
+    Keeps track of which frames each data client asked for.
+
+    A client without subscriptions gets every frame. A client that has
+    subscribed gets the frames matching any of its subscriptions. Clients are
+    looked up from an index of subscription keys, so matching a frame takes
+    the same few dict lookups however many clients are connected.
+    """
+
+    def __init__(self):
+        self._index = collections.defaultdict(set)  # key -> clients
+        self._keys = {}  # client -> its keys
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    def __contains__(self, client):
+        return client in self._keys
+
+    def handle(self, message, client):
+        """
+        Applies a subscription command (CONTROL_PREFIX and ASCII text) from client:
+        SUBSCRIBE <field> <value>, UNSUBSCRIBE <field> <value>, or UNSUBSCRIBE
+        to drop every subscription.
+        """
+        words = bytes(message[len(CONTROL_PREFIX):]).decode('ascii', errors='replace').split()
+        command = words[0].upper() if words else ''
+        if command == 'SUBSCRIBE' and len(words) == 3:
+            self.subscribe(client, parse_key(words[1], words[2]))
+        elif command == 'UNSUBSCRIBE' and len(words) == 3:
+            self.unsubscribe(client, parse_key(words[1], words[2]))
+        elif command == 'UNSUBSCRIBE' and len(words) == 1:
+            self.remove(client)
+        else:
+            raise SubscriptionError('unknown command {}'.format(' '.join(words)))
+
+    def subscribe(self, client, key):
+        self._keys.setdefault(client, set()).add(key)
+        self._index[key].add(client)
+
+    def unsubscribe(self, client, key):
+        keys = self._keys.get(client)
+        if keys is None or key not in keys:
+            return
+        keys.discard(key)
+        self._drop_from_index(client, key)
+        if not keys:
+            del self._keys[client]
+
+    def remove(self, client):
+        """
+        Drops every subscription of client, e.g. once it has disconnected.
+        """
+        for key in self._keys.pop(client, ()):
+            self._drop_from_index(client, key)
+
+    def _drop_from_index(self, client, key):
+        clients = self._index[key]
+        clients.discard(client)
+        if not clients:
+            del self._index[key]
+
+    def match(self, frame):
+        """
+        Returns the subscribed clients that frame (an AX.25 frame) is for.
+        Frames that are not valid AX.25 match no subscription.
+        """
+        try:
+            header = ax25.parse(frame)
+        except ax25.AX25Error:
+            return set()
+        index = self._index
+        matched = set()
+        for key in header_keys(header):
+            clients = index.get(key)
+            if clients:
+                matched |= clients
+        return matched
+
+
+class SubscriptionError(Exception):
+    """Subscription Error."""
+    pass
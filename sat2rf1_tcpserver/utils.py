@@ -28,7 +28,10 @@ from pathlib import Path
 
 from time import time
 
-from .kiss_constants import FESC, FESC_TFEND, FESC_TFESC, FEND, DATA_FRAME
+from sat2rf1_tcpserver import logger
+from . import ax25, codec
+from .kiss_constants import FEND, DATA_FRAME
+from .sat2rf1_constants import SET_MODE, SET_FREQUENCY, SET_POWER, SET_CORR_COEF
 
 
 def escape_special_codes(raw_codes):
@@ -39,14 +42,10 @@ def escape_special_codes(raw_codes):
     need to be escaped. The FEND code is then sent as FESC, TFEND and the
     FESC is then sent as FESC, TFESC."
     - http://en.wikipedia.org/wiki/KISS_(TNC)#Description
+
+    See codec.escape().
     """
-    return raw_codes.replace(
-        FESC,
-        FESC_TFESC
-    ).replace(
-        FEND,
-        FESC_TFEND
-    )
+    return codec.escape(raw_codes)
 
 
 def recover_special_codes(escaped_codes):
@@ -57,29 +56,24 @@ def recover_special_codes(escaped_codes):
     they need to be recovered to the original codes. The FESC_TFESC code is
     replaced by FESC code and FESC_TFEND is replaced by FEND code."
     - http://en.wikipedia.org/wiki/KISS_(TNC)#Description
+
+    See codec.unescape().
     """
-    return escaped_codes.replace(
-        FESC_TFESC,
-        FESC
-    ).replace(
-        FESC_TFEND,
-        FEND
-    )
+    return codec.unescape(escaped_codes)
 
 
 def extract_ui(frame):
     """
-    Extracts the UI component of an individual frame.
+    Extracts the addresses of an individual UI frame.
 
-    :param frame: APRS/AX.25 frame.
-    :type frame: str
-    :returns: UI component of frame.
+    :param frame: APRS/AX.25 frame, with or without FEND and DATA_FRAME in front.
+    :type frame: bytes
+    :returns: Addresses of the frame, e.g. LA1NGS-1>CQ,WIDE1-1.
     :rtype: str
     """
-    start_ui = frame.split(
-        b''.join([FEND, DATA_FRAME]))
-    end_ui = start_ui[0].split(b''.join([SLOT_TIME, UI_PROTOCOL_ID]))
-    return ''.join([chr(x >> 1) for x in end_ui[0]])
+    if frame.startswith(FEND + DATA_FRAME):
+        frame = frame[2:]
+    return ax25.format_header(ax25.parse(frame))
 
 
 def strip_df_start(frame):
@@ -0,0 +1,73 @@
+"""
+Tests for the AX.25 header parser
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sat2rf1_tcpserver.ax25 import AX25Error, Header, format_header, parse
+from sat2rf1_tcpserver.utils import extract_ui
+
+
+def address(callsign, ssid=0, last=False):
+    return bytes(byte << 1 for byte in callsign.ljust(6).encode()) + bytes([0x60 | ssid << 1 | last])
+
+
+def ui_frame(destination, source, *digipeaters, info=b'hello'):
+    addresses = [destination, source] + list(digipeaters)
+    field = b''.join(address(callsign, ssid, index == len(addresses) - 1)
+                     for index, (callsign, ssid) in enumerate(addresses))
+    return field + b'\x03\xf0' + info
+
+
+def test_parse_ui_frame():
+    frame = ui_frame(('CQ', 0), ('LA1NGS', 1), ('WIDE1', 1))
+    header = parse(frame)
+    assert header == Header('CQ', 0, 'LA1NGS', 1, (('WIDE1', 1),), 0x03, 0xF0, 2 * 7 + 7 + 2)
+    assert frame[header.info_offset:] == b'hello'
+    assert format_header(header) == 'LA1NGS-1>CQ,WIDE1-1'
+
+
+def test_parse_frame_without_pid():
+    # Receive ready, a supervisory frame: no PID field.
+    frame = address('LA1NGS', 2) + address('LA2NGS', 0, True) + b'\x01'
+    header = parse(frame)
+    assert (header.destination_ssid, header.control, header.pid) == (2, 0x01, None)
+
+
+def test_invalid_frames():
+    with pytest.raises(AX25Error):
+        parse(b'')
+    with pytest.raises(AX25Error):
+        parse(address('CQ', 0, True) + b'\x03\xf0')  # Only one address
+    with pytest.raises(AX25Error):
+        parse(address('CQ') + address('LA1NGS'))  # Address field never ends
+    with pytest.raises(AX25Error):
+        parse(address('CQ') + address('LA1NGS', 0, True) + b'\x03')  # UI frame without PID
+
+
+def test_extract_ui():
+    frame = ui_frame(('CQ', 0), ('LA1NGS', 0))
+    assert extract_ui(frame) == 'LA1NGS>CQ'
+    assert extract_ui(b'\xc0\x00' + frame) == 'LA1NGS>CQ'
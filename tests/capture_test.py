@@ -0,0 +1,57 @@
+"""
+Tests for capture files
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sat2rf1_tcpserver.capture import (FRAME, FROM_RADIO, RAW, TO_RADIO, CaptureError, CaptureWriter, Record,
+                                       read_capture)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'captures' / 'radio.cap'
+    with CaptureWriter(path) as capture:
+        capture.write(FROM_RADIO, RAW, b'\xc0\x00abc\xc0', timestamp_ns=1)
+        capture.write(FROM_RADIO, FRAME, b'\x00abc', timestamp_ns=2)
+        capture.write(TO_RADIO, RAW, b'', timestamp_ns=3)
+    assert list(read_capture(path)) == [Record(1, FROM_RADIO, RAW, b'\xc0\x00abc\xc0'),
+                                        Record(2, FROM_RADIO, FRAME, b'\x00abc'),
+                                        Record(3, TO_RADIO, RAW, b'')]
+
+
+def test_partial_record_at_end_is_skipped(tmp_path):
+    path = tmp_path / 'radio.cap'
+    with CaptureWriter(path) as capture:
+        capture.write(FROM_RADIO, FRAME, b'\x00abc', timestamp_ns=1)
+        capture.write(FROM_RADIO, FRAME, b'\x00def', timestamp_ns=2)
+    path.write_bytes(path.read_bytes()[:-2])
+    assert [record.data for record in read_capture(path)] == [b'\x00abc']
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'radio.cap'
+    path.write_bytes(b'\xc0\x00abc\xc0')
+    with pytest.raises(CaptureError):
+        list(read_capture(path))
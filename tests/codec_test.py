@@ -0,0 +1,92 @@
+"""
+Tests for the KISS codec
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+
+from sat2rf1_tcpserver.codec import escape, unescape, encode_frame, encode_frames
+from sat2rf1_tcpserver.kiss_constants import FEND, FESC, TFEND, TFESC, FESC_TFEND, FESC_TFESC
+
+
+def naive_escape(data):
+    return data.replace(FESC, FESC_TFESC).replace(FEND, FESC_TFEND)
+
+
+def naive_unescape(data):
+    # Scans the escaped data byte by byte, per KISS spec.
+    out = bytearray()
+    escaped = False
+    for byte in data:
+        if escaped:
+            escaped = False
+            if byte in (TFEND[0], TFESC[0]):
+                out += FEND if byte == TFEND[0] else FESC
+                continue
+            out += FESC  # Invalid escape, read the byte as if there was no FESC.
+        if byte == FESC[0]:
+            escaped = True
+        else:
+            out.append(byte)
+    if escaped:
+        out += FESC
+    return bytes(out)
+
+
+def payloads():
+    rng = random.Random(1)
+    special = FEND + FESC + TFEND + TFESC
+    yield b''
+    yield FESC + TFEND
+    yield FESC + TFESC + FEND
+    for _ in range(2000):
+        # Mostly special bytes, so that every combination of them turns up.
+        yield bytes(rng.choice(special) if rng.random() < 0.7 else rng.getrandbits(8)
+                    for _ in range(rng.randint(1, 24)))
+
+
+def test_escape_matches_naive_version():
+    for payload in payloads():
+        assert escape(payload) == naive_escape(payload)
+
+
+def test_round_trip_is_byte_exact():
+    for payload in payloads():
+        assert unescape(escape(payload)) == payload
+
+
+def test_unescape_matches_naive_version_on_any_input():
+    for payload in payloads():
+        assert unescape(payload) == naive_unescape(payload)
+
+
+def test_escaped_fesc_before_tfend_is_not_an_escaped_fend():
+    # The old two-pass recovery turned this back into FEND.
+    assert unescape(FESC + TFESC + TFEND) == FESC + TFEND
+
+
+def test_encode_frames_writes_frames_back_to_back():
+    frames = [(b'\x00', payload) for payload in payloads()]
+    assert encode_frames(frames) == b''.join(FEND + command + naive_escape(data) + FEND for command, data in frames)
+    assert encode_frames([(b'\x05', memoryview(FEND))]) == encode_frame(b'\x05', FEND)
@@ -0,0 +1,77 @@
+"""
+Tests for loading the configuration
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+from sat2rf1_tcpserver.config import ConfigError, load, radio_configs
+
+CONFIG = {
+    'radio': {'baud': 115200, 'port': '/dev/ttyUSB0'},
+    'socket': {'hostname': 'localhost', 'settings_port': 20201, 'data_port': 20202},
+    'spool': {'directory': 'spool'},
+    'logging': {'level': 'INFO'},
+}
+
+
+def test_single_radio_without_radios_section():
+    [(name, config)] = radio_configs(CONFIG)
+    assert name == 'sat2rf1'
+    assert config['radio'] == CONFIG['radio']
+    assert config['spool'] == {'directory': 'spool'}
+    assert config['simulator'] == {}
+
+
+def test_radios_override_sections():
+    config = dict(CONFIG, radios=[
+        {'name': 'uhf'},
+        {'name': 'vhf', 'radio': {'port': '/dev/ttyUSB1'}, 'socket': {'settings_port': 20203, 'data_port': 20204}},
+    ])
+    (uhf_name, uhf), (vhf_name, vhf) = radio_configs(config)
+    assert (uhf_name, vhf_name) == ('uhf', 'vhf')
+    assert uhf['radio']['port'] == '/dev/ttyUSB0'
+    assert vhf['radio'] == {'baud': 115200, 'port': '/dev/ttyUSB1'}
+    assert vhf['socket']['hostname'] == 'localhost'
+    assert (vhf['socket']['settings_port'], vhf['socket']['data_port']) == (20203, 20204)
+    assert uhf['spool']['directory'] == os.path.join('spool', 'uhf')
+    assert vhf['spool']['directory'] == os.path.join('spool', 'vhf')
+    assert vhf['logging'] is config['logging']
+    assert config['radio'] == {'baud': 115200, 'port': '/dev/ttyUSB0'}
+
+
+def test_duplicate_radio_names():
+    with pytest.raises(ConfigError):
+        radio_configs(dict(CONFIG, radios=[{'name': 'uhf'}, {'name': 'uhf'}]))
+
+
+def test_load_errors(tmp_path):
+    with pytest.raises(ConfigError):
+        load(str(tmp_path / 'missing.yaml'))
+    path = tmp_path / 'config.yaml'
+    path.write_text('radio: [\n')
+    with pytest.raises(ConfigError):
+        load(str(path))
@@ -0,0 +1,91 @@
+"""
+Fixtures shared by the tests
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from sat2rf1_tcpserver.codec import encode_frame
+from sat2rf1_tcpserver.radio_state import FIELD_GETTERS, RadioState
+from sat2rf1_tcpserver.sat2rf1_commands import CommandEngine, decode_response
+from sat2rf1_tcpserver.sat2rf1_constants import SET_FREQUENCY
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when the test sets now.
+    """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRadio:
+    """
+    Stands in for Sat2rf1: a real command engine and state cache, with
+    responses fed in by the test.
+    """
+
+    def __init__(self, clock):
+        self.state = RadioState(clock)
+        self.written = []
+        self.commands = CommandEngine(self.written.extend, clock=clock)
+
+    def request(self, command, data=b''):
+        return self.commands.submit(command, encode_frame(command, data))
+
+    def set_frequency(self, freq, wait=True):
+        return self.request(SET_FREQUENCY, int(freq).to_bytes(4, 'big'))
+
+    def respond(self, command, argument):
+        # As Sat2rf1 does: update the cache, resolve the request and read back a changed setting.
+        invalidated = self.state.handle_response(command, decode_response(command, argument))
+        self.commands.handle_response(command, argument)
+        if invalidated is not None:
+            self.request(FIELD_GETTERS[invalidated])
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def written():
+    """
+    Batches of frames written to the radio by the engine fixture.
+    """
+    return []
+
+
+@pytest.fixture
+def engine(clock, written):
+    return CommandEngine(written.append, timeout=0.5, retries=2, clock=clock)
+
+
+@pytest.fixture
+def radio(clock):
+    return FakeRadio(clock)
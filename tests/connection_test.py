@@ -0,0 +1,104 @@
+"""
+Tests for the Connection class and its helpers
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import socket
+import time
+
+from sat2rf1_tcpserver.connection import DISCONNECT, DROP_NEWEST, Connection, OutboundQueue
+from sat2rf1_tcpserver.framing import framer_factory
+
+
+def test_outbound_queue_keeps_order_across_partial_sends():
+    sender, receiver = socket.socketpair()
+    sender.setblocking(False)
+    receiver.setblocking(False)
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    queue = OutboundQueue()
+    chunks = [bytes([i]) * 10000 for i in range(8)]
+    for chunk in chunks:
+        queue.append(chunk)
+    assert queue.nbytes == 80000
+
+    received = bytearray()
+    while queue:
+        queue.send(sender)
+        while True:
+            try:
+                data = receiver.recv(65536)
+            except BlockingIOError:
+                break
+            received += data
+
+    assert queue.nbytes == 0
+    assert bytes(received) == b''.join(chunks)
+    sender.close()
+    receiver.close()
+
+
+def test_outbound_queue_drop_oldest_keeps_partial_head():
+    queue = OutboundQueue(max_messages=2)
+    queue.append(b'aaaa')
+    queue.append(b'bbbb')
+    queue._consume(2)
+    assert queue.append(b'cccc')
+    assert queue.dropped == 1
+    assert [bytes(chunk) for chunk in queue._chunks] == [b'aa', b'cccc']
+    assert queue.nbytes == 6
+
+
+def test_outbound_queue_drop_newest_and_disconnect():
+    queue = OutboundQueue(max_messages=1, overflow=DROP_NEWEST)
+    queue.append(b'a')
+    assert queue.append(b'b')
+    assert [bytes(chunk) for chunk in queue._chunks] == [b'a']
+
+    queue = OutboundQueue(max_messages=1, overflow=DISCONNECT)
+    queue.append(b'a')
+    assert not queue.append(b'b')
+
+
+def test_unframeable_message_is_dropped_alone():
+    server = Connection('127.0.0.1', 0, framing=framer_factory('length'))
+    client = socket.create_connection(server.lsock.getsockname())
+    try:
+        deadline = time.monotonic() + 2
+        while not server.clients() and time.monotonic() < deadline:
+            server.server_cycle(0.05)
+        server.send_batch_to_all([b'a', b'x' * 70000, b'b'])
+        client.setblocking(False)
+        received = b''
+        while len(received) < 6 and time.monotonic() < deadline:
+            server.server_cycle(0.05)
+            try:
+                received += client.recv(4096)
+            except BlockingIOError:
+                pass
+        assert received == b'\x00\x01a\x00\x01b'
+        assert server.counters['queued_messages'] == 2
+        assert server.counters['dropped_messages'] == 1
+    finally:
+        client.close()
+        server.lsock.close()
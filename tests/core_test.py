@@ -0,0 +1,157 @@
+"""
+Tests for the gateway
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import selectors
+import socket
+import struct
+import time
+
+from sat2rf1_tcpserver.connection import Connection
+from sat2rf1_tcpserver.core import Gateway
+from sat2rf1_tcpserver.framing import framer_factory
+from sat2rf1_tcpserver.sat2rf1 import RadioFrame, Sat2rf1
+from sat2rf1_tcpserver.simulator import DOWNLINK_HEADER, RadioSimulator
+from sat2rf1_tcpserver.spool import Spool
+
+
+async def command(reader, writer, line):
+    writer.write(line + b'\n')
+    lines = []
+    while not lines or not (lines[-1] == b'OK' or lines[-1].startswith(b'ERROR')):
+        lines.append((await asyncio.wait_for(reader.readline(), 2)).rstrip(b'\n'))
+    return lines
+
+
+async def round_trip(gateway, simulator, uplink):
+    task = asyncio.ensure_future(gateway.run())
+    try:
+        settings = await asyncio.open_connection(*gateway.settings_socket.lsock.getsockname())
+        assert await command(*settings, b'   ') == [b'ERROR empty command']
+        assert await command(*settings, b'SET frequency 436000000') == [b'OK']
+        # The new frequency is read back from the radio once the SET is acknowledged.
+        for _ in range(100):
+            reply = await command(*settings, b'GET frequency')
+            if reply[0].startswith(b'frequency 436000000 '):
+                break
+            await asyncio.sleep(0.01)
+        assert reply[0].startswith(b'frequency 436000000 ')
+
+        reader, writer = await asyncio.open_connection(*gateway.data_socket.lsock.getsockname())
+        writer.write(struct.pack('>H', 5) + b'hello')
+        sequences = []
+        for _ in range(2):
+            length, = struct.unpack('>H', await asyncio.wait_for(reader.readexactly(2), 2))
+            frame = await reader.readexactly(length)
+            assert len(frame) == simulator.downlink_size
+            sequences.append(DOWNLINK_HEADER.unpack_from(frame)[0])
+        assert sequences[1] == sequences[0] + 1
+        for _ in range(100):
+            if uplink:
+                break
+            await asyncio.sleep(0.01)
+        assert uplink == [b'hello']
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def test_settings_and_data_round_trip():
+    simulator = RadioSimulator(downlink_rate=20)
+    uplink = []
+    simulator.on_uplink = lambda payload, sent_ns: uplink.append(payload)
+    simulator.start()
+    radio = Sat2rf1(simulator.port)
+    settings_socket = Connection('127.0.0.1', 0, True, framing=framer_factory('line'))
+    data_socket = Connection('127.0.0.1', 0, framing=framer_factory('length'))
+    try:
+        asyncio.run(round_trip(Gateway(radio, settings_socket, data_socket), simulator, uplink))
+    finally:
+        radio.kiss.close()
+        settings_socket.lsock.close()
+        data_socket.lsock.close()
+        simulator.stop()
+
+
+def read_length_prefixed(sock, count):
+    data = b''
+    while True:
+        frames = []
+        offset = 0
+        while offset + 2 <= len(data):
+            length, = struct.unpack_from('>H', data, offset)
+            if offset + 2 + length > len(data):
+                break
+            frames.append(data[offset + 2:offset + 2 + length])
+            offset += 2 + length
+        if len(frames) >= count:
+            return frames
+        data += sock.recv(65536)
+
+
+def test_stalled_client_does_not_hold_back_spool_replay(tmp_path):
+    settings_socket = Connection('127.0.0.1', 0, True, framing=framer_factory('line'))
+    data_socket = Connection('127.0.0.1', 0, framing=framer_factory('length'), max_queue=4)
+    spool = Spool(tmp_path)
+    gateway = Gateway(None, settings_socket, data_socket, spool)
+    fast = socket.create_connection(data_socket.lsock.getsockname())
+    stalled = socket.create_connection(data_socket.lsock.getsockname())
+    try:
+        fast.settimeout(2)
+        while len(data_socket.clients()) < 2:
+            data_socket.server_cycle(1)
+        fast_pointer = next(client for client in data_socket.clients()
+                            if client.addr == fast.getsockname())
+
+        def flush_fast():
+            # Only the fast client's queue is written out; the other one stays full.
+            data_socket.service_connection(data_socket.sel.get_key(fast_pointer.sock), selectors.EVENT_WRITE)
+
+        frames = [bytes([i]) * 8 for i in range(10)]
+        for frame in frames:
+            spool.append(frame)
+        gateway._replay_spool()
+        assert len(spool) == 6
+        for _ in range(2):
+            flush_fast()
+            gateway._replay_spool()
+        flush_fast()
+        assert len(spool) == 0
+        assert read_length_prefixed(fast, 10) == frames
+
+        # Caught up, so new frames go straight out instead of through the spool.
+        gateway._forward([RadioFrame(0, b'live', time.monotonic_ns(), 0)])
+        assert len(spool) == 0
+        flush_fast()
+        assert read_length_prefixed(fast, 1) == [b'live']
+    finally:
+        fast.close()
+        stalled.close()
+        spool.close()
+        settings_socket.lsock.close()
+        data_socket.lsock.close()
@@ -0,0 +1,47 @@
+"""
+Tests for the deduplication cache
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.dedup import DedupCache
+
+
+def test_drops_copies_within_window():
+    cache = DedupCache(window=10.0)
+    assert not cache.seen(b'beacon', now=0.0)
+    assert cache.seen(b'beacon', now=5.0)
+    assert not cache.seen(bytearray(b'other'), now=6.0)
+    assert cache.seen(b'other', now=7.0)
+    # Copies do not extend the window, it runs from the first copy.
+    assert not cache.seen(b'beacon', now=10.0)
+    assert cache.duplicates == 2
+
+
+def test_forgets_oldest_frames_beyond_max_entries():
+    cache = DedupCache(window=10.0, max_entries=2)
+    for frame in (b'a', b'b', b'c'):
+        assert not cache.seen(frame, now=0.0)
+    assert len(cache) == 2
+    assert not cache.seen(b'a', now=0.0)
+    assert cache.seen(b'c', now=0.0)
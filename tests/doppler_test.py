@@ -0,0 +1,110 @@
+"""
+Tests for Doppler correction
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import concurrent.futures
+import time
+
+import pytest
+
+from sat2rf1_tcpserver.doppler import DopplerError, DopplerScheduler, Satellite, Station, pass_table
+
+# Test cases 00005 and 06251 from Vallado et al., "Revisiting Spacetrack Report #3".
+LINE1 = '1 00005U 58002B   00179.78495062  .00000023  00000-0  28098-4 0  4753'
+LINE2 = '2 00005  34.2682 348.7242 1859667 331.7664  19.3264 10.82419157413667'
+LINE1_06251 = '1 06251U 62025E   06176.82412014  .00008885  00000-0  12808-3 0  3985'
+LINE2_06251 = '2 06251  58.0579  54.0425 0030035 139.1568 221.1854 15.56387291  6774'
+
+
+class FakeRadio:
+    def __init__(self):
+        self.frequencies = []
+
+    def set_frequency(self, frequency, wait=True):
+        self.frequencies.append(frequency)
+        future = concurrent.futures.Future()
+        future.set_result(0)
+        return future
+
+
+def test_sgp4_matches_reference():
+    for satellite, minutes, position, velocity in (
+            (Satellite(LINE1, LINE2), 0,
+             (7022.46529266, -1400.08296755, 0.03995155), (1.893841015, 6.405893759, 4.534807250)),
+            (Satellite(LINE1, LINE2), 360,
+             (-7154.03120202, -3783.17682504, -3536.19412294), (4.741887409, -4.151817765, -2.093935425)),
+            (Satellite(LINE1_06251, LINE2_06251), 0,
+             (3988.31022699, 5498.96657235, 0.90055879), (-3.290032738, 2.357652820, 6.496623475)),
+            (Satellite(LINE1_06251, LINE2_06251), 120,
+             (-3935.69800083, 409.10980837, 5471.33577327), (-3.374784183, -6.635211043, -1.942056221))):
+        r, v = satellite.propagate(minutes)
+        assert r == pytest.approx(position, abs=1e-6)
+        assert v == pytest.approx(velocity, abs=1e-8)
+
+
+def test_rejects_bad_elements():
+    with pytest.raises(DopplerError):
+        Satellite(LINE1[:-1] + '0', LINE2)
+    with pytest.raises(DopplerError):
+        Satellite(LINE1, LINE2[:60])
+
+
+def test_scheduler_skips_small_and_overdue_corrections():
+    radio = FakeRadio()
+
+    async def run():
+        doppler = DopplerScheduler(radio, step=100)
+        now = time.time()
+        doppler.load([(now - 2, 435000000), (now - 1, 435001000), (now + 0.02, 435001050),
+                      (now + 0.04, 435000500)])
+        # The latest overdue entry is sent at once; the next one is too close to it.
+        assert radio.frequencies == [435001000]
+        assert len(doppler) == 1
+        await asyncio.sleep(0.1)
+        assert len(doppler) == 0
+        return doppler
+
+    doppler = asyncio.run(run())
+    assert radio.frequencies == [435001000, 435000500]
+    assert doppler.counters['sent'] == 2
+    assert doppler.counters['skipped'] == 2
+    with pytest.raises(DopplerError):
+        doppler.load([(0, 1)])
+
+
+def test_rejects_non_finite_entries():
+    doppler = DopplerScheduler(FakeRadio())
+    for table in ([(float('nan'), 435000000)], [(float('inf'), 435000000)], [(0.0, float('nan'))]):
+        with pytest.raises(DopplerError):
+            doppler.load(table)
+    assert len(doppler) == 0
+
+
+def test_pass_table_is_bounded():
+    satellite = Satellite(LINE1, LINE2)
+    # Never below -90 degrees, so the pass would never end.
+    with pytest.raises(DopplerError):
+        pass_table(satellite, Station(63.4, 10.4, 0), 435e6, satellite.epoch, interval=10.0, search=60.0,
+                   min_elevation=-90.0)
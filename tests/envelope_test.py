@@ -0,0 +1,45 @@
+"""
+Tests for the data port envelope
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from sat2rf1_tcpserver.envelope import HEADER, EnvelopeError, unwrap, wrap
+from sat2rf1_tcpserver.sat2rf1 import RadioFrame
+
+
+def test_wrap_and_unwrap():
+    message = wrap(RadioFrame(b'\x00', b'payload', 123456789012, 2 ** 32 + 5))
+    assert len(message) == HEADER.size + 7
+    envelope, payload = unwrap(message)
+    assert envelope == (123456789012, 5, 7)
+    assert payload == b'payload'
+
+
+def test_unwrap_rejects_truncated_messages():
+    message = wrap(RadioFrame(b'\x00', b'payload', 0, 0))
+    with pytest.raises(EnvelopeError):
+        unwrap(message[:HEADER.size - 1])
+    with pytest.raises(EnvelopeError):
+        unwrap(message[:-1])
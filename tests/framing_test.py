@@ -0,0 +1,66 @@
+"""
+Tests for the TCP message framers
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.framing import FixedLengthFramer, KissFramer, LengthPrefixFramer, LineFramer
+from sat2rf1_tcpserver.kiss_constants import FEND
+
+
+def test_fixed_length_framer_buffers_remainder():
+    framer = FixedLengthFramer(5)
+    assert framer.feed(b'abcdefg') == [b'abcde']
+    assert framer.feed(b'hijklmno') == [b'fghij', b'klmno']
+
+
+def test_length_prefix_framer_parses_many_messages_per_read():
+    framer = LengthPrefixFramer()
+    stream = b''.join(framer.encode(bytes([i]) * i) for i in range(1, 50))
+    messages = []
+    for i in range(0, len(stream), 7):
+        messages += framer.feed(stream[i:i + 7])
+    assert messages == [bytes([i]) * i for i in range(1, 50)]
+
+
+def test_length_prefix_framer_skips_keepalives():
+    framer = LengthPrefixFramer()
+    assert framer.feed(b'\x00\x00\x00\x02hi\x00') == [b'hi']
+    assert framer.feed(b'\x01!') == [b'!']
+
+
+def test_kiss_framer_round_trip():
+    framer = KissFramer()
+    payload = b'a' + FEND + b'b'
+    assert framer.feed(framer.encode(payload) + framer.encode(b'c')) == [payload, b'c']
+
+
+def test_kiss_framer_ignores_non_data_frames():
+    framer = KissFramer()
+    assert framer.feed(FEND + b'\x01\x10' + FEND + FEND + b'\x00x' + FEND) == [b'x']
+
+
+def test_line_framer_splits_lines_and_strips_line_endings():
+    framer = LineFramer()
+    assert framer.feed(b'STATUS\r\nGET freq') == [b'STATUS']
+    assert framer.feed(b'uency\n\n') == [b'GET frequency']
@@ -0,0 +1,176 @@
+"""
+Tests for the KISS decoder
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import select
+import time
+import tty
+
+import pytest
+
+from sat2rf1_tcpserver.kiss import Kiss, KissDecoder
+from sat2rf1_tcpserver.kiss_constants import FEND, FESC, TFEND, TFESC
+
+
+def test_decodes_several_frames_from_one_chunk():
+    decoder = KissDecoder()
+    frames = decoder.feed(FEND + b'\x00one' + FEND + FEND + b'\x00two' + FEND)
+    assert frames == [b'\x00one', b'\x00two']
+
+
+def test_keeps_partial_frame_between_reads():
+    decoder = KissDecoder()
+    assert decoder.feed(FEND + b'\x00par') == []
+    assert decoder.feed(b'tial' + FEND + b'\x00next') == [b'\x00partial']
+    assert decoder.feed(FEND) == [b'\x00next']
+
+
+def test_unescapes_split_escape_sequence():
+    decoder = KissDecoder()
+    assert decoder.feed(FEND + b'\x00a' + FESC) == []
+    assert decoder.feed(TFEND + FESC + TFESC + FEND) == [b'\x00a' + FEND + FESC]
+
+
+def test_discards_bytes_before_first_fend():
+    decoder = KissDecoder()
+    assert decoder.feed(b'garbage' + FEND + b'\x00ok' + FEND) == [b'\x00ok']
+    assert decoder.desyncs == 1
+
+
+def test_drops_oversized_partial_frame():
+    decoder = KissDecoder(max_frame_length=8)
+    assert decoder.feed(FEND + b'x' * 16) == []
+    assert decoder.desyncs == 1
+    assert decoder.feed(FEND + b'\x00ok' + FEND) == [b'\x00ok']
+
+
+def open_kiss(**kwargs):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    kiss = Kiss(os.ttyname(slave), 115200, 0.1, **kwargs)
+    os.set_blocking(master, False)
+    return kiss, master, slave
+
+
+def read_pty(master):
+    try:
+        return os.read(master, 4096)
+    except BlockingIOError:
+        return b''
+
+
+def test_coalesces_writes_within_linger_window():
+    kiss, master, slave = open_kiss(linger=10.0)
+    try:
+        kiss.write_data_frames([b'one', b'two'])
+        kiss.write_data_frames([b'three'])
+        assert kiss.flush_deadline() is not None
+        time.sleep(0.05)
+        assert read_pty(master) == b''
+
+        kiss.write_frames_to_radio()
+        time.sleep(0.05)
+        assert KissDecoder().feed(read_pty(master)) == [b'\x00one', b'\x00two', b'\x00three']
+        assert kiss.frames_per_flush == {3: 1}
+        assert kiss.flush_deadline() is None
+    finally:
+        kiss.close()
+        os.close(master)
+        os.close(slave)
+
+
+def test_writes_at_once_when_byte_cap_is_reached():
+    kiss, master, slave = open_kiss(linger=10.0, max_write_bytes=8)
+    try:
+        kiss.write_data_frames([b'x' * 8])
+        time.sleep(0.05)
+        assert read_pty(master) == FEND + b'\x00' + b'x' * 8 + FEND
+        assert kiss.write_counters['flushes'] == 1
+    finally:
+        kiss.close()
+        os.close(master)
+        os.close(slave)
+
+
+def test_io_thread_in_both_directions():
+    kiss, master, slave = open_kiss(io_thread=True)
+    thread = kiss.io_thread
+    try:
+        # To the radio: handed over to the thread through its deque and wakeup pipe.
+        kiss.write_data_frames([b'up1', b'up2'])
+        kiss.write_frames_to_radio()
+        deadline = time.monotonic() + 2
+        received = b''
+        while len(KissDecoder().feed(received)) < 2 and time.monotonic() < deadline:
+            received += read_pty(master)
+            time.sleep(0.01)
+        assert KissDecoder().feed(received) == [b'\x00up1', b'\x00up2']
+
+        # From the radio: decoded by the thread, which makes fileno() readable.
+        before = time.monotonic_ns()
+        os.write(master, FEND + b'\x00down1' + FEND + FEND + b'\x00down' + FESC + TFEND + FEND)
+        assert select.select([kiss.fileno()], [], [], 2)[0]
+        frames = []
+        while len(frames) < 2 and time.monotonic() < deadline:
+            frames += kiss.read_timed_frames()
+            time.sleep(0.01)
+        assert [frame for _, frame in frames] == [b'\x00down1', b'\x00down' + FEND]
+        assert all(before <= read_ns <= time.monotonic_ns() for read_ns, _ in frames)
+        assert kiss.read_frames() == []
+
+        # Frames queued just before closing are still written.
+        kiss.write_data_frames([b'last'])
+        kiss.write_frames_to_radio()
+    finally:
+        kiss.close()
+    try:
+        assert not thread.is_alive()
+        time.sleep(0.05)
+        assert KissDecoder().feed(read_pty(master)) == [b'\x00last']
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+@pytest.mark.parametrize('mode', [{}, {'io_thread': True}, {'io_process': True}])
+def test_in_waiting_in_every_io_mode(mode):
+    kiss, master, slave = open_kiss(**mode)
+    try:
+        assert kiss.in_waiting() == 0
+        os.write(master, FEND + b'\x00down' + FEND)
+        deadline = time.monotonic() + 5
+        while not kiss.in_waiting() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert kiss.in_waiting() >= 3
+        frames = []
+        while not frames and time.monotonic() < deadline:
+            frames = kiss.read_frames()
+        assert frames == [b'\x00down']
+        assert kiss.in_waiting() == 0
+    finally:
+        kiss.close()
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,54 @@
+"""
+Tests for the logging helpers
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from sat2rf1_tcpserver.logs import Payload, RateLimitFilter
+
+
+def make_record(per_frame=True, lineno=1):
+    record = logging.LogRecord('test', logging.DEBUG, 'test.py', lineno, 'frame %d', (1,), None)
+    record.per_frame = per_frame
+    return record
+
+
+def test_payload_is_truncated_when_formatted():
+    assert str(Payload(b'\x01\x02')) == '0102'
+    assert str(Payload(memoryview(b'\xff' * 40), limit=2)) == 'ffff... (40 bytes)'
+
+
+def test_rate_limit_drops_per_frame_messages_beyond_burst():
+    now = [0.0]
+    log_filter = RateLimitFilter(burst=2, interval=1.0, clock=lambda: now[0])
+    assert [log_filter.filter(make_record()) for _ in range(4)] == [True, True, False, False]
+    # Other lines and other messages have their own limits.
+    assert log_filter.filter(make_record(lineno=2))
+    assert all(log_filter.filter(make_record(per_frame=False)) for _ in range(4))
+
+    now[0] = 1.0
+    record = make_record()
+    assert log_filter.filter(record)
+    assert record.getMessage() == 'frame 1 (2 similar message(s) suppressed)'
@@ -0,0 +1,70 @@
+"""
+Tests for the metrics registry
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sat2rf1_tcpserver.metrics import Histogram, Registry
+
+
+def test_histogram_percentiles():
+    histogram = Histogram('latency', 'Latency.')
+    assert histogram.percentile(50) is None
+    for microseconds in range(1, 1001):
+        histogram.record(microseconds * 1e-6)
+    assert histogram.count == 1000
+    assert histogram.sum == pytest.approx(0.5005)
+    for percent in (1, 50, 99, 100):
+        expected = percent * 10e-6
+        assert expected <= histogram.percentile(percent) <= expected * (1 + 1 / 16) + 1e-9
+
+
+def test_histogram_bucket_bounds():
+    # Every value falls in the bucket whose bounds enclose it.
+    for value in list(range(100)) + [2 ** n + k for n in range(5, 40) for k in (-1, 0, 1)]:
+        index = Histogram._index(value)
+        assert value < Histogram._upper_bound(index)
+        assert index == 0 or value >= Histogram._upper_bound(index - 1)
+
+
+def test_render():
+    registry = Registry()
+    frames = {'data': 3}
+    registry.counter('frames_total', 'Frames.', {'port': 'data'}, lambda: frames['data'])
+    registry.counter('frames_total', 'Frames.', {'port': 'settings'}).inc(2)
+    registry.gauge('queue', 'Queue depth.').set(1.5)
+    histogram = registry.histogram('latency_seconds', 'Latency.')
+    histogram.record(0.003)
+    histogram.record(20)
+    lines = registry.render().splitlines()
+    assert lines[:4] == ['# HELP frames_total Frames.', '# TYPE frames_total counter',
+                         'frames_total{port="data"} 3', 'frames_total{port="settings"} 2']
+    assert 'queue 1.5' in lines
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'latency_seconds_bucket{le="0.005"} 1' in lines
+    assert 'latency_seconds_bucket{le="30.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'latency_seconds_count 2' in lines
@@ -0,0 +1,52 @@
+"""
+Tests for the radio settings cache
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+from sat2rf1_tcpserver.radio_state import RadioState
+from sat2rf1_tcpserver.sat2rf1_constants import GET_FREQUENCY, GET_MODE, SET_FREQUENCY, SET_POWER
+
+
+
+def test_values_age_and_go_stale(clock):
+    state = RadioState(clock)
+    assert state.get('frequency') is None
+    state.handle_response(GET_FREQUENCY, 435000000)
+    state.handle_response(GET_MODE, b'\x01')
+    clock.now += 4
+    assert state.get('frequency') == (435000000, 4)
+    assert state.snapshot() == {'frequency': (435000000, 4), 'mode': (1, 4)}
+    assert state.stale(5) == ['power', 'corr_coef']
+    clock.now += 2
+    assert state.stale(5) == ['frequency', 'power', 'mode', 'corr_coef']
+
+
+def test_acknowledged_set_invalidates_value(clock):
+    state = RadioState(clock)
+    state.handle_response(GET_FREQUENCY, 435000000)
+    # An error code leaves the cached value as it was.
+    assert state.handle_response(SET_FREQUENCY, 3) is None
+    assert state.get('frequency') is not None
+    assert state.handle_response(SET_FREQUENCY, 0) == 'frequency'
+    assert state.get('frequency') is None
+    assert state.handle_response(SET_POWER, 0) == 'power'
@@ -0,0 +1,61 @@
+"""
+Tests for replaying capture files
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.capture import FRAME, FROM_RADIO, RAW, TO_RADIO, Record
+from sat2rf1_tcpserver.replay import data_payloads, replay, serial_chunks
+
+
+def test_serial_chunks_prefer_raw_bytes():
+    records = [Record(1, FROM_RADIO, RAW, b'\xc0\x00ab'), Record(2, FROM_RADIO, FRAME, b'\x00ab'),
+               Record(3, TO_RADIO, RAW, b'\xc0\x00cd\xc0')]
+    assert serial_chunks(records) == [(1, b'\xc0\x00ab')]
+    # Without raw bytes, the frames are encoded again.
+    assert serial_chunks(records[1:2]) == [(2, b'\xc0\x00ab\xc0')]
+
+
+def test_data_payloads_decode_raw_bytes():
+    records = [Record(1, TO_RADIO, RAW, b'\xc0\x00ab\xc0\xc0\x10\x01'), Record(2, TO_RADIO, RAW, b'\xc0\xc0\x00\xdb'),
+               Record(3, TO_RADIO, RAW, b'\xdc\xc0')]
+    # The command frame (0x10) is not a payload.
+    assert data_payloads(records) == [(1, b'ab'), (3, b'\xc0')]
+
+
+def test_replay_paces_by_speed():
+    now = [0.0]
+    sent = []
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    def send(data):
+        sent.append((now[0], data))
+
+    items = [(1000000000, b'a'), (1500000000, b'b'), (3000000000, b'c')]
+    assert replay(items, send, speed=2.0, clock=lambda: now[0], sleep=sleep) == 3
+    assert sent == [(0.0, b'a'), (0.25, b'b'), (1.0, b'c')]
+    sent.clear()
+    assert replay(items, send, speed=None) == 3
+    assert sent == [(1.0, b'abc')]
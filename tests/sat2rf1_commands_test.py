@@ -0,0 +1,97 @@
+"""
+Tests for the radio command engine
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from sat2rf1_tcpserver.sat2rf1_commands import CommandFailed, CommandTimeout
+from sat2rf1_tcpserver.sat2rf1_constants import GET_FREQUENCY, GET_POWER, SET_FREQUENCY
+
+
+
+def test_matches_responses_to_requests_in_order(engine, written):
+    first, second = engine.submit_many([(GET_FREQUENCY, b'f1'), (GET_FREQUENCY, b'f2')])
+    power = engine.submit(GET_POWER, b'p')
+    assert written == [[b'f1', b'f2'], [b'p']]
+    assert engine.handle_response(GET_POWER, b'\xfb')
+    assert engine.handle_response(GET_FREQUENCY, (435000000).to_bytes(4, 'big'))
+    assert engine.handle_response(GET_FREQUENCY, (436000000).to_bytes(4, 'big'))
+    assert (first.result(), second.result(), power.result()) == (435000000, 436000000, -5)
+    assert not engine.handle_response(GET_FREQUENCY, b'\x00\x00\x00\x00')
+    assert len(engine) == 0 and engine.next_deadline() is None
+
+
+def test_failed_set(engine):
+    future = engine.submit(SET_FREQUENCY, b's')
+    engine.handle_response(SET_FREQUENCY, b'\x01')
+    with pytest.raises(CommandFailed):
+        future.result()
+
+
+def test_retries_then_times_out(engine, written, clock):
+    future = engine.submit(GET_FREQUENCY, b'f')
+    assert engine.next_deadline() == 100.5
+    clock.now = 100.4
+    engine.expire()
+    assert written == [[b'f']]
+    for deadline in (101.0, 101.5):
+        clock.now = engine.next_deadline()
+        engine.expire()
+        assert engine.next_deadline() == deadline
+    assert written == [[b'f'], [b'f'], [b'f']]
+    clock.now = 101.5
+    engine.expire()
+    with pytest.raises(CommandTimeout):
+        future.result()
+    assert len(engine) == 0
+
+
+def test_late_answers_to_retried_request_are_not_matched_to_the_next(engine, written, clock):
+    first = engine.submit(SET_FREQUENCY, b's1')
+    clock.now = 100.5
+    engine.expire()  # First request written again
+    second = engine.submit(SET_FREQUENCY, b's2')
+    assert written == [[b's1'], [b's1'], [b's2']]
+    # The late answer to the first attempt resolves the first request, and
+    # the answer to its retry is dropped rather than resolving the second.
+    engine.handle_response(SET_FREQUENCY, b'\x00')
+    assert first.done() and not second.done()
+    assert engine.handle_response(SET_FREQUENCY, b'\x00')
+    assert not second.done()
+    engine.handle_response(SET_FREQUENCY, b'\x00')
+    assert second.result() == 0
+
+
+def test_stale_answers_are_only_expected_for_one_timeout(engine, clock):
+    first = engine.submit(GET_FREQUENCY, b'f1')
+    clock.now = 100.5
+    engine.expire()
+    engine.handle_response(GET_FREQUENCY, b'\x00\x00\x00\x01')
+    assert first.result() == 1
+    # The retry was never answered; well after it would have timed out,
+    # answers go to new requests again.
+    clock.now = 102.0
+    second = engine.submit(GET_FREQUENCY, b'f2')
+    engine.handle_response(GET_FREQUENCY, b'\x00\x00\x00\x02')
+    assert second.result() == 2
@@ -0,0 +1,82 @@
+"""
+Tests for the Sat2rf1 radio interface
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import os
+import struct
+import tty
+
+from sat2rf1_tcpserver.connection import Connection
+from sat2rf1_tcpserver.core import Gateway
+from sat2rf1_tcpserver.framing import framer_factory
+from sat2rf1_tcpserver.kiss_constants import FEND
+from sat2rf1_tcpserver.sat2rf1 import Sat2rf1
+
+
+async def receive(gateway, master, bursts):
+    task = asyncio.ensure_future(gateway.run())
+    try:
+        reader, writer = await asyncio.open_connection(*gateway.data_socket.lsock.getsockname())
+        while not gateway.data_socket.clients():
+            await asyncio.sleep(0.01)
+        for burst in bursts:
+            os.write(master, b''.join(FEND + b'\x00' + frame + FEND for frame in burst))
+            await asyncio.sleep(0.02)
+        received = []
+        for _ in range(sum(len(burst) for burst in bursts)):
+            length, = struct.unpack('>H', await asyncio.wait_for(reader.readexactly(2), 2))
+            received.append(await reader.readexactly(length))
+        writer.close()
+        return received
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def test_frames_from_several_reads_reach_the_client_in_order():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    radio = Sat2rf1(os.ttyname(slave))
+    settings_socket = Connection('127.0.0.1', 0, True, framing=framer_factory('line'))
+    data_socket = Connection('127.0.0.1', 0, framing=framer_factory('length'))
+    try:
+        # One read per cycle; whatever is left is picked up when the port is readable again.
+        radio.max_reads_per_cycle = 1
+        gateway = Gateway(radio, settings_socket, data_socket)
+        bursts = [[b'frame%d' % i for i in range(start, start + 4)] for start in (0, 4, 8)]
+        received = asyncio.run(receive(gateway, master, bursts))
+
+        assert received == [frame for burst in bursts for frame in burst]
+        assert radio.counters['frames_received'] == 12
+        assert gateway.downlink_latency.count == 12
+    finally:
+        radio.kiss.close()
+        settings_socket.lsock.close()
+        data_socket.lsock.close()
+        os.close(master)
+        os.close(slave)
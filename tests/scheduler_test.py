@@ -0,0 +1,72 @@
+"""
+Tests for the transmit scheduler
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.scheduler import TransmitScheduler
+
+
+def payloads(released):
+    return [payload for payload, _ in released]
+
+
+def make_scheduler(**kwargs):
+    # 800 bits per second and no overhead: 100 bytes of airtime per second.
+    return TransmitScheduler(air_bitrate=800, frame_overhead=0, clock=lambda: 0.0, **kwargs)
+
+
+def test_releases_only_what_fits_in_radio_buffer():
+    scheduler = make_scheduler(radio_buffer=250)
+    scheduler.submit([b'a' * 100, b'b' * 100], received_at=-1.0)
+    scheduler.submit([b'c' * 100])
+    assert scheduler.release(now=0.0) == [(b'a' * 100, -1.0), (b'b' * 100, -1.0)]
+    assert scheduler.buffered(now=0.0) == 200
+    # The third frame fits once 50 bytes have gone out on air.
+    assert scheduler.next_release() == 0.5
+    assert payloads(scheduler.release(now=0.4)) == []
+    assert payloads(scheduler.release(now=0.5)) == [b'c' * 100]
+    assert scheduler.next_release() is None
+
+
+def test_oversized_frame_goes_out_when_radio_is_idle():
+    scheduler = make_scheduler(radio_buffer=50)
+    scheduler.submit([b'x' * 100, b'y'])
+    assert payloads(scheduler.release(now=0.0)) == [b'x' * 100]
+    assert payloads(scheduler.release(now=0.5)) == []
+    assert payloads(scheduler.release(now=1.0)) == [b'y']
+
+
+def test_received_frames_hold_up_waiting_frames():
+    scheduler = make_scheduler(radio_buffer=100)
+    scheduler.submit([b'a' * 100, b'b' * 100])
+    scheduler.release(now=0.0)
+    scheduler.received(50, now=0.5)
+    assert scheduler.next_release() == 1.5
+
+
+def test_refuses_frames_beyond_max_queue_bytes():
+    scheduler = make_scheduler(max_queue_bytes=150)
+    assert scheduler.submit([b'a' * 100, b'b' * 100, b'c']) == 1
+    assert scheduler.dropped == 2
+    assert len(scheduler) == 1
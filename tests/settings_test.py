@@ -0,0 +1,107 @@
+"""
+Tests for the settings port
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+from types import SimpleNamespace
+
+import pytest
+
+from sat2rf1_tcpserver.codec import encode_frame
+from sat2rf1_tcpserver.metrics import Registry
+from sat2rf1_tcpserver.sat2rf1_constants import GET_FREQUENCY, GET_POWER, SET_FREQUENCY, SET_POWER
+from sat2rf1_tcpserver.settings import SettingsHandler
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+
+    def send_batch(self, messages, data_pointer):
+        self.sent.extend(message.decode() for message in messages)
+
+
+@pytest.fixture
+def connection():
+    return FakeConnection()
+
+
+@pytest.fixture
+def handler(radio, connection):
+    return SettingsHandler(radio, connection)
+
+
+CLIENT = SimpleNamespace(addr=('127.0.0.1', 1234))
+
+
+def test_status_and_get_answer_from_cache(handler, radio, connection, clock):
+    radio.state.update('frequency', 435000000)
+    clock.now += 1.5
+    handler.handle(b'GET frequency', CLIENT)
+    handler.handle(b'get POWER', CLIENT)
+    assert connection.sent == ['frequency 435000000 1.500', 'OK', 'power unknown', 'OK']
+    connection.sent.clear()
+    handler.handle(b'STATUS', CLIENT)
+    assert connection.sent == ['frequency 435000000 1.500', 'power unknown', 'mode unknown', 'corr_coef unknown',
+                               'rssi unknown', 'OK']
+    assert radio.written == []
+
+
+def test_set_is_answered_once_acknowledged_and_read_back(handler, radio, connection):
+    radio.state.update('frequency', 435000000)
+    handler.handle(b'SET frequency 436000000', CLIENT)
+    assert radio.written == [encode_frame(SET_FREQUENCY, (436000000).to_bytes(4, 'big'))]
+    assert connection.sent == []
+    radio.respond(SET_FREQUENCY, b'\x00')
+    assert connection.sent == ['OK']
+    assert radio.written[-1] == encode_frame(GET_FREQUENCY)
+    handler.handle(b'GET frequency', CLIENT)
+    assert connection.sent[-2:] == ['frequency unknown', 'OK']
+    radio.respond(GET_FREQUENCY, (436000000).to_bytes(4, 'big'))
+    handler.handle(b'GET frequency', CLIENT)
+    assert connection.sent[-2:] == ['frequency 436000000 0.000', 'OK']
+
+
+def test_set_rejected_by_radio(handler, radio, connection):
+    handler.handle(b'SET power 10', CLIENT)
+    radio.respond(SET_POWER, b'\x02')
+    assert connection.sent == ['ERROR Command 0x22 failed with error code 2']
+    assert encode_frame(GET_POWER) not in radio.written
+
+
+def test_errors(handler, connection):
+    for line in (b'   ', b'GET volume', b'SET rssi 1', b'SET power loud', b'FROB', b'METRICS'):
+        handler.handle(line, CLIENT)
+    assert connection.sent == ['ERROR empty command', 'ERROR unknown setting volume', 'ERROR unknown setting rssi',
+                               'ERROR invalid value loud', 'ERROR unknown command', 'ERROR metrics disabled']
+    connection.sent.clear()
+    SettingsHandler(None, connection).handle(b'STATUS', CLIENT)
+    assert connection.sent == ['ERROR no radio']
+
+
+def test_metrics(connection):
+    handler = SettingsHandler(None, connection, Registry())
+    handler.metrics.counter('sat2rf1_test_total', 'Test.', {'radio': 'a'}, lambda: 3)
+    handler.handle(b'METRICS', CLIENT)
+    assert connection.sent == ['# HELP sat2rf1_test_total Test.', '# TYPE sat2rf1_test_total counter',
+                               'sat2rf1_test_total{radio="a"} 3', 'OK']
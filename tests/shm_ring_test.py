@@ -0,0 +1,63 @@
+"""
+Tests for the shared memory ring buffer
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.shm_ring import ShmRing
+
+
+def test_records_wrap_around():
+    producer = ShmRing(size=64)
+    consumer = ShmRing(producer.name)
+    try:
+        sent = []
+        received = []
+        for i in range(100):
+            records = [bytes([i]) * (i % 13), b'x' * (i % 7)]
+            count = producer.put_many(records)
+            sent += records[:count]
+            if i % 3:
+                received += consumer.get_all()
+        received += consumer.get_all()
+        assert received == sent
+        assert len(sent) > 100
+        assert len(producer) == 0
+    finally:
+        consumer.close()
+        producer.close()
+
+
+def test_refuses_records_that_do_not_fit():
+    producer = ShmRing(size=32)
+    consumer = ShmRing(producer.name)
+    try:
+        assert producer.put(b'a' * 20)
+        assert not producer.put(b'b' * 20)
+        assert producer.put_many([b'c' * 4, b'd' * 4, b'e']) == 1
+        assert consumer.get_all() == [b'a' * 20, b'c' * 4]
+        assert producer.put(b'b' * 20)
+        assert consumer.get_all() == [b'b' * 20]
+    finally:
+        consumer.close()
+        producer.close()
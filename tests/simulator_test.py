@@ -0,0 +1,82 @@
+"""
+Tests for the simulated radio
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import select
+import time
+
+from sat2rf1_tcpserver.codec import encode_frame
+from sat2rf1_tcpserver.kiss import KissDecoder
+from sat2rf1_tcpserver.sat2rf1_constants import DATA_FRAME, GET_FREQUENCY, SET_FREQUENCY
+from sat2rf1_tcpserver.simulator import DOWNLINK_HEADER, RadioSimulator
+
+
+def read_frames(fd, decoder, count, timeout=2.0):
+    frames = []
+    deadline = time.monotonic() + timeout
+    while len(frames) < count and time.monotonic() < deadline:
+        if select.select([fd], [], [], max(deadline - time.monotonic(), 0))[0]:
+            frames += decoder.feed(os.read(fd, 4096))
+    return frames
+
+
+def test_answers_commands_and_sends_data():
+    simulator = RadioSimulator()
+    uplink = []
+    simulator.on_uplink = lambda payload, sent_ns: uplink.append(payload)
+    simulator.start()
+    fd = os.open(simulator.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        os.write(fd, encode_frame(SET_FREQUENCY, (436000000).to_bytes(4, 'big')) + encode_frame(GET_FREQUENCY) +
+                 encode_frame(SET_FREQUENCY, (500000000).to_bytes(4, 'big')) + encode_frame(DATA_FRAME, b'hello'))
+        frames = read_frames(fd, KissDecoder(), 3)
+        assert frames == [SET_FREQUENCY + b'\x00', GET_FREQUENCY + (436000000).to_bytes(4, 'big'),
+                          SET_FREQUENCY + b'\x01']
+        deadline = time.monotonic() + 2
+        while not uplink and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert uplink == [b'hello']
+        assert simulator.settings['frequency'] == 436000000
+    finally:
+        os.close(fd)
+        simulator.stop()
+
+
+def test_paces_downlink():
+    # 64 byte frames take 67 ms on air at 9600 bit/s, so 10 frames per second fit.
+    simulator = RadioSimulator(air_bitrate=9600, downlink_rate=10, downlink_size=64)
+    simulator.start()
+    fd = os.open(simulator.port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        frames = read_frames(fd, KissDecoder(), 4)
+    finally:
+        os.close(fd)
+        simulator.stop()
+    assert len(frames) == 4
+    headers = [DOWNLINK_HEADER.unpack_from(frame, 1) for frame in frames]
+    assert [frame[:1] for frame in frames] == [DATA_FRAME] * 4
+    assert [sequence for sequence, _ in headers] == [0, 1, 2, 3]
+    gaps = [(later - earlier) / 1e9 for (_, earlier), (_, later) in zip(headers, headers[1:])]
+    assert all(0.08 < gap < 0.15 for gap in gaps)
@@ -0,0 +1,82 @@
+"""
+Tests for the downlink spool
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+from sat2rf1_tcpserver.spool import Spool
+
+
+def test_spool_replays_in_order_across_segments(tmp_path):
+    spool = Spool(tmp_path, segment_size=64)
+    frames = [bytes([i]) * 10 for i in range(20)]
+    for frame in frames:
+        spool.append(frame)
+    assert len(spool) == 20
+    assert len(list(tmp_path.glob('*.seg'))) > 1
+
+    replayed = [bytes(frame) for frame in spool.read(7)]
+    replayed += [bytes(frame) for frame in spool.read(100)]
+    assert replayed == frames
+    assert len(spool) == 0
+    assert spool.read(10) == []
+
+
+def test_spool_resumes_after_restart(tmp_path):
+    spool = Spool(tmp_path, segment_size=64)
+    for i in range(10):
+        spool.append(bytes([i]) * 10)
+    assert [bytes(frame) for frame in spool.read(3)] == [bytes([i]) * 10 for i in range(3)]
+    spool.close()
+
+    spool = Spool(tmp_path, segment_size=64)
+    assert len(spool) == 7
+    assert [bytes(frame) for frame in spool.read(100)] == [bytes([i]) * 10 for i in range(3, 10)]
+
+
+def test_spool_drops_oldest_segments_beyond_max_size(tmp_path):
+    spool = Spool(tmp_path, segment_size=64, max_size=200)
+    for i in range(50):
+        spool.append(bytes([i]) * 10)
+    frames = [bytes(frame) for frame in spool.read(100)]
+    assert len(frames) == len(set(frames)) < 50
+    assert frames[-1] == bytes([49]) * 10
+
+
+def test_spool_drops_truncated_tail_after_restart(tmp_path):
+    spool = Spool(tmp_path, segment_size=1024)
+    for i in range(3):
+        spool.append(bytes([i]) * 10)
+    spool.close()
+    # A crash in the middle of an append leaves a record longer than the file.
+    segment = next(tmp_path.glob('*.seg'))
+    complete = segment.stat().st_size
+    with open(segment, 'ab') as f:
+        f.write(b'\x00\x00\x00\x0a' + b'\xff' * 4)
+
+    spool = Spool(tmp_path, segment_size=1024)
+    assert len(spool) == 3
+    assert segment.stat().st_size == complete
+    spool.append(b'next')
+    assert [bytes(frame) for frame in spool.read(100)] == [bytes([i]) * 10 for i in range(3)] + [b'next']
+    assert len(spool) == 0
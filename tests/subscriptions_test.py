@@ -0,0 +1,65 @@
+"""
+Tests for data client subscriptions
+"""
+
+#  Copyright (c) 2020 Orbit NTNU (http://orbitntnu.no)
+#
+#  Authors:
+#  David Ferenc Bendiksen
+#  Joakim Skogø Langvand <jlangvand@gmail.com>
+#  Sander Aakerholt
+#
+#  This file is part of Sat2rf1-tcpserver.
+#
+#  Sat2rf1-tcpserver is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Sat2rf1-tcpserver is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Sat2rf1-tcpserver.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sat2rf1_tcpserver.subscriptions import CONTROL_PREFIX, Subscriptions, SubscriptionError, parse_key
+
+
+def ui_frame(destination, source):
+    field = b''
+    for index, (callsign, ssid) in enumerate((destination, source)):
+        field += bytes(byte << 1 for byte in callsign.ljust(6).encode()) + bytes([0x60 | ssid << 1 | index])
+    return field + b'\x03\xf0hello'
+
+
+def test_parse_key():
+    assert parse_key('src', 'la1ngs') == ('src', 'LA1NGS', None)
+    assert parse_key('DST', 'LA1NGS-15') == ('dst', 'LA1NGS', 15)
+    assert parse_key('pid', '0xF0') == ('pid', 0xF0)
+    for field, value in (('src', 'LA1NGS-16'), ('src', 'TOOLONGCALL'), ('pid', '256'), ('via', 'CQ')):
+        with pytest.raises(SubscriptionError):
+            parse_key(field, value)
+
+
+def test_match():
+    subscriptions = Subscriptions()
+    subscriptions.handle(CONTROL_PREFIX + b'SUBSCRIBE src LA1NGS', 'a')
+    subscriptions.handle(CONTROL_PREFIX + b'SUBSCRIBE dst CQ-1', 'b')
+    subscriptions.handle(CONTROL_PREFIX + b'SUBSCRIBE pid 0xcf', 'b')
+    assert 'a' in subscriptions and 'c' not in subscriptions
+    assert subscriptions.match(ui_frame(('CQ', 0), ('LA1NGS', 3))) == {'a'}
+    assert subscriptions.match(ui_frame(('CQ', 1), ('LA1NGS', 0))) == {'a', 'b'}
+    assert subscriptions.match(ui_frame(('CQ', 0), ('LA2NGS', 0))) == set()
+    assert subscriptions.match(b'not ax.25') == set()
+
+    subscriptions.handle(CONTROL_PREFIX + b'UNSUBSCRIBE dst CQ-1', 'b')
+    assert subscriptions.match(ui_frame(('CQ', 1), ('LA1NGS', 0))) == {'a'}
+    subscriptions.handle(CONTROL_PREFIX + b'UNSUBSCRIBE', 'a')
+    subscriptions.remove('b')
+    assert not subscriptions
+    with pytest.raises(SubscriptionError):
+        subscriptions.handle(CONTROL_PREFIX + b'SUBSCRIBE src', 'a')